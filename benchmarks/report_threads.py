@@ -0,0 +1,104 @@
+"""
+File: report_threads.py
+
+Benchmarks building monthly reports one after another against building
+them in parallel threads, each with a reader from the connection pool.
+
+    python benchmarks/report_threads.py --transactions 200000 --threads 4
+
+Two workloads are timed: the account totals of each report, which is
+all SQLite work and runs in parallel (sqlite3 releases the GIL while a
+query runs), and the full report data, where building the Python
+objects for every transaction holds the GIL and limits the speedup.
+Threads can only help with as many CPUs as there are to run them.
+"""
+
+from __future__ import print_function
+import argparse
+import concurrent.futures
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from oink import db, migrations, transactions
+from oink.reporting import reports
+
+
+def build_ledger(num_accounts, num_transactions):
+    cur = db.cursor()
+    cur.executemany('INSERT INTO accounts (account_number, name, balance, created_at) VALUES (?, ?, ?, ?)',
+                    [(str(1000 + i), 'Account {}'.format(i), 0, '2018-01-01 00:00:00') for i in range(num_accounts)])
+    rand = random.Random(42)
+    rows = ((rand.randint(1, num_accounts), rand.choice((transactions.DEPOSIT_ID, transactions.WITHDRAWAL_ID)),
+             'Transaction {}'.format(i), rand.randint(100, 100000),
+             '2018-{:02d}-{:02d} 12:00:00'.format(rand.randint(1, 12), rand.randint(1, 28)))
+            for i in range(num_transactions))
+    cur.executemany('INSERT INTO transactions (account_id, transaction_type_id, description, amount, created_at) \
+        VALUES (?, ?, ?, ?, ?)', rows)
+    db.commit()
+
+
+def _period(month):
+    return '2018-{:02d}-01'.format(month), '2018-{:02d}-31'.format(month)
+
+
+def account_totals(month):
+    from_date, to_date = _period(month)
+    with db.pool.reader():
+        return db.cursor().execute(reports.ACCOUNT_TOTALS_QUERY,
+            reports.query_params(from_date, to_date)).fetchall()
+
+
+def report_data(month):
+    with db.pool.reader():
+        data = reports.generate_report_data(*_period(month), money=lambda value: value)
+    return sum(len(acct['transactions']) for acct in data['accounts'].values())
+
+
+def compare(name, build, months, threads):
+    started = time.perf_counter()
+    serial = [build(month) for month in months]
+    serial_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        threaded = list(executor.map(build, months))
+    threaded_time = time.perf_counter() - started
+
+    assert serial == threaded
+    print('{}:'.format(name))
+    print('  one at a time: {:8.1f} ms'.format(serial_time * 1000))
+    print('  {} threads:     {:8.1f} ms ({:.2f}x)'.format(threads, threaded_time * 1000, serial_time / threaded_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--reports', type=int, default=12, help='one report per month, cycling through the year')
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp()
+    try:
+        db.connect(path, {'poolSize': args.threads})
+        migrations.migrate()
+        build_ledger(args.accounts, args.transactions)
+        months = [i % 12 + 1 for i in range(args.reports)]
+
+        print('{} reports over {} transactions, {} CPU(s)'.format(
+            args.reports, args.transactions, os.cpu_count()))
+        compare('Account totals', account_totals, months, args.threads)
+        compare('Report data', report_data, months, args.threads)
+    finally:
+        db.disconnect()
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
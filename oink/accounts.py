@@ -9,31 +9,12 @@ import re
 from datetime import datetime
 import locale
 
-# 3rd-Party module for tabular console output
-from tabulate import tabulate
-
 from . import db, utils
+from .utils import tabulate
 from .colorize import colorize, colorize_headers, colorize_list
 from .colorize import color_input, color_error, color_info, color_success
 
 
-def setup():
-    """
-    Initial database setup; creates the `accounts` table
-    """
-    locale.setlocale(locale.LC_ALL, '')
-    cur = db.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS accounts (
-            id integer NOT NULL PRIMARY KEY,
-            account_number text NOT NULL,
-            name text NOT NULL UNIQUE,
-            balance integer NOT NULL,
-            created_at text NOT NULL);
-        ''')
-    db.commit()
-
-
 def list_accounts():
     """
     Handler to list all accounts in the `accounts` table
@@ -99,8 +80,7 @@ def rename():
 
         # Verify successfulness
         if cur.rowcount == 0:
-            print(color_error('[error]') + ' Failed to rename the account.')
-            return
+            return 'Failed to rename the account.'
 
         # Save the changes to the database
         db.commit()
@@ -181,9 +161,7 @@ def delete(account_id):
         cur.execute('SELECT COUNT(*) FROM accounts WHERE id = ?', (account_id,))
         count = cur.fetchone()[0]
         if count == 0:
-            print(color_error('[error]') + \
-                ' No account was found by the ID `{}`'.format(account_id))
-            return
+            return 'No account was found by the ID `{}`'.format(account_id)
 
         # Confirm deletion
         conf = input(color_input('Are you sure you want to delete this account? [y/n] '))
@@ -196,9 +174,7 @@ def delete(account_id):
 
         # Verify successfulness
         if cur.rowcount == 0:
-            print(color_error('[error]') + \
-                ' Failed to delete the account (ID: {})'.format(account_id))
-            return
+            return 'Failed to delete the account (ID: {})'.format(account_id)
 
         print(color_success('Deleted account (ID: {})'.format(account_id)))
         db.commit()
@@ -243,6 +219,10 @@ def set_balance(acct, new_balance):
     """
     cur = db.cursor()
 
+    # Balances otherwise only change along with transactions, so the
+    # triggers keeping the ledger change tokens leave them out
+    cur.execute("REPLACE INTO ledger_changes (month, token) VALUES ('', random())")
+
     if isinstance(acct, str):
         # Find by account name
         cur.execute('UPDATE accounts SET balance = ? WHERE name = ?', (new_balance, acct))
@@ -263,6 +243,22 @@ def set_balance(acct, new_balance):
     return None
 
 
+def post(account_id, delta):
+    """
+    Posts a balance change of `delta` to account `account_id`.
+    The change is applied atomically by SQLite, so concurrent postings
+    to the same account cannot overwrite one another.
+    Returns True if the account was found; otherwise False.
+    """
+    cur = db.cursor()
+    cur.execute('UPDATE accounts SET balance = balance + ? WHERE id = ?', (delta, account_id))
+    if cur.rowcount == 0:
+        print(color_error('[error]') + \
+            ' No account was found by the ID `{}`'.format(account_id))
+        return False
+    return True
+
+
 def exists(acct):
     """
     Helper function to check if an account exists
@@ -0,0 +1,249 @@
+"""
+File: aio.py
+
+Asyncio facade over Oink's data access, for embedding Oink in async
+services without blocking their event loop.
+
+A `Database` owns a worker thread with its own connection to oink.db.
+Awaiting one of its methods queues the call for the worker and suspends
+the caller until it is done, so any number of queries can be awaited
+concurrently. Writes waiting in the queue together are run as a batch in
+a single transaction (one commit), each in its own savepoint so that a
+failing write doesn't undo the others.
+
+    async with aio.Database(path) as database:
+        checking, savings = await asyncio.gather(
+            database.accounts.get(1), database.accounts.get(2))
+        await database.transactions.create(1, 'Rent', transactions.WITHDRAWAL_ID, 120000)
+"""
+
+import asyncio
+import functools
+import queue
+import threading
+
+from . import db, accounts, budget, category, transactions
+
+
+# Most writes committed together in one transaction
+BATCH_SIZE = 100
+
+# Queued to stop the worker thread
+_STOP = object()
+
+# The helpers available through `Database`, by module:
+# {attribute: (module, {function name: whether it writes})}
+HELPERS = {
+    'accounts': (accounts, {
+        'get': False,
+        'all': False,
+        'exists': False,
+        'get_balance': False,
+        'add_account': True,
+        'post': True,
+    }),
+    'transactions': (transactions, {
+        'list_for_account': False,
+        'page': False,
+        'create': True,
+    }),
+    'category': (category, {
+        'get': False,
+        'get_by_name': False,
+        'exists': False,
+        'create': True,
+        'update': True,
+    }),
+    'budget': (budget, {
+        'list_for_account': False,
+        'list_for_period': False,
+        'evaluate_month': False,
+        'get_balance': False,
+        'create': True,
+    }),
+}
+
+
+class _Job(object):
+    def __init__(self, function, args, kwargs, writes, loop, future):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.writes = writes
+        self.loop = loop
+        self.future = future
+
+    def run(self):
+        return self.function(*self.args, **self.kwargs)
+
+    def finish(self, result=None, error=None):
+        self.loop.call_soon_threadsafe(_resolve, self.future, result, error)
+
+
+def _resolve(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class _Helpers(object):
+    """
+    The helpers of one module, as coroutine functions run by a `Database`.
+    """
+    def __init__(self, database, module, functions):
+        self._database = database
+        self._module = module
+        self._functions = functions
+
+    def __getattr__(self, name):
+        if name not in self._functions:
+            raise AttributeError('{} has no async helper `{}`'.format(self._module.__name__, name))
+        function = getattr(self._module, name)
+        run = self._database.write if self._functions[name] else self._database.run
+        return functools.partial(run, function)
+
+
+class Database(object):
+    """
+    Runs Oink's data access on a dedicated worker thread with its own
+    connection to the oink.db database in the folder at `path`.
+    `profile` is the connection profile (see db.open_connection()).
+
+    Use as an async context manager, or call `start()` and `close()`.
+    The helpers of each module are available as coroutine functions,
+    e.g. `await database.accounts.get(1)`; see `HELPERS`.
+    """
+    def __init__(self, path, profile=None, batch_size=BATCH_SIZE):
+        self.path = path
+        self.profile = profile
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        for name, (module, functions) in HELPERS.items():
+            setattr(self, name, _Helpers(self, module, functions))
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        """
+        Starts the worker thread and waits for it to connect.
+        Raises whatever opening the connection raised.
+        """
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        self._thread = threading.Thread(target=self._work, args=(loop, ready), name='oink-aio', daemon=True)
+        self._thread.start()
+        try:
+            await ready
+        except BaseException:
+            self._thread = None
+            raise
+
+    async def close(self):
+        """
+        Finishes the queued work, then stops the worker thread and closes its connection.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+        self._thread = None
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Calls `function(*args, **kwargs)` on the worker thread, where it
+        can use the db module as usual, and returns its result.
+        """
+        return await self._submit(function, args, kwargs, False)
+
+    async def write(self, function, *args, **kwargs):
+        """
+        Like `run()`, but the call may be batched with other writes queued
+        at the same time and is only done once the batch is committed.
+        """
+        return await self._submit(function, args, kwargs, True)
+
+    async def execute(self, sql, params=()):
+        """
+        Runs a read query, returning all of its rows.
+        """
+        return await self.run(_fetchall, sql, params)
+
+    async def _submit(self, function, args, kwargs, writes):
+        if self._thread is None:
+            raise RuntimeError('The database has not been started')
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put(_Job(function, args, kwargs, writes, loop, future))
+        return await future
+
+    def _work(self, loop, ready):
+        try:
+            connection = db.open_connection(self.path, self.profile)
+        except Exception as err:
+            loop.call_soon_threadsafe(_resolve, ready, None, err)
+            return
+        loop.call_soon_threadsafe(_resolve, ready, None, None)
+
+        with db.bind(connection):
+            job = self._queue.get()
+            while job is not _STOP:
+                if job.writes:
+                    batch, job = self._gather(job)
+                    self._write(batch)
+                else:
+                    try:
+                        job.finish(job.run())
+                    except Exception as err:
+                        job.finish(error=err)
+                    job = None
+                if job is None:
+                    job = self._queue.get()
+        connection.close()
+
+    def _gather(self, job):
+        """
+        The batch of writes queued up from `job` on, and the job queued
+        after them (or None if there is nothing else queued yet).
+        """
+        batch = [job]
+        while len(batch) < self.batch_size:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return batch, None
+            if job is _STOP or not job.writes:
+                return batch, job
+            batch.append(job)
+        return batch, None
+
+    def _write(self, batch):
+        outcomes = []
+        try:
+            with db.transaction():
+                for job in batch:
+                    try:
+                        with db.transaction():
+                            outcomes.append((job, job.run(), None))
+                    except Exception as err:
+                        outcomes.append((job, None, err))
+        except Exception as err:
+            # The commit failed, taking every write in the batch with it
+            for job in batch:
+                job.finish(error=err)
+            return
+
+        for job, result, error in outcomes:
+            job.finish(result, error)
+
+
+def _fetchall(sql, params):
+    return db.cursor().execute(sql, params).fetchall()
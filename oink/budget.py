@@ -4,28 +4,116 @@ File: budget.py
 
 from __future__ import print_function
 import datetime
+import json
 import locale
 
-from tabulate import tabulate
-
 from . import db, utils, category, accounts, transactions
+from .utils import tabulate
 from .colorize import color_error, color_info, color_input, color_success, colorize_headers, colorize, colorize_list
 
 
+# Evaluates budgets in a single pass: every budget row is joined against the
+# monthly totals of its account/category for its month (see totals.py), a
+# row per transaction type, and the deposits and withdrawals are summed up
+# by SQLite rather than in Python.
+# See `_evaluate_query()` for how the placeholders get filled in.
+EVALUATE_QUERY = '''
+    SELECT b.id, b.account_id, c.id, c.name, b.amount, b.year, b.month, b.created_at,
+        a.name,
+        b.amount + COALESCE(SUM(CASE m.type
+            WHEN {deposit} THEN m.total
+            WHEN {withdrawal} THEN -m.total
+            ELSE 0 END), 0) AS balance
+    FROM budgets b
+    LEFT JOIN accounts a ON b.account_id = a.id
+    LEFT JOIN categories c ON b.category_id = c.id
+    LEFT JOIN monthly_totals m ON m.account_id = b.account_id
+        AND m.year = b.year
+        AND m.month = b.month
+        AND m.category_id = b.category_id
+    WHERE {where}
+    GROUP BY b.id
+    ORDER BY {order}
+    '''
+
+
 class Budget(object):
-    def __init__(self, id, account_id, category_id, category_name, amount, year, month, created_at):
+    def __init__(self, id, account_id, category_id, category_name, amount, year, month, created_at, account_name=None, balance=None):
         self.id = id
         self.account_id = account_id
+        self.account_name = account_name
         self.category = category.Category(category_id, category_name)
         self.amount = amount
         self.year = year
         self.month = month
         self.created_at = created_at
-        self.balance = get_balance(self)
+        self._balance = balance
 
+    @property
+    def balance(self):
+        """
+        The budget amount less the transactions made against it.
+        Evaluated on first access unless loaded up front by
+        `evaluate()` or `load_balances()`.
+        """
+        if self._balance is None:
+            self._balance = get_balance(self)
+        return self._balance
 
-def list_for_account(account_id, from_date='0000-00-00', to_date='9999-99-99'):
-    # Parse months and years from arguments
+    @balance.setter
+    def balance(self, value):
+        self._balance = value
+
+
+def _evaluate_query(where, order):
+    """
+    Fills in the `EVALUATE_QUERY` template
+    """
+    return EVALUATE_QUERY.format(
+        deposit=transactions.DEPOSIT_ID, withdrawal=transactions.WITHDRAWAL_ID,
+        where=where, order=order)
+
+
+def evaluate(where='1', params=(), order='b.id'):
+    """
+    Budget evaluation engine; computes the balance of every budget
+    matching the `where` clause with one grouped query.
+    Returns a list of `Budget` objects.
+    """
+    rows = db.cursor().execute(_evaluate_query(where, order), params).fetchall()
+    return [Budget(*row) for row in rows]
+
+
+def load_balances(budgets):
+    """
+    Bulk-loads the balances of `budgets` with a single query,
+    regardless of how many budgets are given.
+    Returns `budgets`.
+    """
+    pending = {}
+    for bud in budgets:
+        if bud._balance is None:
+            pending.setdefault(bud.id, []).append(bud)
+    if pending:
+        query = _evaluate_query('b.id IN (SELECT value FROM json_each(?))', 'b.id')
+        for row in db.cursor().execute(query, (json.dumps(list(pending)),)):
+            for bud in pending[row[0]]:
+                bud.balance = row[-1]
+    return budgets
+
+
+def evaluate_month(month, year, order='b.id'):
+    """
+    Evaluates the budgets of all accounts for `month` of `year`.
+    """
+    return evaluate('b.year = ? AND b.month = ?', (year, month,), order)
+
+
+def _parse_period(from_date, to_date):
+    """
+    Parses the years and months out of a `from_date` to `to_date` range.
+    Returns `(from_year, to_year, from_month, to_month)`.
+    """
     from_date = from_date.split('-')
     if len(from_date) > 1:
         from_year, from_month = [int(x) for x in from_date[:2]]
@@ -38,71 +126,30 @@ def list_for_account(account_id, from_date='0000-00-00', to_date='9999-99-99'):
     else:
         to_year = int(to_date[0])
         to_month = 12
+    return from_year, to_year, from_month, to_month
 
-    cur = db.cursor()
-    buds = cur.execute('SELECT b.id, b.account_id, c.id, c.name, b.amount, b.year, b.month, b.created_at \
-        FROM budgets b \
-        LEFT JOIN categories c ON b.category_id = c.id \
-        WHERE b.account_id = ? AND b.year BETWEEN ? AND ? \
-        AND b.month BETWEEN ? AND ? \
-        ORDER BY b.year, b.month', (account_id, from_year, to_year, from_month, to_month,)).fetchall()
-    return [Budget(*row) for row in buds]
 
+def list_for_account(account_id, from_date='0000-00-00', to_date='9999-99-99'):
+    return evaluate('b.account_id = ? AND b.year BETWEEN ? AND ? \
+        AND b.month BETWEEN ? AND ?', (account_id,) + _parse_period(from_date, to_date),
+        order='b.year, b.month')
 
-def get_balance(budget):
-    transaction_query = 'SELECT transaction_type_id, amount FROM transactions \
-        WHERE account_id = ? AND category_id = ? AND created_at BETWEEN ? AND ?'
-    month = budget.month
-    year = budget.year
-    next_month = month + 1
-    t_month = '0' + str(month) if len(str(month)) == 1 else str(month)
-    next_month = month + 1 if month < 12 else 1
-    t_next_month = '0' + str(next_month) if len(str(next_month)) == 1 else str(next_month)
-    t_year = str(year)
-    t_next_year = t_year if next_month != 1 else str(year + 1)
-
-    result = budget.amount
-    trans = db.cursor().execute(transaction_query, (budget.account_id, budget.category.id, f'{t_year}-{t_month}', f'{t_next_year}-{t_next_month}'))
-    for transaction in trans:
-        type_id = transaction[0]
-        amount = transaction[1]
-        if type_id == transactions.WITHDRAWAL_ID:
-            result -= amount
-        elif type_id == transactions.DEPOSIT_ID:
-            result += amount
-
-    return result
-
-
-def setup():
+
+def list_for_period(from_date='0000-00-00', to_date='9999-99-99'):
     """
-    Setup budgeting table(s).
+    Evaluates the budgets of every account within a date range,
+    ordered by account.
     """
-    locale.setlocale(locale.LC_ALL, '')
-    budgets_sql = '''
-    CREATE TABLE IF NOT EXISTS budgets (
-        id integer PRIMARY KEY AUTOINCREMENT,
-        account_id integer NOT NULL,
-        category_id integer NOT NULL,
-        amount integer NOT NULL,
-		created_at text NOT NULL,
-        year integer NOT NULL,
-        month integer NOT NULL,
-        FOREIGN KEY (account_id)
-            REFERENCES accounts (id)
-            ON UPDATE CASCADE
-            ON DELETE NO ACTION,
-        FOREIGN KEY (category_id)
-            REFERENCES categories (id)
-            ON UPDATE CASCADE
-            ON DELETE NO ACTION,
-        UNIQUE(account_id, category_id, month, year)
-    );
-    '''
+    return evaluate('b.year BETWEEN ? AND ? AND b.month BETWEEN ? AND ?',
+        _parse_period(from_date, to_date), order='b.account_id, b.year, b.month')
 
-    cur = db.cursor()
-    cur.execute(budgets_sql)
-    db.commit()
+
+def get_balance(budget):
+    """
+    Evaluates the balance of a single `budget`.
+    """
+    row = db.cursor().execute(_evaluate_query('b.id = ?', 'b.id'), (budget.id,)).fetchone()
+    return row[-1] if row else budget.amount
 
 
 def new(account_id):
@@ -111,8 +158,7 @@ def new(account_id):
     """
     account_id = int(account_id)
     if not accounts.exists(account_id):
-        print(color_error('[error]') + ' Account does not exist (ID: {})'.format(account_id))
-        return
+        return 'Account does not exist (ID: {})'.format(account_id)
 
     # Get the budget category inputs from user
     category.print_list()
@@ -128,14 +174,10 @@ def new(account_id):
     try:
         budget_amount = float(budget_amount)
     except ValueError:
-        print(color_error('[error]') + ' Invalid budget amount specified. ' + \
-            'Amount must be a numeric value.')
-        return
+        return 'Invalid budget amount specified. Amount must be a numeric value.'
 
     if budget_amount < 0 or budget_amount is None:
-        print(color_error('[error]') + ' Invalid budget amount specified. ' + \
-            'Amount must not be less than zero.')
-        return
+        return 'Invalid budget amount specified. Amount must not be less than zero.'
 
     default_year = datetime.datetime.now().year
     default_month = datetime.datetime.now().month
@@ -147,8 +189,9 @@ def new(account_id):
     budget_amount = utils.float_to_atomic(budget_amount)
 
     # Create the budget
-    if create(account_id, category_id, budget_amount, year, month):
-        print(color_success('Budget category created'))
+    if not create(account_id, category_id, budget_amount, year, month):
+        return 'Failed to create budget'
+    print(color_success('Budget category created'))
 
 
 def create(account_id, category_id, amount, year, month):
@@ -202,22 +245,10 @@ def list_all_budgets(month=None, year=None):
         print('No budgets were found for the month of {}/{}'.format(month, year))
         return
 
-    cur.execute('SELECT b.id, a.name, c.name, b.amount, b.month, b.year, b.created_at \
-        FROM budgets b \
-        LEFT JOIN accounts a ON b.account_id = a.id \
-        LEFT JOIN categories c ON b.category_id = c.id \
-        WHERE b.year = ? AND b.month = ? \
-        ORDER BY b.account_id DESC', (year, month,))
-    rows = cur.fetchall()
-
     new_rows = []
-    for row in rows:
-        budget_id = row[0]
-        account = row[1]
-        category = row[2]
-        amount = utils.atomic_to_float(row[3])
-        month, year, created_at = row[4:7]
-        new_rows.append([budget_id, account, category, locale.currency(amount, grouping=True), month, year, created_at])
+    for bud in evaluate_month(month, year, order='b.account_id DESC'):
+        amount = utils.atomic_to_float(bud.amount)
+        new_rows.append([bud.id, bud.account_name, bud.category.name, locale.currency(amount, grouping=True), bud.month, bud.year, bud.created_at])
 
     headers = colorize_headers(['ID', 'Account', 'Cateogory', 'Amount', 'Month', 'Year', 'Created At'])
     print(tabulate(new_rows, headers=headers, tablefmt='psql'))
@@ -233,63 +264,26 @@ def list_budget(month=None, year=None):
 
     # Data validation
     if not str(month).isdecimal() or (int(month) < 1 or int(month) > 12):
-        print(color_error('[error]') + ' Invalid value for <month>. Month should be a number 1-12.')
-        return
+        return 'Invalid value for <month>. Month should be a number 1-12.'
 
     if not str(year).isdecimal() or \
         len(str(year)) != 4:
-        print(color_error('[error]') + ' Invalid value for year. Year must be a ' + \
-            'four-digit integer!')
-        return
+        return 'Invalid value for year. Year must be a four-digit integer!'
 
     month = int(month)
     year = int(year)
 
-    # Loop through budgets, and for the account that is attached to it
-    # loop through its transactions, matching the budget category;
-    # then evaluate the budget result (overbudget or underbudget)
-    budget_cur = db.cursor()
-    trans_cur = db.cursor()
+    # Evaluate every budget of the month in one pass
+    # then format the result (overbudget or underbudget)
     rows = []
-    for budget in budget_cur.execute('SELECT c.id, c.name, b.amount, a.id, a.name, b.created_at, b.id \
-        FROM budgets b \
-        LEFT JOIN accounts a ON b.account_id = a.id \
-        LEFT JOIN categories c ON b.category_id = c.id \
-        WHERE b.year = ? AND b.month = ?', (year, month,)):
-
-        category_id = budget[0]
-        category = budget[1]
-        result = budget[2] # Budget amount
-        budget_amount = utils.atomic_to_float(budget[2])
-        account_id = budget[3]
-        account = budget[4]
-        created_at = budget[5]
-        budget_id = budget[6]
-
-        transaction_query = 'SELECT transaction_type_id, amount FROM transactions \
-            WHERE account_id = ? AND category_id = ? AND created_at BETWEEN ? AND ?'
-        next_month = month + 1
-        t_month = '0' + str(month) if len(str(month)) == 1 else str(month)
-        next_month = month + 1 if month < 12 else 1
-        t_next_month = '0' + str(next_month) if len(str(next_month)) == 1 else str(next_month)
-        t_year = str(year)
-        t_next_year = t_year if next_month != 1 else str(year + 1)
-
-        trans = trans_cur.execute(transaction_query, (account_id, category_id, f'{t_year}-{t_month}', f'{t_next_year}-{t_next_month}'))
-        for transaction in trans:
-            type_id = transaction[0]
-            amount = transaction[1]
-            if type_id == transactions.WITHDRAWAL_ID:
-                result -= amount
-            elif type_id == transactions.DEPOSIT_ID:
-                result += amount
-
-        result = utils.atomic_to_float(result)
+    for bud in evaluate_month(month, year):
+        result = utils.atomic_to_float(bud.balance)
         if result > 0: # Good; means budget has not run out
             result = colorize('+' + locale.currency(result, grouping=True), 'green')
         else:
             result = colorize('-' + locale.currency(-1 * result, grouping=True), 'red')
-        lyst = [budget_id, account, category, locale.currency(budget_amount, grouping=True), month, year, created_at]
+        budget_amount = utils.atomic_to_float(bud.amount)
+        lyst = [bud.id, bud.account_name, bud.category.name, locale.currency(budget_amount, grouping=True), month, year, bud.created_at]
         rows.append(colorize_list(lyst[:4], ['white', 'purple', 'cyan', 'white']) + [result,] + colorize_list(lyst[4:], ['yellow', 'yellow', 'white']))
 
     headers = colorize_headers(['ID', 'Account', 'Category', 'Budget', 'Balance', 'Month', 'Year', 'Created At'])
@@ -308,7 +302,6 @@ def _delete_budget(budget_id):
     exists = cur.execute('SELECT COUNT(*) FROM budgets WHERE \
         id = ?', (budget_id,)).fetchone()[0] != 0
     if not exists:
-        print(color_error('[error]') + ' Budget does not exist for ID {}'.format(budget_id))
         return False
 
     # Try to delete the budget
@@ -325,7 +318,7 @@ def delete_budget(budget_id):
     """
     budget_id = int(budget_id)
 
-    success = _delete_budget(budget_id)
-    if success:
-        print(color_success('Budget (ID: {}) deleted.'.format(budget_id)))
-        db.commit()
+    if not _delete_budget(budget_id):
+        return 'Budget does not exist for ID {}'.format(budget_id)
+    print(color_success('Budget (ID: {}) deleted.'.format(budget_id)))
+    db.commit()
@@ -9,12 +9,10 @@ import re
 from datetime import datetime
 import locale
 
-# 3rd-Party module for tabular console output
-from tabulate import tabulate
-
 from . import db, utils
+from .utils import tabulate
 from .colorize import colorize, colorize_headers, colorize_list
-from .colorize import color_input, color_error, color_info, color_success
+from .colorize import color_input, color_info, color_success
 
 
 class Category(object):
@@ -23,20 +21,6 @@ class Category(object):
         self.name = name
 
 
-def setup():
-    """
-    Initial database setup; creates the `accounts` table
-    """
-    locale.setlocale(locale.LC_ALL, '')
-    cur = db.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            id integer NOT NULL PRIMARY KEY,
-            name text NOT NULL UNIQUE);
-        ''')
-    db.commit()
-
-
 def list_all():
     """
     Lists all the available categories
@@ -51,45 +35,41 @@ def new(name):
     """
     Handler for creating a new category.
     """
-    if create(name):
-        print(color_success(f'"{name}" category created'))
-    else:
-        print(color_error(f'"{name}" category already exists'))
+    if not create(name):
+        return f'"{name}" category already exists'
+    print(color_success(f'"{name}" category created'))
 
 
 def rename(old_name, new_name):
     """
     Handler for renaming category `old_name` to `new_name`
     """
-    if exists(old_name):
-        if (exists(new_name)):
-            print(color_error(f'"{new_name}" category already exists'))
-        else:
-            old_id, old_name = get_by_name(old_name)
-            if update(old_id, new_name):
-                print(color_success(f'Renamed category "{old_name}" to "{new_name}"'))
-            else:
-                print(color_error(f'Unable to rename category "{old_name}" to "{new_name}"'))
-    else:
-        print(color_error(f'"{old_name}" category does not exist'))
+    if not exists(old_name):
+        return f'"{old_name}" category does not exist'
+    if exists(new_name):
+        return f'"{new_name}" category already exists'
+
+    old_id, old_name = get_by_name(old_name)
+    if not update(old_id, new_name):
+        return f'Unable to rename category "{old_name}" to "{new_name}"'
+    print(color_success(f'Renamed category "{old_name}" to "{new_name}"'))
 
 
 def remove(_id):
     """
     Handler for deleting a category
     """
-    if get(_id):
-        conf = input(color_input('Are you sure you want to delete this category? [y/n] '))
-        if conf.lower() != 'y':
-            print(color_info('Aborted category deletion'))
-            return
-
-        if delete(_id):
-            print(color_success(f'Category (ID: {_id}) deleted'))
-        else:
-            print(color_error(f'Unable to delete category'))
-    else:
-        print(color_error(f'Category (ID: {_id}) does not exist'))
+    if not get(_id):
+        return f'Category (ID: {_id}) does not exist'
+
+    conf = input(color_input('Are you sure you want to delete this category? [y/n] '))
+    if conf.lower() != 'y':
+        print(color_info('Aborted category deletion'))
+        return
+
+    if not delete(_id):
+        return 'Unable to delete category'
+    print(color_success(f'Category (ID: {_id}) deleted'))
 
 
 def get(id):
@@ -3,18 +3,45 @@ File: cli.py
 '''
 
 from __future__ import print_function
+import argparse
+import importlib
 import os
 import sys
 import json
+import time
+
+# Startup timings (see --timing) are measured from here
+STARTED = time.perf_counter()
 
 try:
     import readline
 except:
     pass # possibility a user's build of python does not include readline
 
-from . import accounts, db, router, transactions, budget, colorize, category
-from .reporting import reports
+from . import accounts, db, router, transactions, budget, colorize, category, migrations, report_cache, rules, stats, totals
+
+
+CONFIG_DIR = os.path.join(os.path.expanduser('~'), '.oink')
+CONFIG_PATH = os.path.join(CONFIG_DIR, 'config.json')
+REPORT_CACHE_PATH = os.path.join(CONFIG_DIR, 'report_cache.db')
+
+DEFAULT_CONFIG = {
+    "colorscheme": {
+        "info": "blue",
+        "error": "red",
+        "success": "green",
+        "warning": "yellow",
+        "input": "cyan",
+        "headers": "blue",
+        "default": "white"
+    },
+    "databasePath": "",
+    "database": db.DEFAULT_PROFILE,
+    "reportCacheSize": report_cache.MAX_SIZE
+}
 
+# (phase, time it finished) for each startup phase, see mark()
+timings = []
 
 TITLE = r'''
  $$$$$$\  $$\           $$\
@@ -28,22 +55,54 @@ $$ |  $$ |$$ |$$ |  $$ |$$  _$$<
  '''
 
 
-def main():
+def main(argv=None):
     '''
     Starting point. Ensures everything is setup and shows welcome message.
 
+    Given a command on the command line (e.g. `oink lt 1 50`), runs just that
+    command; given a script with `-f` (`-` for stdin), runs each of its
+    commands inside a single database transaction. Either way no banner is
+    shown and Oink exits with a non-zero status if a command failed.
+
     '''
-    installation_path = get_installation_path()
-    db.connect(installation_path)
+    mark('imports')
+    args = parse_args(argv)
+    interactive = args.script is None and not args.command
+    timing = args.timing or bool(os.environ.get('OINK_TIMING'))
+
+    config = load_config()
+    colorize.load_color_scheme(config)
+    installation_path = get_installation_path(config, interactive)
+    if installation_path is None:
+        return 2
+    mark('config')
+
+    db.connect(installation_path, get_database_profile(config))
+    mark('connect')
 
-    # Setup the tables for the database
-    accounts.setup()
-    category.setup()
-    transactions.setup()
-    budget.setup()
+    # Bring the database schema up to date; costs a single
+    # pragma when it already is
+    migrations.migrate()
+    mark('schema')
+
+    report_cache.configure(REPORT_CACHE_PATH, config.get('reportCacheSize', report_cache.MAX_SIZE))
 
     register_commands()
+    mark('commands')
+
+    if args.script is not None or args.command:
+        if args.script is not None:
+            succeeded = run_script(args.script)
+        else:
+            succeeded = run_command(args.command)
+        mark('run')
+        if timing:
+            show_timings()
+        return exit_with(succeeded)
+
     show_welcome_message()
+    if timing:
+        show_timings()
 
     try:
         router.wait()
@@ -51,6 +110,122 @@ def main():
         quit_oink()
 
 
+def parse_args(argv=None):
+    '''
+    Parses the command line. Everything after the options is the Oink command to run.
+    '''
+    parser = argparse.ArgumentParser(prog='oink',
+        description='A CLI budgeting tools for nerds. Starts an interactive ' + \
+            'session unless a command or script is given.')
+    parser.add_argument('-f', '--file', dest='script', metavar='script',
+        help='run the commands in a script file (- for stdin) in a single transaction')
+    parser.add_argument('--timing', action='store_true',
+        help='show how long each startup phase took (or set OINK_TIMING=1)')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+        help='a single command to run, e.g. `lt 1 50`')
+    return parser.parse_args(argv)
+
+
+def run_command(args):
+    '''
+    Runs a single command given as a list of words, e.g. from the command line.
+    Returns True if the command succeeded.
+    '''
+    return router.dispatch(args[0], args[1:]) is None
+
+
+def run_script(path):
+    '''
+    Runs each command in a script file (or stdin for `-`), one per line,
+    inside a single database transaction. Blank lines and lines starting
+    with `#` are skipped and `q` stops the script early. If any command
+    fails, nothing the script did is kept.
+    Returns True if every command succeeded.
+    '''
+    if path == '-':
+        return _run_lines(sys.stdin)
+
+    try:
+        fin = open(os.path.expanduser(path), 'r')
+    except OSError as err:
+        print(colorize.color_error('[error]') + ' Unable to read script: {}'.format(err))
+        return False
+    with fin:
+        return _run_lines(fin)
+
+
+def _run_lines(fin):
+    # Lines are read one at a time so that commands which prompt
+    # for input can be answered by the lines that follow them
+    try:
+        with db.transaction():
+            for number, line in enumerate(iter(fin.readline, ''), 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line == 'q':
+                    break
+                if router.route(line) is not None:
+                    raise ScriptError(number, line)
+    except ScriptError as err:
+        print(colorize.color_error('[error]') + ' {}; no changes were saved.'.format(err))
+        return False
+    except Exception as err:
+        print(colorize.color_error('[error]') + ' Script failed ({}); no changes were saved.'.format(err))
+        return False
+    return True
+
+
+class ScriptError(Exception):
+    '''
+    Raised to abandon a script when one of its commands fails.
+    '''
+    def __init__(self, number, line):
+        super().__init__('Line {} failed: `{}`'.format(number, line))
+
+
+def mark(phase):
+    '''
+    Records that startup `phase` has just finished.
+    '''
+    timings.append((phase, time.perf_counter()))
+
+
+def show_timings():
+    '''
+    Prints how long each startup phase took to stderr, so that it does not
+    get mixed up with the output of a command.
+    '''
+    previous = STARTED
+    for phase, finished in timings:
+        print('{:<10}{:8.1f} ms'.format(phase, (finished - previous) * 1000), file=sys.stderr)
+        previous = finished
+    print('{:<10}{:8.1f} ms'.format('total', (previous - STARTED) * 1000), file=sys.stderr)
+
+
+def lazy(module, name):
+    '''
+    Handler which imports `module` (relative to this package) the first
+    time its command is run, rather than on every launch. The router
+    checks the imported handler then (see router.register()).
+    '''
+    def resolve():
+        return getattr(importlib.import_module(module, __package__), name)
+
+    def handler(*args):
+        return resolve()(*args)
+    handler.resolve = resolve
+    return handler
+
+
+def exit_with(succeeded):
+    '''
+    Disconnects from the database and returns the exit status for `succeeded`.
+    '''
+    db.disconnect()
+    return 0 if succeeded else 1
+
+
 def register_commands():
     '''
     Registers all commands with the router class. See router.register() for details.
@@ -66,13 +241,19 @@ def register_commands():
     # Transaction commands
     router.register('header', 'Transaction', None)
     router.register('at', 'Record a new transaction', transactions.new)
-    router.register('lt [account] [num]', 'List transactions for an account; ' + \
+    router.register('lt [account] [num] [balance]', 'List transactions for an account; ' + \
         'defaults to all accounts and 10 transactions. ' + \
         'Use * to specify all.', transactions.list_transactions)
+    router.register('pt [account] [size] [balance]', 'Page through transactions for an account, ' + \
+        'newest first', transactions.page_transactions)
+    router.register('find <query> [from] [to]', 'Search transaction descriptions, ' + \
+        'best matches first', transactions.find)
     router.register('ar <amount> <source_account> <destination_account>', 'Record a transfer ' + \
         'transaction between two accounts', transactions.add_transfer)
     router.register('et <id>', 'Edit a transaction', transactions.edit_transaction)
     router.register('dt <id>', 'Delete a transaction', transactions.delete_transaction)
+    router.register('import <file> <account> [format]', 'Import transactions from a ' + \
+        'CSV, OFX or QIF bank export', lazy('.importer', 'import_transactions'))
     router.register('separator', None, None)
 
     # Category commands
@@ -81,6 +262,12 @@ def register_commands():
     router.register('ac <name>', 'Add new category', category.new)
     router.register('rc <name> <new_name>', 'Rename a category', category.rename)
     router.register('dc <id>', 'Delete a category and all its transactions', category.remove)
+    router.register('rules', 'List the rules for categorizing transactions', rules.list_rules)
+    router.register('addrule <category> <pattern> [min] [max]', 'Add a rule putting transactions ' + \
+        'matching the text or /regex/ pattern (* for any) within the amounts in a category', rules.add_rule)
+    router.register('delrule <id>', 'Delete a categorization rule', rules.remove_rule)
+    router.register('autocat [account]', 'Categorize uncategorized transactions by the rules',
+        rules.autocategorize)
     router.register('separator', None, None)
 
     # Budget commands
@@ -92,7 +279,20 @@ def register_commands():
     router.register('separator', None, None)
 
     router.register('header', 'Report', None)
-    router.register('rep <file> <from_date> [to_date] [format]', 'Generate a report for a date range; ', reports.report)
+    router.register('rep <file> <from_date> [to_date] [format]', 'Generate a report for a date range; ',
+        lazy('.reporting.reports', 'report'))
+    router.register('separator', None, None)
+
+    router.register('header', 'Server', None)
+    router.register('serve [socket]', 'Serve the ledger as JSON-RPC over a Unix socket; ' + \
+        'defaults to ~/.oink/oink.sock', lazy('.server', 'serve'))
+    router.register('separator', None, None)
+
+    router.register('header', 'Diagnostic', None)
+    router.register('stats [option]', 'Show the slowest and most frequent queries; ' + \
+        'on/off toggles query instrumentation, reset clears it, or give a file to export to JSON', stats.show)
+    router.register('totals [option]', 'Check the monthly totals of transactions against them; ' + \
+        'rebuild recomputes them', totals.totals)
     router.register('separator', None, None)
 
     router.register('q', 'Quit Oink', quit_oink)
@@ -123,57 +323,50 @@ def quit_oink():
     sys.exit(0)
 
 
-def get_installation_path():
+def get_installation_path(config, interactive=True):
     '''
-    Get the oink.db sqlite3 file path from ~/.oink config file. If the config
-    file doesn't exist, ask for an installation path and create new config.
-
-    The ~/.oink config file consists of a single line of text, which is the full
-    path the the oink.db file.
+    Get the oink.db sqlite3 file path from the config. If it hasn't been set
+    yet, ask for an installation path and save it to the config file.
+    When not `interactive` there is nobody to ask, so None is returned instead.
 
     '''
-    config_dir = os.path.join(os.path.expanduser('~'), '.oink')
-    config_path = os.path.join(config_dir, 'config.json')
+    if config['databasePath'] != "":
+        return config['databasePath']
+    elif not interactive:
+        print(colorize.color_error('[error]') + ' No database path is configured; ' + \
+            'run `oink` interactively once to set one up.')
+        return None
+
+    while True:
+        print('Where would you like Oink to save its data?')
+        path = os.path.expanduser(input('> '))
+        if not os.path.isdir(path):
+            print(colorize.color_error('[error]') + ' That path doesn\'t exist.')
+            print('Please enter the full path to an existing folder.')
+        else:
+            config['databasePath'] = path
+            with open(CONFIG_PATH, 'w') as fout:
+                json.dump(config, fout, indent=4)
+            return path
+
+
+def get_database_profile(config):
+    '''
+    Get the database connection profile from the "database" section of the
+    config. Settings that are missing fall back to the defaults in
+    db.DEFAULT_PROFILE.
+    '''
+    return config.get('database', {})
+
 
+def load_config():
+    '''
+    Read the ~/.oink/config.json config file, creating it first if need be.
+    This is the only place the config file is read on startup.
+    '''
     setup_config()
-    colorize.load_color_scheme()
-
-    if os.path.isfile(config_path):
-        with open(config_path, 'r') as fin:
-            config = json.load(fin)
-
-            if config['databasePath'] != "":
-                return config['databasePath']
-            else:
-                while True:
-                    print('Where would you like Oink to save its data?')
-                    path = os.path.expanduser(input('> '))
-                    if not os.path.isdir(path):
-                        print(colorize.color_error('[error]') + ' That path doesn\'t exist.')
-                        print('Please enter the full path to an existing folder.')
-                    else:
-                        config['databasePath'] = path
-                        with open(config_path, 'w') as fout:
-                            json.dump(config, fout, indent=4)
-                        return path
-    else:
-        if not os.path.exists(config_dir):
-            os.mkdir(config_dir)
-        with open(config_path, 'w') as fout:
-            default_config = {
-                "colorscheme": {
-                    "info": "blue",
-                    "error": "red",
-                    "success": "green",
-                    "warning": "yellow",
-                    "input": "cyan",
-                    "headers": "blue",
-                    "default": "white"
-                },
-                "databasePath": ""
-            }
-            json.dump(default_config, fout, indent=4)
-        return get_installation_path()
+    with open(CONFIG_PATH, 'r') as fin:
+        return json.load(fin)
 
 
 def setup_config():
@@ -182,25 +375,10 @@ def setup_config():
     yet, create it and create the default JSON config file in it
     """
     # Create the ~/.oink/ directory if it does not exist
-    config_dir = os.path.join(os.path.expanduser('~'), '.oink')
-    if not os.path.exists(config_dir):
-        os.mkdir(config_dir)
-
-    config_path = os.path.join(config_dir, 'config.json')
+    if not os.path.exists(CONFIG_DIR):
+        os.mkdir(CONFIG_DIR)
 
     # If the config file does not exist, create it with the defaults
-    if not os.path.isfile(config_path):
-        with open(config_path, 'w') as fout:
-            default_config = {
-                "colorscheme": {
-                    "info": "blue",
-                    "error": "red",
-                    "success": "green",
-                    "warning": "yellow",
-                    "input": "cyan",
-                    "headers": "blue",
-                    "default": "white"
-                },
-                "databasePath": ""
-            }
-            json.dump(default_config, fout, indent=4)
+    if not os.path.isfile(CONFIG_PATH):
+        with open(CONFIG_PATH, 'w') as fout:
+            json.dump(DEFAULT_CONFIG, fout, indent=4)
@@ -69,12 +69,12 @@ def colorize_list(lyst_of_str, color_or_list):
     return colored_list
 
 
-def load_color_scheme():
-    '''Loads the color scheme from json config file'''
+def load_color_scheme(config=None):
+    '''Loads the color scheme from the given config, or else the json config file'''
     global COLOR_SCHEME
-    config = None
-    with open(os.path.join(os.path.expanduser('~'), '.oink', 'config.json')) as fin:
-        config = json.load(fin)
+    if config is None:
+        with open(os.path.join(os.path.expanduser('~'), '.oink', 'config.json')) as fin:
+            config = json.load(fin)
     COLOR_SCHEME = config['colorscheme']
 
 
@@ -83,19 +83,19 @@ def cprint(string, color):
     print(colorize(string, color))
 
 def color_info(string):
-    return colorize(string, COLOR_SCHEME['info'])
+    return colorize(string, COLOR_SCHEME.get('info'))
 
 def color_error(string):
-    return colorize(string, COLOR_SCHEME['error'])
+    return colorize(string, COLOR_SCHEME.get('error'))
 
 def color_success(string):
-    return colorize(string, COLOR_SCHEME['success'])
+    return colorize(string, COLOR_SCHEME.get('success'))
 
 def color_warning(string):
-    return colorize(string, COLOR_SCHEME['warning'])
+    return colorize(string, COLOR_SCHEME.get('warning'))
 
 def color_input(string):
-    return colorize(string, COLOR_SCHEME['input'])
+    return colorize(string, COLOR_SCHEME.get('input'))
 
 def colorize_headers(list_of_str):
-    return colorize_list(list_of_str, COLOR_SCHEME['headers'])
+    return colorize_list(list_of_str, COLOR_SCHEME.get('headers'))
@@ -3,48 +3,535 @@ File: db.py
 '''
 
 from __future__ import print_function
+import contextlib
+import functools
+import json
 import os
+import queue
+import re
+import threading
+import time
+import weakref
 
 import sqlite3
 
 
+# The connection of the thread which called `connect()`
 conn = None
 
+# Reader and writer connections shared between threads, see `Pool`
+pool = None
 
-def connect(path):
+# Per-thread state: the connection bound by `bind()` (if any, overriding
+# `conn`), the state of its `transaction()` blocks, and the thread's own
+# connection when it isn't the one which called `connect()`
+_local = threading.local()
+
+# How `connect()` was called, for opening the connections of other threads
+_owner = None
+_settings = None
+
+# Counts the calls to `connect()`, so that threads can tell their own
+# connection was opened for an earlier one
+_generation = 0
+
+# The connections opened for other threads, closed by `disconnect()`
+_thread_connections = weakref.WeakSet()
+
+
+# Default connection profile. Any of these can be overridden in the
+# "database" section of the ~/.oink/config.json config file.
+DEFAULT_PROFILE = {
+    # Write-ahead logging lets readers (e.g. report generation) carry on
+    # while another connection is writing, and makes commits cheaper
+    'journalMode': 'WAL',
+    # NORMAL is durable in WAL mode short of a power failure
+    'synchronous': 'NORMAL',
+    # Page cache size; negative values are in KiB (i.e. 16 MB)
+    'cacheSize': -16000,
+    # Bytes of the database file to memory-map; 0 disables it
+    'mmapSize': 268435456,
+    # Keep temporary tables and indices (e.g. for sorting) in memory
+    'tempStore': 'MEMORY',
+    # Open the database read-only
+    'readOnly': False,
+    # Record query statistics from the start (see `instrument()`)
+    'instrument': False,
+    # Most read-only connections the pool keeps open (see `Pool`)
+    'poolSize': 4,
+}
+
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+TEMP_STORES = ('DEFAULT', 'FILE', 'MEMORY')
+
+
+def _choice(profile, key, choices):
+    value = str(profile[key]).upper()
+    if value not in choices:
+        raise ValueError('Invalid database {} `{}`; expected one of {}'.format(
+            key, profile[key], ', '.join(choices)))
+    return value
+
+
+def _integer(profile, key):
+    try:
+        return int(profile[key])
+    except (TypeError, ValueError):
+        raise ValueError('Invalid database {} `{}`; expected an integer'.format(key, profile[key]))
+
+
+def open_connection(path, profile=None, read_only=None, check_same_thread=True):
     '''
-    Connect to the sqlite database provided at the specified path.
+    Opens a new connection to the oink.db database in the folder at `path`
+    and configures it according to the connection `profile`, which is
+    merged over `DEFAULT_PROFILE`. `read_only` overrides the profile's
+    'readOnly' setting. Connections that are handed between threads
+    (by the pool) are opened with `check_same_thread` off.
     '''
-    global conn
-    conn = sqlite3.connect(os.path.join(path, 'oink.db'))
+    profile = dict(DEFAULT_PROFILE, **(profile or {}))
+    if read_only is None:
+        read_only = bool(profile['readOnly'])
+
+    # Validate everything before touching the database
+    journal_mode = _choice(profile, 'journalMode', JOURNAL_MODES)
+    synchronous = _choice(profile, 'synchronous', SYNCHRONOUS_MODES)
+    temp_store = _choice(profile, 'tempStore', TEMP_STORES)
+    cache_size = _integer(profile, 'cacheSize')
+    mmap_size = _integer(profile, 'mmapSize')
+
+    db_path = os.path.join(path, 'oink.db')
+    if read_only:
+        # Imported here as urllib is slow to import and only needed for URIs
+        from urllib.request import pathname2url
+        connection = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(db_path))),
+                                     uri=True, check_same_thread=check_same_thread)
+    else:
+        connection = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+
     if os.environ.get('DEBUG', ''):
-        conn.set_trace_callback(print) # prints queries; useful for development
+        connection.set_trace_callback(print) # prints queries; useful for development
 
     # Enable foreign key support
-    cur = conn.cursor()
+    cur = connection.cursor()
     cur.execute('PRAGMA foreign_keys = ON')
     if cur.rowcount == 0:
         print('Failed to enable foreign key support. Failed to connect to database.')
         exit(1)
+
+    # The journal mode is persistent, and can only be changed by a writer
+    if not read_only:
+        cur.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+    cur.execute('PRAGMA synchronous = {}'.format(synchronous))
+    cur.execute('PRAGMA cache_size = {:d}'.format(cache_size))
+    cur.execute('PRAGMA mmap_size = {:d}'.format(mmap_size))
+    cur.execute('PRAGMA temp_store = {}'.format(temp_store))
+    return connection
+
+
+def connect(path, profile=None, read_only=None):
+    '''
+    Connect to the sqlite database provided at the specified path.
+    See `open_connection()` for the connection profile. Any previous
+    connection is closed first, along with its pool and the connections
+    of other threads.
+    '''
+    global conn, pool, _owner, _settings, _generation
+    disconnect()
+    conn = open_connection(path, profile, read_only)
+    _owner = threading.get_ident()
+    _settings = (path, profile, read_only)
+    _generation += 1
+    pool = Pool(path, profile, size=dict(DEFAULT_PROFILE, **(profile or {}))['poolSize'])
+    if (profile or {}).get('instrument') or os.environ.get('OINK_STATS', ''):
+        instrument(True)
     return conn
 
 
+class _ThreadConnection(object):
+    '''
+    Holds the connection of a thread other than the one which connected,
+    opened for the `generation`th call to `connect()`. It is closed once
+    the thread ends and its locals are released.
+    '''
+    def __init__(self, connection, generation):
+        self.connection = connection
+        self.generation = generation
+
+    def __del__(self):
+        self.connection.close()
+
+
+def _connection():
+    '''
+    The connection `cursor()` and friends use in the current thread:
+    the one bound by `bind()`, else `conn` in the thread which connected,
+    else a connection of the thread's own, opened on first use and
+    again after each `connect()`.
+    '''
+    bound = getattr(_local, 'conn', None)
+    if bound is not None:
+        return bound
+    if conn is None or threading.get_ident() == _owner:
+        return conn
+
+    own = getattr(_local, 'own', None)
+    if own is None or own.generation != _generation:
+        path, profile, read_only = _settings
+        # Closed by whichever thread releases it last
+        own = _local.own = _ThreadConnection(
+            open_connection(path, profile, read_only, check_same_thread=False), _generation)
+        _thread_connections.add(own)
+    return own.connection
+
+
+class _TransactionState(object):
+    def __init__(self):
+        # How many `transaction()` blocks are currently open
+        self.depth = 0
+        # Savepoint names of the open nested blocks, innermost last
+        self.savepoints = []
+
+
+def _state():
+    '''
+    The transaction state of the current thread
+    '''
+    state = getattr(_local, 'state', None)
+    if state is None:
+        state = _local.state = _TransactionState()
+    return state
+
+
+@contextlib.contextmanager
+def bind(connection):
+    '''
+    Makes `cursor()`, `commit()`, `transaction()` and `rollback()` use
+    `connection` instead of `conn` in the current thread for the duration
+    of the block, e.g. in a worker thread with its own connection.
+    '''
+    previous = getattr(_local, 'conn', None), getattr(_local, 'state', None)
+    _local.conn, _local.state = connection, _TransactionState()
+    try:
+        yield connection
+    finally:
+        _local.conn, _local.state = previous
+
+
 def cursor():
     '''
     Returns a sqlite3 cursor to the database
     '''
-    return conn.cursor()
+    if _instrumented:
+        return _connection().cursor(InstrumentedCursor)
+    return _connection().cursor()
 
 
 def commit():
     '''
     Commit the changes to the database.
+    Inside of a `transaction()` block this is deferred until
+    the outermost block completes.
     '''
-    return conn.commit()
+    if _state().depth:
+        return None
+    return _connection().commit()
+
+
+@contextlib.contextmanager
+def transaction():
+    '''
+    Runs the enclosed statements in a single explicit transaction,
+    committed when the block completes and rolled back if it raises.
+    The write lock is taken up front (BEGIN IMMEDIATE) so concurrent
+    writers queue up rather than fail part way through.
+    Nested blocks are savepoints within the outermost transaction, so
+    they can be rolled back on their own.
+    '''
+    connection = _connection()
+    state = _state()
+    savepoint = None
+    if state.depth == 0:
+        if not connection.in_transaction:
+            connection.execute('BEGIN IMMEDIATE')
+    else:
+        savepoint = 'oink_{:d}'.format(state.depth)
+        connection.execute('SAVEPOINT ' + savepoint)
+        state.savepoints.append(savepoint)
+    state.depth += 1
+
+    try:
+        yield
+    except BaseException:
+        state.depth -= 1
+        if savepoint is None:
+            connection.rollback()
+        else:
+            state.savepoints.pop()
+            connection.execute('ROLLBACK TO ' + savepoint)
+            connection.execute('RELEASE ' + savepoint)
+        raise
+
+    state.depth -= 1
+    if savepoint is None:
+        connection.commit()
+    else:
+        state.savepoints.pop()
+        connection.execute('RELEASE ' + savepoint)
+
+
+def rollback():
+    '''
+    Roll back the changes made since the last commit, or inside of a
+    nested `transaction()` block, the changes made by that block.
+    '''
+    state = _state()
+    if state.savepoints:
+        return _connection().execute('ROLLBACK TO ' + state.savepoints[-1])
+    return _connection().rollback()
 
 
 def disconnect():
     '''
-    Close the connection to the databse.
+    Close the connection to the databse, along with the pool and
+    the connections opened for other threads. Does nothing if not
+    connected.
+    '''
+    global conn, pool
+    if pool is not None:
+        pool.close()
+        pool = None
+    for own in list(_thread_connections):
+        own.connection.close()
+    _thread_connections.clear()
+    if conn is not None:
+        conn.close()
+        conn = None
+
+
+class Pool(object):
+    '''
+    Connections to share between threads: up to `size` read-only
+    connections, checked out with `reader()`, and one writer connection,
+    checked out with `writer()`.
+
+    In WAL mode readers never wait for the writer, or it for them, so
+    several threads can e.g. build reports while another records
+    transactions. Inside either block the db helpers (`cursor()`,
+    `commit()`, ...) use the checked out connection.
+    '''
+    def __init__(self, path, profile=None, size=4):
+        self.path = path
+        self.profile = profile
+        self.size = _integer({'poolSize': size}, 'poolSize')
+        if self.size < 1:
+            raise ValueError('Invalid database poolSize `{}`; expected at least 1'.format(size))
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._opened = []
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._closed = False
+
+    def _open(self, read_only):
+        if self._closed:
+            raise RuntimeError('The connection pool is closed')
+        connection = open_connection(self.path, self.profile, read_only=read_only, check_same_thread=False)
+        self._opened.append(connection)
+        return connection
+
+    @contextlib.contextmanager
+    def reader(self):
+        '''
+        Checks out a read-only connection for the block, waiting if all
+        of them are in use. Every query in the block reads the same
+        snapshot of the ledger, even while it is being written to.
+        '''
+        with self._slots:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._open(read_only=True)
+            try:
+                with bind(connection):
+                    connection.execute('BEGIN')
+                    try:
+                        yield connection
+                    finally:
+                        connection.rollback()
+            finally:
+                self._idle.put(connection)
+
+    @contextlib.contextmanager
+    def writer(self):
+        '''
+        Checks out the writer connection for the block, which runs as one
+        `transaction()`. Writers from other threads wait their turn.
+        '''
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._open(read_only=False)
+            with bind(self._writer):
+                with transaction():
+                    yield self._writer
+
+    def close(self):
+        '''
+        Closes every connection the pool opened.
+        '''
+        self._closed = True
+        for connection in self._opened:
+            connection.close()
+        self._opened = []
+
+
+# Query instrumentation
+#
+# While enabled, cursors handed out by `cursor()` time every statement
+# and count the rows fetched from it. The figures are aggregated by
+# normalized SQL (literals and IN lists folded into placeholders), so
+# the same query issued once per row shows up as one hot entry.
+
+_instrumented = False
+
+# Normalized SQL => {'sql', 'calls', 'rows', 'total_time', 'max_time'}
+_stats = {}
+
+# Guards `_stats`, as queries are recorded from whichever thread runs
+# them (the aio worker, pool readers, ...)
+_stats_lock = threading.Lock()
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r'\bIN \((?:\?, )+\?\)', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize(sql):
+    '''
+    Normalizes a SQL statement for grouping in the query statistics.
+    '''
+    sql = _WHITESPACE_RE.sub(' ', sql).strip()
+    sql = _LITERAL_RE.sub('?', sql)
+    return _IN_LIST_RE.sub('IN (?)', sql)
+
+
+def _record(sql, elapsed, rows=0, calls=0, statement_time=None):
+    '''
+    `statement_time` is the time spent on the execution so far,
+    fetches included (defaults to `elapsed`)
+    '''
+    key = normalize(sql)
+    with _stats_lock:
+        stat = _stats.get(key)
+        if stat is None:
+            stat = _stats[key] = {'sql': key, 'calls': 0, 'rows': 0, 'total_time': 0.0, 'max_time': 0.0}
+        stat['calls'] += calls
+        stat['rows'] += rows
+        stat['total_time'] += elapsed
+        stat['max_time'] = max(stat['max_time'], elapsed if statement_time is None else statement_time)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    '''
+    Cursor that records the statistics of the statements it executes.
+    Time spent fetching rows is attributed to the statement that
+    produced them.
+    '''
+    _sql = None
+    # Time spent on the last statement, fetches included
+    _statement_time = 0.0
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._sql = sql
+            self._statement_time = time.perf_counter() - start
+            _record(sql, self._statement_time, calls=1)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._sql = sql
+            self._statement_time = time.perf_counter() - start
+            _record(sql, self._statement_time, rows=max(self.rowcount, 0), calls=1)
+
+    def _fetched(self, start, rows):
+        if self._sql is not None:
+            elapsed = time.perf_counter() - start
+            self._statement_time += elapsed
+            _record(self._sql, elapsed, rows=rows, statement_time=self._statement_time)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        row = super().__next__()
+        self._fetched(start, 1)
+        return row
+
+
+def instrument(enabled=True):
+    '''
+    Turns query instrumentation on or off. Statistics gathered
+    so far are kept until `reset_stats()` is called.
+    '''
+    global _instrumented
+    _instrumented = enabled
+
+
+def is_instrumented():
+    '''
+    Whether query instrumentation is turned on
+    '''
+    return _instrumented
+
+
+def reset_stats():
+    '''
+    Clears the query statistics gathered so far.
+    '''
+    with _stats_lock:
+        _stats.clear()
+
+
+def query_stats(order_by='total_time'):
+    '''
+    Returns the statistics gathered for each distinct (normalized) query,
+    ordered by `order_by` (e.g. 'total_time', 'max_time' or 'calls'),
+    largest first. Each entry also reports the 'mean_time'.
+    '''
+    with _stats_lock:
+        stats = [dict(stat) for stat in _stats.values()]
+    for stat in stats:
+        stat['mean_time'] = stat['total_time'] / stat['calls'] if stat['calls'] else 0.0
+    stats.sort(key=lambda stat: stat[order_by], reverse=True)
+    return stats
+
+
+def export_stats(path):
+    '''
+    Writes the query statistics to `path` as JSON.
     '''
-    return conn.close()
+    with open(path, 'w') as fout:
+        json.dump(query_stats(), fout, indent=4)
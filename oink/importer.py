@@ -0,0 +1,311 @@
+"""
+File: importer.py
+
+Bulk import of transactions from bank exports (CSV, OFX/QFX and QIF).
+
+Files are parsed as a stream, one record at a time, and the rows are
+inserted in batches with `executemany` inside a single database
+transaction. The account balance is adjusted once, by the net of all
+imported rows, at the end of the import. Rows are categorized by the
+categorization rules (see rules.py) as they are read.
+"""
+
+from __future__ import print_function
+import csv
+import decimal
+import functools
+import os
+import re
+from datetime import datetime
+
+from . import db, accounts, rules, transactions
+from .colorize import color_success
+
+
+# Number of rows handed to each `executemany` call
+BATCH_SIZE = 1000
+
+# Encoding of the export files; a byte order mark, as spreadsheet
+# programs put at the start of CSV files, is skipped
+ENCODING = 'utf-8-sig'
+
+# Date formats tried, in order, for CSV and QIF dates
+DATE_FORMATS = (
+    '%Y-%m-%d',
+    '%Y/%m/%d',
+    '%m/%d/%Y',
+    '%m/%d/%y',
+    '%d.%m.%Y',
+    '%Y%m%d',
+)
+
+# Recognized CSV column names (lowercased)
+CSV_DATE_COLUMNS = ('date', 'posted date', 'posting date', 'transaction date', 'created_at')
+CSV_DESCRIPTION_COLUMNS = ('description', 'payee', 'name', 'memo', 'details')
+CSV_AMOUNT_COLUMNS = ('amount', 'transaction amount')
+CSV_DEBIT_COLUMNS = ('debit', 'withdrawal', 'withdrawals')
+CSV_CREDIT_COLUMNS = ('credit', 'deposit', 'deposits')
+
+OFX_TAG_RE = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)')
+
+INSERT_QUERY = 'INSERT INTO transactions (account_id, transaction_type_id, \
+    description, amount, category_id, created_at) VALUES (?, ?, ?, ?, ?, ?)'
+
+
+class ImportFileError(ValueError):
+    """
+    Raised when an import file cannot be parsed
+    """
+    pass
+
+
+def _parse_amount(text):
+    """
+    Parses a signed currency string (e.g. "-1,234.56", "(12.00)", "$5")
+    into a signed atomic integer.
+    """
+    text = text.strip()
+    negative = text.startswith('(') and text.endswith(')')
+    text = re.sub(r'[^0-9.\-+]', '', text)
+    if not text:
+        raise ImportFileError('Invalid amount')
+    try:
+        value = int(decimal.Decimal(text) * 100)
+    except decimal.InvalidOperation:
+        raise ImportFileError('Invalid amount `{}`'.format(text))
+    return -value if negative else value
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_date(text):
+    """
+    Parses a date in any of `DATE_FORMATS` into the
+    `created_at` format used by the database.
+    Memoized, since exports repeat the same few dates many times over.
+    """
+    text = text.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            date = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        return date.strftime('%Y-%m-%d %H:%M:%S')
+    raise ImportFileError('Unrecognized date `{}`'.format(text))
+
+
+def _find_column(fieldnames, candidates):
+    for name in candidates:
+        if name in fieldnames:
+            return name
+    return None
+
+
+def parse_csv(lines):
+    """
+    Parses CSV bank exports. Yields `(created_at, description, amount)`
+    tuples, where `amount` is signed (negative for withdrawals).
+
+    The first row must be a header naming the date, description and
+    either a signed amount column or separate debit/credit columns.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    fieldnames = [name.strip().lower() for name in header]
+
+    date_col = _find_column(fieldnames, CSV_DATE_COLUMNS)
+    desc_col = _find_column(fieldnames, CSV_DESCRIPTION_COLUMNS)
+    amount_col = _find_column(fieldnames, CSV_AMOUNT_COLUMNS)
+    debit_col = _find_column(fieldnames, CSV_DEBIT_COLUMNS)
+    credit_col = _find_column(fieldnames, CSV_CREDIT_COLUMNS)
+
+    if date_col is None:
+        raise ImportFileError('No date column was found in the CSV header')
+    if amount_col is None and debit_col is None and credit_col is None:
+        raise ImportFileError('No amount column was found in the CSV header')
+
+    date_idx = fieldnames.index(date_col)
+    desc_idx = fieldnames.index(desc_col) if desc_col else None
+    amount_idx = fieldnames.index(amount_col) if amount_col else None
+    debit_idx = fieldnames.index(debit_col) if debit_col else None
+    credit_idx = fieldnames.index(credit_col) if credit_col else None
+
+    for line_no, row in enumerate(reader, 2):
+        if not row or not any(row):
+            continue
+        try:
+            created_at = _parse_date(row[date_idx])
+            if amount_idx is not None:
+                amount = _parse_amount(row[amount_idx])
+            else:
+                debit = row[debit_idx].strip() if debit_idx is not None else ''
+                credit = row[credit_idx].strip() if credit_idx is not None else ''
+                amount = _parse_amount(credit) if credit else -abs(_parse_amount(debit))
+        except (ImportFileError, IndexError) as err:
+            raise ImportFileError('Line {}: {}'.format(line_no, err))
+        description = row[desc_idx].strip() if desc_idx is not None else None
+        yield created_at, description, amount
+
+
+def parse_ofx(lines):
+    """
+    Parses OFX/QFX statements (both the SGML and XML flavours).
+    Yields `(created_at, description, amount)` tuples for every
+    <STMTTRN> statement transaction.
+    """
+    record = None
+    for line_no, line in enumerate(lines, 1):
+        for match in OFX_TAG_RE.finditer(line):
+            closing, tag, value = match.groups()
+            tag = tag.upper()
+            value = value.strip()
+
+            if tag == 'STMTTRN':
+                if closing and record is not None:
+                    yield _ofx_record(record, line_no)
+                    record = None
+                elif not closing:
+                    if record is not None:
+                        yield _ofx_record(record, line_no)
+                    record = {}
+            elif record is not None and not closing and value:
+                record[tag] = value
+
+    if record is not None:
+        yield _ofx_record(record, 'EOF')
+
+
+def _ofx_record(record, line_no):
+    try:
+        posted = record['DTPOSTED']
+        amount = _parse_amount(record['TRNAMT'])
+    except KeyError as err:
+        raise ImportFileError('Line {}: transaction is missing {}'.format(line_no, err))
+    digits = re.sub(r'[^0-9].*$', '', posted)
+    try:
+        if len(digits) >= 14:
+            created_at = datetime.strptime(digits[:14], '%Y%m%d%H%M%S')
+        else:
+            created_at = datetime.strptime(digits[:8], '%Y%m%d')
+    except ValueError:
+        raise ImportFileError('Line {}: unrecognized date `{}`'.format(line_no, posted))
+    description = record.get('NAME') or record.get('MEMO')
+    return created_at.strftime('%Y-%m-%d %H:%M:%S'), description, amount
+
+
+def parse_qif(lines):
+    """
+    Parses QIF bank exports. Yields `(created_at, description, amount)`
+    tuples for every `^`-terminated record.
+    """
+    record = {}
+    for line_no, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('!'):
+            continue
+        code, value = line[0], line[1:].strip()
+        if code == '^':
+            if record:
+                yield _qif_record(record, line_no)
+            record = {}
+        elif code not in record:
+            record[code] = value
+
+    if record:
+        yield _qif_record(record, 'EOF')
+
+
+def _qif_record(record, line_no):
+    try:
+        # Quicken writes dates like 6/23'18 and 6/ 3/2018
+        date = record['D'].replace("'", '/').replace(' ', '0')
+        created_at = _parse_date(date)
+        amount = _parse_amount(record.get('T') or record['U'])
+    except (KeyError, ImportFileError) as err:
+        raise ImportFileError('Line {}: {}'.format(line_no, err))
+    return created_at, record.get('P') or record.get('M'), amount
+
+
+PARSERS = {
+    'csv': parse_csv,
+    'ofx': parse_ofx,
+    'qfx': parse_ofx,
+    'qif': parse_qif,
+}
+
+
+def _read(path, parse, encoding):
+    """
+    Yields the records `parse` reads from the file at `path`, raising
+    ImportFileError should it not be in `encoding` or be malformed CSV
+    """
+    try:
+        with open(path, newline='', encoding=encoding) as fin:
+            yield from parse(fin)
+    except UnicodeDecodeError as err:
+        raise ImportFileError('The file is not {} encoded ({})'.format(encoding, err))
+    except csv.Error as err:
+        raise ImportFileError('Malformed CSV ({})'.format(err))
+
+
+def import_file(path, account_id, fmt=None, batch_size=BATCH_SIZE, encoding=ENCODING):
+    """
+    Imports every transaction in the file at `path` (in `encoding`) into
+    the account `account_id`. The format is inferred from the file
+    extension unless `fmt` is given. The import is all or nothing.
+    Returns the number of transactions imported.
+    """
+    if fmt is None:
+        fmt = os.path.splitext(path)[1].lstrip('.')
+    fmt = fmt.lower()
+    if fmt not in PARSERS:
+        raise ImportFileError('Unsupported import format `{}`'.format(fmt))
+    parse = PARSERS[fmt]
+
+    count = 0
+    net = 0
+    batch = []
+    categorize = rules.matcher().match
+    cur = db.cursor()
+    with db.transaction(), transactions.deferred_search_index():
+        for created_at, description, amount in _read(path, parse, encoding):
+            category_id = categorize(description, abs(amount))
+            if amount < 0:
+                batch.append((account_id, transactions.WITHDRAWAL_ID, description, -amount, category_id, created_at))
+            else:
+                batch.append((account_id, transactions.DEPOSIT_ID, description, amount, category_id, created_at))
+            net += amount
+            if len(batch) >= batch_size:
+                cur.executemany(INSERT_QUERY, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            cur.executemany(INSERT_QUERY, batch)
+            count += len(batch)
+
+        accounts.post(account_id, net)
+    return count
+
+
+def import_transactions(path, account_id, fmt=None):
+    """
+    Handler for importing transactions from a bank export file
+    """
+    path = os.path.expanduser(path)
+    if not os.path.isfile(path):
+        return 'No file was found at `{}`'.format(path)
+
+    try:
+        account_id = int(account_id)
+    except ValueError:
+        return 'Account ID must be an integer!'
+    if not accounts.exists(account_id):
+        return 'No account was found by the ID `{}`'.format(account_id)
+
+    try:
+        count = import_file(path, account_id, fmt)
+    except ImportFileError as err:
+        return 'Import failed; nothing was imported. {}'.format(err)
+
+    print(color_success('Imported {} transaction(s) into account {}'.format(count, account_id)))
@@ -0,0 +1,443 @@
+"""
+File: migrations.py
+
+Versioned schema migrations for the Oink database.
+
+The schema version of a database is kept in `PRAGMA user_version`;
+`migrate()` applies every migration newer than that version, each in
+its own transaction, and bumps the version as it goes. Databases created
+before migrations existed report version 0, which is why the baseline
+migration only creates what is missing.
+
+Migrations are append-only: never edit one that has been released,
+add a new one to the end of `MIGRATIONS` instead.
+"""
+
+from . import db
+
+
+# Migration 1: the schema as previously created by each module's `setup()`.
+# Deposits are transaction type 0 and withdrawals type 1 (see transactions.py).
+BASELINE = [
+    '''
+    CREATE TABLE IF NOT EXISTS accounts (
+        id integer NOT NULL PRIMARY KEY,
+        account_number text NOT NULL,
+        name text NOT NULL UNIQUE,
+        balance integer NOT NULL,
+        created_at text NOT NULL);
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS categories (
+        id integer NOT NULL PRIMARY KEY,
+        name text NOT NULL UNIQUE);
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS transaction_types (
+        id integer PRIMARY KEY AUTOINCREMENT,
+        name text NOT NULL,
+        UNIQUE(name)
+    );
+    ''',
+    '''
+    INSERT INTO transaction_types (id, name)
+    SELECT 0, 'deposit'
+    WHERE NOT EXISTS(SELECT 1 FROM transaction_types WHERE id = 0 AND name = 'deposit');
+    ''',
+    '''
+    INSERT INTO transaction_types (id, name)
+    SELECT 1, 'withdrawal'
+    WHERE NOT EXISTS(SELECT 1 FROM transaction_types WHERE id = 1 AND name = 'withdrawal');
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS transactions (
+        id integer PRIMARY KEY AUTOINCREMENT,
+        account_id integer NOT NULL,
+        transaction_type_id integer NOT NULL,
+        description text,
+        amount integer NOT NULL,
+        category_id integer,
+        created_at text NOT NULL,
+        FOREIGN KEY (account_id)
+            REFERENCES accounts (id)
+            ON UPDATE CASCADE
+            ON DELETE NO ACTION,
+        FOREIGN KEY (transaction_type_id)
+            REFERENCES transaction_types (id)
+            ON UPDATE CASCADE
+            ON DELETE NO ACTION,
+        FOREIGN KEY (category_id)
+            REFERENCES categories (id)
+            ON UPDATE CASCADE
+            ON DELETE NO ACTION
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS budgets (
+        id integer PRIMARY KEY AUTOINCREMENT,
+        account_id integer NOT NULL,
+        category_id integer NOT NULL,
+        amount integer NOT NULL,
+        created_at text NOT NULL,
+        year integer NOT NULL,
+        month integer NOT NULL,
+        FOREIGN KEY (account_id)
+            REFERENCES accounts (id)
+            ON UPDATE CASCADE
+            ON DELETE NO ACTION,
+        FOREIGN KEY (category_id)
+            REFERENCES categories (id)
+            ON UPDATE CASCADE
+            ON DELETE NO ACTION,
+        UNIQUE(account_id, category_id, month, year)
+    );
+    ''',
+]
+
+# Migration 2: covering indexes for the transaction hot paths.
+# Per-account listings, report totals and as-of balances filter on
+# (account_id, created_at); budget evaluation on
+# (account_id, category_id, created_at). Both carry the type and amount
+# so the sums never have to touch the table itself.
+TRANSACTION_INDEXES = [
+    '''
+    CREATE INDEX IF NOT EXISTS idx_transactions_account_created
+    ON transactions (account_id, created_at, transaction_type_id, amount);
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_transactions_account_category_created
+    ON transactions (account_id, category_id, created_at, transaction_type_id, amount);
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_budgets_period
+    ON budgets (year, month);
+    ''',
+]
+
+# Migration 3: newest-first listings of all accounts page through
+# transactions by (created_at, id); the rowid makes up the `id` part.
+LISTING_INDEXES = [
+    '''
+    CREATE INDEX IF NOT EXISTS idx_transactions_created
+    ON transactions (created_at);
+    ''',
+]
+
+# Migration 4: monthly balance snapshots, backfilled from the existing
+# transactions (superseded by the monthly totals, see migration 9). Deposits (type 0) add to the balance
+# and withdrawals (type 1) take from it.
+BALANCE_SNAPSHOTS = [
+    '''
+    CREATE TABLE IF NOT EXISTS balance_snapshots (
+        account_id integer NOT NULL,
+        month text NOT NULL,
+        net integer NOT NULL,
+        PRIMARY KEY (account_id, month),
+        FOREIGN KEY (account_id)
+            REFERENCES accounts (id)
+            ON UPDATE CASCADE
+            ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    ''',
+    '''
+    INSERT OR REPLACE INTO balance_snapshots (account_id, month, net)
+    SELECT account_id, substr(created_at, 1, 7), SUM(CASE transaction_type_id
+        WHEN 0 THEN amount WHEN 1 THEN -amount ELSE 0 END)
+    FROM transactions
+    GROUP BY account_id, substr(created_at, 1, 7);
+    ''',
+]
+
+# Migration 5: full-text index of transaction descriptions for `find`.
+# An external-content FTS5 table (the text stays in transactions only),
+# kept in step by triggers and filled from the existing transactions.
+# Bulk inserts can set `deferred` to index their rows in one go instead
+# (see transactions.deferred_search_index()).
+DESCRIPTION_SEARCH = [
+    '''
+    CREATE TABLE IF NOT EXISTS transactions_fts_state (
+        deferred integer NOT NULL
+    );
+    ''',
+    '''
+    INSERT INTO transactions_fts_state (deferred)
+    SELECT 0
+    WHERE NOT EXISTS(SELECT 1 FROM transactions_fts_state);
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+        description,
+        content='transactions',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    );
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions
+    WHEN (SELECT deferred FROM transactions_fts_state) = 0 BEGIN
+        INSERT INTO transactions_fts (rowid, description) VALUES (new.id, new.description);
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, description)
+        VALUES ('delete', old.id, old.description);
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF description ON transactions BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, description)
+        VALUES ('delete', old.id, old.description);
+        INSERT INTO transactions_fts (rowid, description) VALUES (new.id, new.description);
+    END;
+    ''',
+    '''
+    INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild');
+    ''',
+]
+
+# Migration 6: rules for categorizing transactions automatically
+# (see rules.py), tried in order of their IDs.
+CATEGORIZATION_RULES = [
+    '''
+    CREATE TABLE IF NOT EXISTS categorization_rules (
+        id integer PRIMARY KEY AUTOINCREMENT,
+        category_id integer NOT NULL,
+        kind text NOT NULL,
+        pattern text,
+        min_amount integer,
+        max_amount integer,
+        created_at text NOT NULL,
+        FOREIGN KEY (category_id)
+            REFERENCES categories (id)
+            ON UPDATE CASCADE
+            ON DELETE CASCADE
+    );
+    ''',
+]
+
+# Migration 7: change tokens of the ledger for the report cache (see
+# report_cache.py). Every change to a transaction or budget gives the
+# month it falls in a new random token; changes to accounts and category
+# names, which may show in any report, give the '' month one. Account
+# balances are left out as they only change along with transactions.
+LEDGER_CHANGES = [
+    '''
+    CREATE TABLE IF NOT EXISTS ledger_changes (
+        month text PRIMARY KEY,
+        token integer NOT NULL
+    ) WITHOUT ROWID;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_changes_transaction_insert AFTER INSERT ON transactions BEGIN
+        REPLACE INTO ledger_changes (month, token) VALUES (substr(new.created_at, 1, 7), random());
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_changes_transaction_delete AFTER DELETE ON transactions BEGIN
+        REPLACE INTO ledger_changes (month, token) VALUES (substr(old.created_at, 1, 7), random());
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_changes_transaction_update AFTER UPDATE ON transactions BEGIN
+        REPLACE INTO ledger_changes (month, token) VALUES (substr(old.created_at, 1, 7), random());
+        REPLACE INTO ledger_changes (month, token) VALUES (substr(new.created_at, 1, 7), random());
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_changes_budget_insert AFTER INSERT ON budgets BEGIN
+        REPLACE INTO ledger_changes (month, token) VALUES (printf('%04d-%02d', new.year, new.month), random());
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_changes_budget_delete AFTER DELETE ON budgets BEGIN
+        REPLACE INTO ledger_changes (month, token) VALUES (printf('%04d-%02d', old.year, old.month), random());
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_changes_budget_update AFTER UPDATE ON budgets BEGIN
+        REPLACE INTO ledger_changes (month, token) VALUES (printf('%04d-%02d', old.year, old.month), random());
+        REPLACE INTO ledger_changes (month, token) VALUES (printf('%04d-%02d', new.year, new.month), random());
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_changes_account_insert AFTER INSERT ON accounts BEGIN
+        REPLACE INTO ledger_changes (month, token) VALUES ('', random());
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_changes_account_delete AFTER DELETE ON accounts BEGIN
+        REPLACE INTO ledger_changes (month, token) VALUES ('', random());
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_changes_account_update
+    AFTER UPDATE OF account_number, name, created_at ON accounts BEGIN
+        REPLACE INTO ledger_changes (month, token) VALUES ('', random());
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_changes_category_update AFTER UPDATE OF name ON categories BEGIN
+        REPLACE INTO ledger_changes (month, token) VALUES ('', random());
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_changes_category_delete AFTER DELETE ON categories BEGIN
+        REPLACE INTO ledger_changes (month, token) VALUES ('', random());
+    END;
+    ''',
+    # Sets this ledger apart from any other
+    '''
+    REPLACE INTO ledger_changes (month, token) VALUES ('', random());
+    ''',
+]
+
+# Migration 8: total amount and number of transactions of each account by
+# month, category (0 for uncategorized) and type (see totals.py), so that
+# budgets and reports sum a row per month rather than every transaction.
+# Kept exact by triggers and filled from the existing transactions.
+MONTHLY_TOTALS = [
+    '''
+    CREATE TABLE IF NOT EXISTS monthly_totals (
+        account_id integer NOT NULL,
+        year integer NOT NULL,
+        month integer NOT NULL,
+        category_id integer NOT NULL,
+        type integer NOT NULL,
+        total integer NOT NULL,
+        count integer NOT NULL,
+        PRIMARY KEY (account_id, year, month, category_id, type)
+    ) WITHOUT ROWID;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS monthly_totals_insert AFTER INSERT ON transactions BEGIN
+        INSERT INTO monthly_totals (account_id, year, month, category_id, type, total, count)
+        VALUES (new.account_id, CAST(substr(new.created_at, 1, 4) AS integer),
+            CAST(substr(new.created_at, 6, 2) AS integer), COALESCE(new.category_id, 0),
+            new.transaction_type_id, new.amount, 1)
+        ON CONFLICT (account_id, year, month, category_id, type)
+        DO UPDATE SET total = total + excluded.total, count = count + 1;
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS monthly_totals_delete AFTER DELETE ON transactions BEGIN
+        UPDATE monthly_totals SET total = total - old.amount, count = count - 1
+        WHERE account_id = old.account_id
+            AND year = CAST(substr(old.created_at, 1, 4) AS integer)
+            AND month = CAST(substr(old.created_at, 6, 2) AS integer)
+            AND category_id = COALESCE(old.category_id, 0)
+            AND type = old.transaction_type_id;
+        DELETE FROM monthly_totals
+        WHERE account_id = old.account_id
+            AND year = CAST(substr(old.created_at, 1, 4) AS integer)
+            AND month = CAST(substr(old.created_at, 6, 2) AS integer)
+            AND category_id = COALESCE(old.category_id, 0)
+            AND type = old.transaction_type_id
+            AND count = 0;
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS monthly_totals_update
+    AFTER UPDATE OF account_id, transaction_type_id, amount, category_id, created_at ON transactions BEGIN
+        UPDATE monthly_totals SET total = total - old.amount, count = count - 1
+        WHERE account_id = old.account_id
+            AND year = CAST(substr(old.created_at, 1, 4) AS integer)
+            AND month = CAST(substr(old.created_at, 6, 2) AS integer)
+            AND category_id = COALESCE(old.category_id, 0)
+            AND type = old.transaction_type_id;
+        DELETE FROM monthly_totals
+        WHERE account_id = old.account_id
+            AND year = CAST(substr(old.created_at, 1, 4) AS integer)
+            AND month = CAST(substr(old.created_at, 6, 2) AS integer)
+            AND category_id = COALESCE(old.category_id, 0)
+            AND type = old.transaction_type_id
+            AND count = 0;
+        INSERT INTO monthly_totals (account_id, year, month, category_id, type, total, count)
+        VALUES (new.account_id, CAST(substr(new.created_at, 1, 4) AS integer),
+            CAST(substr(new.created_at, 6, 2) AS integer), COALESCE(new.category_id, 0),
+            new.transaction_type_id, new.amount, 1)
+        ON CONFLICT (account_id, year, month, category_id, type)
+        DO UPDATE SET total = total + excluded.total, count = count + 1;
+    END;
+    ''',
+    '''
+    INSERT OR REPLACE INTO monthly_totals (account_id, year, month, category_id, type, total, count)
+    SELECT account_id, CAST(substr(created_at, 1, 4) AS integer), CAST(substr(created_at, 6, 2) AS integer),
+        COALESCE(category_id, 0), transaction_type_id, SUM(amount), COUNT(*)
+    FROM transactions
+    GROUP BY 1, 2, 3, 4, 5;
+    ''',
+]
+
+# Migration 9: the balance snapshots of migration 4 only held each month's
+# net change, which the monthly totals give just as well; unlike them,
+# they were only kept up to date by `accounts.post()`.
+DROP_BALANCE_SNAPSHOTS = [
+    '''
+    DROP TABLE IF EXISTS balance_snapshots;
+    ''',
+]
+
+# Ordered list of (version, description, statements)
+MIGRATIONS = [
+    (1, 'Baseline schema', BASELINE),
+    (2, 'Covering indexes for transactions and budgets', TRANSACTION_INDEXES),
+    (3, 'Index for paginated transaction listings', LISTING_INDEXES),
+    (4, 'Monthly balance snapshots', BALANCE_SNAPSHOTS),
+    (5, 'Full-text search of transaction descriptions', DESCRIPTION_SEARCH),
+    (6, 'Categorization rules', CATEGORIZATION_RULES),
+    (7, 'Ledger change tokens for the report cache', LEDGER_CHANGES),
+    (8, 'Monthly totals of transactions', MONTHLY_TOTALS),
+    (9, 'Drop the balance snapshots for the monthly totals', DROP_BALANCE_SNAPSHOTS),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def version():
+    """
+    The schema version of the connected database
+    """
+    return db.cursor().execute('PRAGMA user_version').fetchone()[0]
+
+
+def pending():
+    """
+    The migrations which have yet to be applied to the connected database
+    """
+    current = version()
+    return [migration for migration in MIGRATIONS if migration[0] > current]
+
+
+def migrate(target=LATEST_VERSION):
+    """
+    Brings the connected database up to schema version `target`.
+    Each migration runs in its own transaction together with the
+    version bump, so an interrupted upgrade resumes where it left off.
+    Returns the list of versions that were applied.
+    """
+    applied = []
+    cur = db.cursor()
+
+    # Cheap check first so an up-to-date database costs a single pragma
+    if version() >= target:
+        return applied
+
+    for number, _, statements in MIGRATIONS:
+        if number > target:
+            break
+
+        # The write lock is taken before re-checking the version,
+        # in case another process is migrating the same database
+        with db.transaction():
+            if version() >= number:
+                continue
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute('PRAGMA user_version = {:d}'.format(number))
+        applied.append(number)
+
+    if applied:
+        cur.execute('PRAGMA optimize')
+    return applied
@@ -0,0 +1,272 @@
+"""
+File: report_cache.py
+
+Persistent cache of report data, so that reports over date ranges where
+nothing has changed are not built again.
+
+Entries are keyed by the date range and the change tokens of the ledger.
+Every change to a transaction or budget gives the month it falls in a
+new random token in the `ledger_changes` table. Triggers keep that table
+up to date (see migration 7). Changes that may show in any report, such
+as account details and category names, give the '' month a new token.
+The report for a range depends on every month up to its end, as those
+months make up the balances. So its key hashes the tokens of those
+months, and a change after the range leaves its entry valid. The tokens
+are random rather than counted, so copies of a ledger changed apart
+(e.g. synced through Dropbox) can never share a key.
+
+What is cached are the rows the report queries return, with money left
+atomic, so any report format can be built from them. Entries are kept
+in an SQLite database of their own, and the least recently used are
+evicted to keep it within `max_size` bytes. The transaction rows of an
+entry are stored in compressed chunks of `CHUNK_ROWS`: they are written
+as the report streams them and read back a chunk at a time, so neither
+building nor reading an entry holds it in memory whole. An entry is
+written in a single transaction of the cache database, so it is only
+ever seen complete; a report built while another is being cached is
+not cached.
+"""
+
+import hashlib
+import json
+import sqlite3
+import zlib
+from contextlib import closing
+
+from . import db, totals
+
+# Default bound on the size of the cache, in bytes
+MAX_SIZE = 64 * 1024 * 1024
+
+# Transaction rows stored (and read back) together, compressed
+CHUNK_ROWS = 1000
+
+# The cache database, None while caching is off (the default). The
+# command line keeps it in ~/.oink/ (see cli.main())
+path = None
+
+# Bound on the size of the cache, in bytes
+max_size = MAX_SIZE
+
+# Layout of the cache database; the entries of any other are dropped
+FORMAT = 2
+
+SCHEMA = '''
+    DROP TABLE IF EXISTS reports;
+    DROP TABLE IF EXISTS report_rows;
+    CREATE TABLE reports (
+        key text PRIMARY KEY,
+        from_date text NOT NULL,
+        to_date text NOT NULL,
+        data blob NOT NULL,
+        size integer NOT NULL,
+        used integer NOT NULL
+    );
+    CREATE TABLE report_rows (
+        key text NOT NULL,
+        seq integer NOT NULL,
+        data blob NOT NULL,
+        PRIMARY KEY (key, seq)
+    ) WITHOUT ROWID;
+    PRAGMA user_version = {};
+    '''.format(FORMAT)
+
+# Evicts the least recently used entries beyond the first `?` bytes;
+# `used` counts up with every use of an entry
+EVICT_QUERY = '''
+    DELETE FROM reports WHERE key IN (
+        SELECT key FROM (
+            SELECT key, SUM(size) OVER (ORDER BY used DESC ROWS UNBOUNDED PRECEDING) AS total
+            FROM reports)
+        WHERE total > ?)
+    '''
+
+# Drops the rows of the entries that were evicted or replaced
+ORPHANS_QUERY = 'DELETE FROM report_rows WHERE key NOT IN (SELECT key FROM reports)'
+
+
+def configure(cache_path, size=MAX_SIZE):
+    """
+    Caches reports in the database at `cache_path`, within `size` bytes.
+    A `size` of 0 (or no `cache_path`) turns caching off.
+    """
+    global path, max_size
+    path = cache_path if size else None
+    max_size = size
+
+
+def _connect():
+    # In autocommit mode, as transactions are begun explicitly. Nothing
+    # waits on a lock: the cache only ever saves time, so a report is
+    # built (or left uncached) rather than kept waiting
+    connection = sqlite3.connect(path, timeout=0, isolation_level=None)
+    try:
+        if connection.execute('PRAGMA user_version').fetchone()[0] != FORMAT:
+            # Readers don't block the writer of an entry, nor it them
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.executescript('BEGIN IMMEDIATE;' + SCHEMA + 'COMMIT;')
+    except sqlite3.Error:
+        connection.close()
+        raise
+    return connection
+
+
+def _dump(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode())
+
+
+def _load(blob):
+    return json.loads(zlib.decompress(blob).decode())
+
+
+def key(from_date, to_date):
+    """
+    The cache key of the report for `from_date` to `to_date` as the
+    ledger is now, or None while caching is off
+    """
+    if path is None:
+        return None
+    digest = hashlib.sha1(json.dumps([from_date, to_date]).encode())
+    # Every month up to the end of the range, which for a year-only
+    # `to_date` (as budget periods allow) is the end of that year
+    rows = db.cursor().execute('SELECT month, token FROM ledger_changes \
+        WHERE month < ? ORDER BY month', (totals.bound(to_date),))
+    for month, token in rows:
+        digest.update('{}:{};'.format(month, token).encode())
+    return digest.hexdigest()
+
+
+def get(cache_key):
+    """
+    The `(data, rows)` cached under `cache_key`, or None if there is
+    none. The transaction `rows` are read from the cache as they are
+    iterated over, from a snapshot of the entry as it was when found.
+    """
+    if cache_key is None:
+        return None
+    try:
+        connection = _connect()
+    except sqlite3.Error:
+        # The cache only ever saves time; a report is built without it
+        return None
+    try:
+        try:
+            connection.execute('UPDATE reports SET used = (SELECT MAX(used) + 1 FROM reports) \
+                WHERE key = ?', (cache_key,))
+        except sqlite3.OperationalError:
+            pass  # Another report is being cached; recency is only a hint
+        connection.execute('BEGIN')
+        row = connection.execute('SELECT data FROM reports WHERE key = ?', (cache_key,)).fetchone()
+    except sqlite3.Error:
+        row = None
+    if row is None:
+        connection.close()
+        return None
+    return _load(row[0]), _read_rows(connection, cache_key)
+
+
+def _read_rows(connection, cache_key):
+    with closing(connection):
+        chunks = connection.execute('SELECT data FROM report_rows WHERE key = ? ORDER BY seq', (cache_key,))
+        for chunk, in chunks:
+            for row in _load(chunk):
+                yield row
+
+
+def put(cache_key, from_date, to_date, data, rows=()):
+    """
+    Caches the report `data` (any JSON-serializable value) and its
+    transaction `rows` for `from_date` to `to_date` under `cache_key`
+    (see `caching()`)
+    """
+    for _ in caching(cache_key, from_date, to_date, data, rows):
+        pass
+
+
+def caching(cache_key, from_date, to_date, data, rows):
+    """
+    Passes the transaction `rows` of a report through, caching them with
+    the report `data` for `from_date` to `to_date` under `cache_key` as
+    they are read. The entry replaces those for the range as the ledger
+    was before once every row has been read. Nothing is cached should
+    the rows not all be read, or the entry outgrow the cache.
+    """
+    connection = _begin(cache_key, from_date, to_date)
+    head = _dump(data)
+    size = len(head)
+    chunk = []
+    try:
+        for row in rows:
+            yield row
+            if connection is None:
+                continue
+            chunk.append(row)
+            if len(chunk) == CHUNK_ROWS:
+                size = _insert(connection, cache_key, chunk, size)
+                chunk = []
+                if size is None:
+                    connection.close()
+                    connection = None
+        if connection is not None:
+            size = _insert(connection, cache_key, chunk, size)
+            if size is not None:
+                _commit(connection, cache_key, from_date, to_date, head, size)
+    finally:
+        if connection is not None:
+            connection.close()
+
+
+def _begin(cache_key, from_date, to_date):
+    """
+    A connection to the cache in the transaction writing the entry for
+    `from_date` to `to_date` under `cache_key`, or None if it is not to
+    be cached
+    """
+    if cache_key is None:
+        return None
+    try:
+        connection = _connect()
+    except sqlite3.Error:
+        return None
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute('DELETE FROM reports WHERE key = ? OR (from_date = ? AND to_date = ?)',
+            (cache_key, from_date, to_date))
+        connection.execute(ORPHANS_QUERY)
+    except sqlite3.Error:
+        connection.close()
+        return None
+    return connection
+
+
+def _insert(connection, cache_key, chunk, size):
+    """
+    Writes the `chunk` of rows of the entry under `cache_key`, which is
+    `size` bytes so far. Returns its size after, or None if it has grown
+    too large to cache or could not be written.
+    """
+    if not chunk:
+        return size
+    blob = _dump(chunk)
+    size += len(blob)
+    if size > max_size:
+        return None
+    try:
+        connection.execute('INSERT INTO report_rows (key, seq, data) VALUES (?, \
+            (SELECT COALESCE(MAX(seq), -1) + 1 FROM report_rows WHERE key = ?), ?)',
+            (cache_key, cache_key, blob))
+    except sqlite3.Error:
+        return None
+    return size
+
+
+def _commit(connection, cache_key, from_date, to_date, head, size):
+    try:
+        connection.execute('INSERT INTO reports (key, from_date, to_date, data, size, used) \
+            VALUES (?, ?, ?, ?, ?, (SELECT COALESCE(MAX(used), 0) + 1 FROM reports))',
+            (cache_key, from_date, to_date, head, size))
+        connection.execute(EVICT_QUERY, (max_size,))
+        connection.execute(ORPHANS_QUERY)
+        connection.execute('COMMIT')
+    except sqlite3.Error:
+        pass
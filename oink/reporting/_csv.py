@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+"""
+File: _csv.py
+
+Implements the .csv report generation for Oink
+"""
+
+import csv
+import gzip
+
+from .. import transactions
+from . import reports
+
+HEADER = [
+    'record', 'account_id', 'account_number', 'account_name', 'id', 'created_at',
+    'type', 'description', 'category', 'amount', 'balance', 'year', 'month',
+]
+
+
+def atomic(value):
+    """
+    Leaves a money amount atomic, to be written out by `decimal()`
+    """
+    return value
+
+
+# How money amounts are formatted in the report
+MONEY = atomic
+
+
+def decimal(value):
+    """
+    Formats an atomic money `value` as a plain decimal string
+    (e.g. -4210 => '-42.10') that spreadsheets read as a number
+    """
+    sign = '-' if value < 0 else ''
+    return '{}{}.{:02d}'.format(sign, abs(value) // 100, abs(value) % 100)
+
+
+def generate_report(from_date, to_date, filepath, data=None):
+    """
+    Generates a CSV Oink report for the date range `from_date` to
+    `to_date` and saves it to a UTF-8 file at `filepath`, gzipped if
+    it ends in `.gz`. `data` is the `(report, accounts)` of
+    `reports.iter_report_data()` if already being read.
+    """
+    report, accts = data or reports.iter_report_data(from_date, to_date, MONEY)
+
+    if filepath.lower().endswith('.gz'):
+        fout = gzip.open(filepath, 'wt', encoding='utf-8', newline='')
+    else:
+        fout = open(filepath, 'w', encoding='utf-8', newline='')
+    with fout:
+        write_report(report, accts, fout)
+
+
+def write_report(report, accts, fout):
+    """
+    Streams a report out to `fout` as CSV: one row for every transaction
+    then every budget of each account, written as they are read from
+    the database so that memory use does not grow with the date range.
+    `accts` must have money amounts left as atomic integers.
+    """
+    writer = csv.writer(fout)
+    writer.writerow(HEADER)
+    for acct in accts:
+        account = [acct['id'], acct['account_number'], acct['name']]
+        writer.writerows(_transaction_rows(account, acct['transactions']))
+        writer.writerows(_budget_rows(account, acct['budgets']))
+
+
+def _transaction_rows(account, trans):
+    for tran in trans:
+        amount = tran['amount']
+        if tran['type']['id'] == transactions.WITHDRAWAL_ID:
+            amount = -amount
+        yield ['transaction'] + account + [
+            tran['id'],
+            tran['created_at'],
+            tran['type']['name'],
+            tran['description'],
+            tran['category']['name'],
+            decimal(amount),
+            decimal(tran['balance']),
+            tran['created_at'][:4],
+            tran['created_at'][5:7],
+        ]
+
+
+def _budget_rows(account, buds):
+    for bud in buds:
+        yield ['budget'] + account + [
+            bud['id'],
+            bud['created_at'],
+            '',
+            '',
+            bud['category']['name'],
+            decimal(bud['amount']),
+            decimal(bud['balance']),
+            bud['year'],
+            '{:02d}'.format(bud['month']),
+        ]
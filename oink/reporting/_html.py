@@ -1,127 +1,209 @@
 #!/usr/bin/python3
-'''
+"""
 File: _html.py
 Author: Zachary King
 
 Implements the .html report generation for Oink
+
+The report is rendered from a handful of templates, each filled in with
+HTML-escaped values and written out as soon as its data is read, so the
+document is streamed straight from the report data generators. Table rows,
+written once per transaction, are plain format strings rather than
+`string.Template`s, which cost a regular expression pass each. The
+transactions of an account are split into pages of `PAGE_SIZE` rows,
+each one a section of its own linked to its neighbours, which browsers
+only lay out when scrolled to (and print one per sheet), so that even
+reports over years of transactions open quickly.
+"""
+
+import html
+from string import Template
+
+from .. import transactions, utils
+from . import reports
+
+# How money amounts are formatted in the report
+MONEY = utils.format_money
+
+# Transactions per page of an account's transactions
+PAGE_SIZE = 500
+
+DOCUMENT_START = Template('''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Oink Report | $from_date to $to_date</title>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; margin: 1em 0; }
+th, td { border: 1px solid #ccc; padding: 0.2em 0.6em; }
+td.money { text-align: right; font-variant-numeric: tabular-nums; }
+section.page { content-visibility: auto; contain-intrinsic-size: auto 40em; }
+@media print { section.page { break-after: page; } nav { display: none; } }
+</style>
+</head>
+<body>
+<header>
+<h1>Oink Report</h1>
+<p>Generated at $created_at for $from_date to $to_date</p>
+</header>
+''')
+
+ACCOUNT_START = Template('''<article class="account" id="account-$id">
+<h2>$name</h2>
+<table>
+<tr><th>Account #</th><td>$account_number</td></tr>
+<tr><th>Balance</th><td class="money">$balance</td></tr>
+<tr><th>Created At</th><td>$created_at</td></tr>
+<tr><th>Total Income</th><td class="money">$total_income</td></tr>
+<tr><th>Total Expenses</th><td class="money">$total_expenses</td></tr>
+<tr><th>Total Revenue</th><td class="money">$total_revenue</td></tr>
+</table>
+<h3>Transactions</h3>
+''')
+
+PAGE_START = Template('''<section class="page" id="account-$account_id-page-$page">
+<h4>Page $page</h4>
+<table>
+<thead><tr><th>Transaction #</th><th>Created At</th><th>Description</th><th>Category</th><th>Amount</th><th>Balance</th></tr></thead>
+<tbody>
+''')
+
+TRANSACTION_ROW = ('<tr><td>{id}</td><td>{created_at}</td><td>{description}</td>'
+    '<td>{category}</td><td class="money">{amount}</td><td class="money">{balance}</td></tr>\n')
+
+PAGE_END = Template('''</tbody>
+</table>
+<nav>$previous $next</nav>
+</section>
+''')
+
+PAGE_LINK = Template('<a href="#account-$account_id-page-$page">$label</a>')
+
+NO_TRANSACTIONS = '<p>No transactions for this account</p>\n'
+
+BUDGETS_START = '''<h3>Budgets</h3>
+<table>
+<thead><tr><th>ID</th><th>Category</th><th>Year</th><th>Month</th><th>Amount</th><th>Balance</th><th>Created At</th></tr></thead>
+<tbody>
 '''
 
-from datetime import datetime
-import locale
-
-from tabulate import tabulate
-
-from .. import accounts, db
-
-REPORT_WIDTH = 100
-
-def generate_html_report(acct_no, acct_name, filepath):
-    '''Generates a .TXT budgeting report'''
-
-    # Append .html to filepath if not there already
-    if not filepath.lower().endswith('.html'):
-        filepath += '.html'
-
-    locale.setlocale(locale.LC_ALL, '')
-
-    with open(filepath, 'w') as fout:
-        # Write the HTML static elements
-        fout.write('<!DOCTYPE html><html lang="en"><head><meta charset="utf-8" /><title>Oink Report | ')
-        fout.write(acct_name + ' | ' + datetime.now().strftime('%Y-%m'))
-        fout.write('</title></head><body>')
-
-        # Write the header info (date & account info)
-        fout.write('<hr />')
-        fout.write('<h1>OINK REPORT</h1>')
-        fout.write('<br />')
-        fout.write('<h2>Generated on ' + datetime.now().strftime('%Y-%m-%d') + ' for the month of ' + datetime.now().strftime('%Y-%m') + '</h2>')
-        fout.write('<hr /><br />')
-
-        fout.write('<h2>Account Information</h2>')
-        fout.write('<p id="account_name">Account: ' + acct_name + '</p>')
-        fout.write('<p id="account_number">Account #' + str(acct_no) + '</p>')
-        fout.write('<br />')
-
-        # Output balance and totals
-        balance = accounts.get_balance(acct_name)
-        if balance < 0:
-            balance = '-' + locale.currency(-1 * balance, grouping=True)
-        else:
-            balance = locale.currency(balance, grouping=True)
-        fout.write('<p id="current_balance">Current Balance: ' + balance + '</p>')
-
-        sql = 'SELECT TOTAL(amount) FROM transactions WHERE credit = {} AND acct = "{}" AND recorded_on LIKE "{}-%%"'
-        cur = db.cursor()
-        total_income = cur.execute(sql.format(0, acct_name, datetime.now().strftime('%Y-%m'))).fetchone()[0]
-        total_expenses = cur.execute(sql.format(1, acct_name, datetime.now().strftime('%Y-%m'))).fetchone()[0]
-        total_revenue = total_income - total_expenses
-
-        fout.write('<p id="total_income">Total Income: ' + locale.currency(total_income, grouping=True) + '</p>')
-        fout.write('<p id="total_expenses">Total Expenses: ' + locale.currency(total_expenses, grouping=True) + '</p>')
-        if total_revenue < 0:
-            total_revenue = '-' + locale.currency(-1 * total_revenue, grouping=True)
-        else:
-            total_revenue = locale.currency(total_revenue, grouping=True)
-        fout.write('<p id="total_revenue">Total Revenue: ' + total_revenue + '</p>')
-        fout.write('<br /><hr /><br /><h2>Budgets</h2>')
-
-        # Output the budgets table
-        budget_month = datetime.now().strftime('%Y-%m')
-
-        # Loop through budgets, and for the account that is attached to it
-        # loop through its transactions, matching the budget category;
-        # then evaluate the budget result (overbudget or underbudget)
-        budget_cur = db.cursor()
-        trans_cur = db.cursor()
-        rows = []
-        for budget in budget_cur.execute('SELECT category_name, budget_amount, budget_acct \
-            FROM budget_categories WHERE month = "{}"'.format(budget_month)):
-            result = budget[1] # Budget amount
-            transaction_query = 'SELECT credit, amount FROM transactions \
-                WHERE acct = "{}" AND budget_category = "{}" AND recorded_on LIKE "{}"'
-            transaction_query = transaction_query.format(
-                budget[2], budget[0], budget_month + '%')
-
-            for transaction in trans_cur.execute(transaction_query):
-                if transaction[0] == 1:
-                    result -= transaction[1]
-                else:
-                    result += transaction[1]
-            if result > 0: # Good; means budget has not run out
-                result = '+' + locale.currency(result, grouping=True)
-            else:
-                result = '-' + locale.currency(-1 * result, grouping=True)
-            rows.append([budget[0], locale.currency(budget[1], grouping=True), result])
-
-        table = tabulate(rows, headers=['Category', 'Budget', 'Balance'], tablefmt='html')
-        fout.write(table)
-        fout.write('<br /><hr /><br /><h2>Transactions</h2>')
-
-        # Output the transactions table
-        cur.execute('SELECT trans_id, description, credit, amount, budget_category, \
-            recorded_on FROM transactions WHERE acct = "{}" ORDER BY recorded_on \
-            DESC'.format(acct_name))
-        rows = cur.fetchall()
-
-        # Place (+/-) in front of amount in response to credit/debit
-        new_rows = []
-        for row in rows:
-            str_amount = ''
-            if row[2] == 1: # Credit
-                str_amount = '-' + str(locale.currency(row[3], grouping=True))
-            else:
-                str_amount = '+' + str(locale.currency(row[3], grouping=True))
-            new_rows.append(row[:2] + (str_amount,) + row[3:])
-
-        table = tabulate(
-            new_rows,
-            headers=[
-                'Transaction #', 'Description',
-                'Amount', 'Category', 'Recorded On'],
-            tablefmt='html'
-        )
-
-        fout.write(table)
-
-        # Write end HTML
-        fout.write('</body></html')
+BUDGET_ROW = ('<tr><td>{id}</td><td>{category}</td><td>{year}</td><td>{month}</td>'
+    '<td class="money">{amount}</td><td class="money">{balance}</td><td>{created_at}</td></tr>\n')
+
+BUDGETS_END = '</tbody>\n</table>\n'
+
+NO_BUDGETS = '<h3>Budgets</h3>\n<p>No budgets for this account yet</p>\n'
+
+ACCOUNT_END = '</article>\n'
+
+DOCUMENT_END = '</body>\n</html>\n'
+
+
+def escape(value):
+    """
+    HTML-escapes `value` for the report (None as blank)
+    """
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return html.escape(value)
+    # Numbers have nothing to escape
+    return value
+
+
+def render(template, **values):
+    """
+    Fills in `template` (a `string.Template` or a format string) with
+    `values`, HTML-escaped
+    """
+    values = {key: escape(value) for key, value in values.items()}
+    if isinstance(template, Template):
+        return template.substitute(values)
+    return template.format(**values)
+
+
+def generate_report(from_date, to_date, filepath, data=None):
+    """
+    Generates an HTML Oink report for the date range
+    `from_date` to `to_date` and saves it to a file at `filepath`.
+    `data` is the `(report, accounts)` of `reports.iter_report_data()`
+    if already being read.
+    """
+    report, accts = data or reports.iter_report_data(from_date, to_date, MONEY)
+
+    # Whatever the locale, as the document declares
+    with open(filepath, 'w', encoding='utf-8') as fout:
+        write_report(report, accts, fout)
+
+
+def write_report(report, accts, fout, page_size=PAGE_SIZE):
+    """
+    Streams a report out to `fout` as an HTML document, one account and
+    one transaction at a time, so that memory use does not grow with the
+    size of the date range.
+    """
+    fout.write(render(DOCUMENT_START, **report))
+    for acct in accts:
+        fout.write(render(ACCOUNT_START, **{key: value for key, value in acct.items()
+            if key not in ('transactions', 'budgets')}))
+        _write_transactions(acct['id'], acct['transactions'], fout, page_size)
+        _write_budgets(acct['budgets'], fout)
+        fout.write(ACCOUNT_END)
+    fout.write(DOCUMENT_END)
+
+
+def _page_link(account_id, page, label):
+    # Built from trusted values, so it is not escaped again by `render()`
+    return PAGE_LINK.substitute(account_id=account_id, page=page, label=label)
+
+
+def _write_transactions(account_id, trans, fout, page_size):
+    page = 0
+    for i, tran in enumerate(trans):
+        if i % page_size == 0:
+            if page:
+                _end_page(account_id, page, fout, has_next=True)
+            page += 1
+            fout.write(render(PAGE_START, account_id=account_id, page=page))
+
+        amount = tran['amount']
+        if tran['type']['id'] == transactions.WITHDRAWAL_ID:
+            amount = '-{}'.format(amount)
+        elif tran['type']['id'] == transactions.DEPOSIT_ID:
+            amount = '+{}'.format(amount)
+        fout.write(render(TRANSACTION_ROW,
+            id=tran['id'],
+            created_at=tran['created_at'],
+            description=tran['description'],
+            category=tran['category']['name'],
+            amount=amount,
+            balance=tran['balance']))
+
+    if page:
+        _end_page(account_id, page, fout, has_next=False)
+    else:
+        fout.write(NO_TRANSACTIONS)
+
+
+def _end_page(account_id, page, fout, has_next):
+    previous = _page_link(account_id, page - 1, '&larr; Previous') if page > 1 else ''
+    following = _page_link(account_id, page + 1, 'Next &rarr;') if has_next else ''
+    fout.write(PAGE_END.substitute(previous=previous, next=following))
+
+
+def _write_budgets(buds, fout):
+    if not buds:
+        fout.write(NO_BUDGETS)
+        return
+    fout.write(BUDGETS_START)
+    for bud in buds:
+        fout.write(render(BUDGET_ROW,
+            id=bud['id'],
+            category=bud['category']['name'],
+            year=bud['year'],
+            month=bud['month'],
+            amount=bud['amount'],
+            balance=bud['balance'],
+            created_at=bud['created_at']))
+    fout.write(BUDGETS_END)
@@ -8,16 +8,60 @@ Implements the .json report generation for Oink
 
 import json
 
+from .. import utils
 from . import reports
 
+# How money amounts are formatted in the report
+MONEY = utils.format_money
 
-def generate_report(from_date, to_date, filepath):
+
+def generate_report(from_date, to_date, filepath, data=None):
     """
     Generates a JSON Oink report for
     the date range `from_date` to `to_date`
     and saves it to a file at `filepath`.
+    `data` is the `(report, accounts)` of `reports.iter_report_data()`
+    if already being read.
     """
-    report = reports.generate_report_data(from_date, to_date)
+    report, accts = data or reports.iter_report_data(from_date, to_date, MONEY)
 
     with open(filepath, 'w') as fout:
-        json.dump(report, fout)
+        write_report(report, accts, fout)
+
+
+def write_report(report, accts, fout):
+    """
+    Streams a report out to `fout` as JSON, one account and
+    one transaction at a time, so that memory use does not grow
+    with the size of the date range. Produces the same document
+    as `json.dump()` of `reports.generate_report_data()`.
+    """
+    encode = json.JSONEncoder().encode
+
+    fout.write('{"report": ' + encode(report) + ', "accounts": {')
+    for i, acct in enumerate(accts):
+        if i:
+            fout.write(', ')
+        fout.write(encode(str(acct['id'])) + ': {')
+        for j, (key, value) in enumerate(acct.items()):
+            if j:
+                fout.write(', ')
+            fout.write(encode(key) + ': ')
+            if key in ('transactions', 'budgets'):
+                _write_items(value, fout, encode)
+            else:
+                fout.write(encode(value))
+        fout.write('}')
+    fout.write('}}')
+
+
+def _write_items(items, fout, encode):
+    """
+    Writes an iterable of dicts as a JSON object keyed by their 'id'
+    """
+    fout.write('{')
+    for i, item in enumerate(items):
+        if i:
+            fout.write(', ')
+        fout.write(encode(str(item['id'])) + ': ' + encode(item))
+    fout.write('}')
@@ -9,19 +9,31 @@ Implements the .txt report generation for Oink
 from datetime import datetime
 import locale
 
-from tabulate import tabulate
-
-from .. import accounts, db, transactions
+from .. import accounts, db, transactions, utils
+from ..utils import tabulate
 from . import reports
 
 REPORT_WIDTH = 100
 
-def generate_report(from_date, to_date, filepath):
+# How money amounts are formatted in the report
+MONEY = utils.format_money
+
+
+def generate_report(from_date, to_date, filepath, data=None):
     """
-    Generates a text Oink report
+    Generates a text Oink report, from the `(report, accounts)` `data`
+    of `reports.iter_report_data()` if already being read
     """
-    report = reports.generate_report_data(from_date, to_date)
+    report, accts = data or reports.iter_report_data(from_date, to_date, MONEY)
 
+    with open(filepath, 'w') as fout:
+        write_report(report, accts, fout)
+
+
+def write_report(report, accts, fout):
+    """
+    Writes a report out to `fout` as text, one account at a time
+    """
     def hr(num_newlines=1):
         fout.write('-' * REPORT_WIDTH + '\n' * num_newlines)
 
@@ -55,68 +67,69 @@ def generate_report(from_date, to_date, filepath):
             write(text, 0, alignments[i])
         br(trailing_newlines)
 
-    with open(filepath, 'w') as fout:
-        hr(2)
-        write('OINK REPORT', 2, 'center')
-        write('Generated at ' + report['report']['created_at'] + ' for ' + report['report']['from_date'] + ' to ' + report['report']['to_date'], alignment='center')
-        hr(2)
+    hr(2)
+    write('OINK REPORT', 2, 'center')
+    write('Generated at ' + report['created_at'] + ' for ' + report['from_date'] + ' to ' + report['to_date'], alignment='center')
+    hr(2)
+
+    header('Accounts')
+
+    for account in accts:
+        write(f'Account Name: {account["name"]}', alignment='left')
+        write(f'Account #{account["account_number"]}', alignment='left')
+        write(f'Balance: {account["balance"]}', alignment='left')
+        write(f'Created At: {account["created_at"]}', 2, 'left')
+
+        write(f'Total Income  : {account["total_income"]}')
+        write(f'Total Expenses: {account["total_expenses"]}')
+        write(f'Total Revenue : {account["total_revenue"]}', 2)
+
+        subheader('Transactions')
+        br()
+
+        # Write transactional data for account
+        rows = []
+        for trans in account['transactions']:
+            amount = trans['amount']
+            if trans['type']['id'] == transactions.WITHDRAWAL_ID:
+                amount = '-{}'.format(amount)
+            elif trans['type']['id'] == transactions.DEPOSIT_ID:
+                amount = '+{}'.format(amount)
+
+            rows.append([
+                trans["id"],
+                trans['category']['name'],
+                amount,
+                trans['balance'],
+                trans['created_at'],
+            ])
+        if rows:
+            headers = ['Transaction #', 'Category', 'Amount', 'Balance', 'Created At',]
+            fout.write(tabulate(rows, headers=headers, tablefmt='psql', stralign='right'))
+        else:
+            write('< No transactions for this account >', alignment='center')
+
+        br(2)
+        subheader('Budgets')
+        br()
+
+        # Write budget data for account
+        if account['budgets']:
+            rows = []
+            headers = ['ID', 'Category', 'Year', 'Month', 'Amount', 'Balance', 'Created At',]
+            for bud in account['budgets']:
+                rows.append([
+                    bud['id'],
+                    bud['category']['name'],
+                    bud['year'],
+                    bud['month'],
+                    bud['amount'],
+                    bud['balance'],
+                    bud['created_at'],
+                ])
+            fout.write(tabulate(rows, headers=headers, tablefmt='psql', stralign='right'))
+        else:
+            write('< No budgets for this account yet >', alignment='center')
 
-        header('Accounts')
-
-        for account_id, account in report['accounts'].items():
-            write(f'Account Name: {account["name"]}', alignment='left')
-            write(f'Account #{account["account_number"]}', alignment='left')
-            write(f'Balance: {account["balance"]}', alignment='left')
-            write(f'Created At: {account["created_at"]}', 2, 'left')
-
-            write(f'Total Income  : {account["total_income"]}')
-            write(f'Total Expenses: {account["total_expenses"]}')
-            write(f'Total Revenue : {account["total_revenue"]}', 2)
-
-            subheader('Transactions')
-            br()
-
-            # Write transactional data for account
-            if account['transactions']:
-                rows = []
-                for trans in account['transactions'].values():
-                    if trans['type']['id'] == transactions.WITHDRAWAL_ID:
-                        trans['amount'] = '-' + trans['amount']
-                    elif trans['type']['id'] == transactions.DEPOSIT_ID:
-                        trans['amount'] = '+' + trans['amount']
-
-                    rows.append([
-                        trans["id"],
-                        trans['category']['name'],
-                        trans['amount'],
-                        trans['created_at'],
-                    ])
-                headers = ['Transaction #', 'Category', 'Amount', 'Created At',]
-                fout.write(tabulate(rows, headers=headers, tablefmt='psql', stralign='right'))
-            else:
-                write('< No transactions for this account >', alignment='center')
-
-            br(2)
-            subheader('Budgets')
-            br()
-
-            # Write budget data for account
-            if account['budgets']:
-                rows = []
-                headers = ['ID', 'Category', 'Year', 'Month', 'Amount', 'Balance', 'Created At',]
-                for bud in account['budgets'].values():
-                    rows.append([
-                        bud['id'],
-                        bud['category']['name'],
-                        bud['year'],
-                        bud['month'],
-                        bud['amount'],
-                        bud['balance'],
-                        bud['created_at'],
-                    ])
-                fout.write(tabulate(rows, headers=headers, tablefmt='psql', stralign='right'))
-            else:
-                write('< No budgets for this account yet >', alignment='center')
-
-            br(2)
-            hr(2)
+        br(2)
+        hr(2)
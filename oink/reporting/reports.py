@@ -6,197 +6,432 @@ Contains handlers for reporting commands.
 Reports curated budgeting information to file.
 """
 
-from .. import accounts, budget, transactions, db, colorize, category, utils
-from . import _txt, _html, _json
+from .. import accounts, budget, transactions, totals, db, colorize, category, utils, report_cache
+from . import _txt, _html, _json, _csv
 
 import os
 import locale
 import datetime
+import itertools
+import queue
+import concurrent.futures
 
-from tabulate import tabulate
+from ..utils import tabulate
 
 locale.setlocale(locale.LC_ALL, '')
 
-VALID_FORMATS = ('txt', 'json',)  # TODO: add support for 'csv', 'html', 'md', 'pdf',)
+VALID_FORMATS = ('txt', 'json', 'csv', 'html',)  # TODO: add support for 'md', 'pdf',)
+
+# Formats which can be written gzipped, e.g. as `report.csv.gz`
+COMPRESSIBLE_FORMATS = ('csv',)
+
+# The module writing each format
+WRITERS = {
+    'txt': _txt,
+    'json': _json,
+    'csv': _csv,
+    'html': _html,
+}
+
+# Transactions handed to the writers of a multi-format report at a time,
+# and how many batches each writer may have waiting
+FANOUT_BATCH_SIZE = 500
+FANOUT_QUEUE_SIZE = 8
+
+# Marks the end of an account's transactions in a `_Feed`
+_END_OF_ACCOUNT = object()
 
 
 def report(path, from_date, to_date='9999-99-99', fmt=None, month=datetime.datetime.now().month, year=datetime.datetime.now().year):
     """
-    Root handler for the report command
+    Root handler for the report command. `fmt` may list several
+    formats separated by commas (e.g. `txt,json,csv`) to generate the
+    report in each of them at once, to `path` with each one's extension.
     """
 
     # Check if file exists already
     if not path:
-        print('Invalid file path given')
-        return
+        return 'Invalid file path given'
 
     if fmt is None:
         print(colorize.color_warning('Report format not specified; will try to infer from file extension...'))
         try:
             fmt = os.path.split(os.path.expanduser(path))[1].split('.', 1)[1]
         except IndexError:
-            print(colorize.color_error('Unable to infer the report format from file extension'))
-            return
-
-    fmt = fmt.lower()
-    if fmt not in VALID_FORMATS:
-        print(colorize.color_error('[error]') + ' Unsupported report format `{}`'.format(fmt))
-        print('Supported formats are ' + ', '.join([f.lower() for f in VALID_FORMATS]))
-        return
-
-    if not path.lower().endswith(fmt):
-        path += '.' + fmt.lower()
-
-    path = os.path.expanduser(path)
-    dirpath, filepath = os.path.split(path)
-    if not dirpath: # File in same directory
+            return 'Unable to infer the report format from file extension'
+
+    outputs = []
+    for fmt in fmt.lower().split(','):
+        fmt = fmt.strip()
+        compressed = fmt.endswith('.gz')
+        if compressed:
+            fmt = fmt[:-len('.gz')]
+        if fmt not in VALID_FORMATS:
+            return 'Unsupported report format `{}`; supported formats are {}'.format(
+                fmt, ', '.join([f.lower() for f in VALID_FORMATS]))
+        if compressed and fmt not in COMPRESSIBLE_FORMATS:
+            return 'Reports in the `{}` format cannot be gzipped'.format(fmt)
+
+        suffix = fmt + '.gz' if compressed else fmt
+        filepath = path if path.lower().endswith(suffix) else path + '.' + suffix
+        outputs.append((fmt, os.path.expanduser(filepath)))
+
+    for fmt, filepath in outputs:
         if os.path.isfile(filepath):
-            overwrite = input(colorize.color_warning('File already exists. Overwrite it? (y/n): ')).lower()
+            overwrite = input(colorize.color_warning('File `{}` already exists. Overwrite it? (y/n): '.format(filepath))).lower()
             if overwrite in ('n', 'no', '0'):
                 print(colorize.color_info('Report generation cancelled'))
                 return
         else:
             # File doesn't exist so create it
-            with open(path, 'w'):
+            with open(filepath, 'w'):
                 pass
 
-    else: # Directory path was given
-        if not os.path.isfile(path):
-            with open(path, 'w'):
+    if len(outputs) == 1:
+        fmt, filepath = outputs[0]
+        WRITERS[fmt].generate_report(from_date, to_date, filepath)
+    else:
+        generate_reports(from_date, to_date, outputs)
+    for fmt, filepath in outputs:
+        print(colorize.color_success('Report generated and saved to `{}`'.format(filepath)))
+
+
+def generate_reports(from_date, to_date, outputs):
+    """
+    Generates the report for the date range `from_date` to `to_date`
+    in several formats at once, `outputs` being a list of
+    `(format, filepath)`.
+
+    The report data is read from the database once, with money amounts
+    left atomic, and handed over in batches to a writer thread for each
+    format, which formats the amounts its own way. No writer falls more
+    than FANOUT_QUEUE_SIZE batches behind the data pass, so memory use
+    does not grow with the date range.
+    """
+    report, accts = iter_report_data(from_date, to_date, money=lambda value: value)
+    feeds = [_Feed(WRITERS[fmt].MONEY) for fmt, filepath in outputs]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        futures = [executor.submit(_write_report, fmt, from_date, to_date, filepath, report, feed)
+                   for (fmt, filepath), feed in zip(outputs, feeds)]
+        try:
+            for acct in accts:
+                trans = iter(acct.pop('transactions'))
+                for feed in feeds:
+                    feed.put(acct)
+                while True:
+                    batch = list(itertools.islice(trans, FANOUT_BATCH_SIZE))
+                    if not batch:
+                        break
+                    for feed in feeds:
+                        feed.put(batch)
+                for feed in feeds:
+                    feed.put(_END_OF_ACCOUNT)
+        finally:
+            for feed in feeds:
+                feed.put(None)
+
+    # Raises the first error of any writer
+    for future in futures:
+        future.result()
+
+
+def _write_report(fmt, from_date, to_date, filepath, report, feed):
+    try:
+        WRITERS[fmt].generate_report(from_date, to_date, filepath, (dict(report), feed.accounts()))
+    finally:
+        # Keeps the data pass going should the writer have stopped early
+        feed.drain()
+
+
+class _Feed(object):
+    """
+    The report data read by `generate_reports()`, as handed over to the
+    thread writing one of its formats
+    """
+    def __init__(self, money):
+        self.money = money
+        self.queue = queue.Queue(FANOUT_QUEUE_SIZE)
+        self.finished = False
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def get(self):
+        if self.finished:
+            return None
+        item = self.queue.get()
+        if item is None:
+            self.finished = True
+        return item
+
+    def drain(self):
+        while self.get() is not None:
+            pass
+
+    def accounts(self):
+        """
+        Generator of the accounts, shaped like those of `iter_report_data()`
+        """
+        money = self.money
+        while True:
+            acct = self.get()
+            if acct is None:
+                return
+            trans = self._transactions()
+            yield dict(acct,
+                transactions=trans,
+                budgets=[dict(bud, amount=money(bud['amount']), balance=money(bud['balance']))
+                         for bud in acct['budgets']],
+                balance=money(acct['balance']),
+                total_income=money(acct['total_income']),
+                total_expenses=money(acct['total_expenses']),
+                total_revenue=money(acct['total_revenue']))
+            # Skip over the transactions the writer left
+            for _ in trans:
                 pass
-        else:
-            overwrite = input(colorize.color_warning('File already exists. Overwrite it? (y/n): ')).lower()
-            if overwrite in ('n', 'no', '0'):
-                print(colorize.color_info('Report generation cancelled'))
+
+    def _transactions(self):
+        money = self.money
+        while True:
+            batch = self.get()
+            if batch is None or batch is _END_OF_ACCOUNT:
                 return
+            for tran in batch:
+                yield dict(tran, amount=money(tran['amount']), balance=money(tran['balance']))
+
+
+# Balance as of `to_date` and the totals for the period of every account.
+# The months wholly within the period are totalled from the monthly totals
+# (see totals.py), as are the changes made after `to_date` for whole
+# months, so only the transactions of the first and last months of the period are
+# scanned: from :from_date until its month ends (or the last month
+# begins) and from :to_month until :bound. The CROSS JOINs keep SQLite
+# scanning those account by account through the covering index rather
+# than by date, which would have to sort them by account.
+ACCOUNT_TOTALS_QUERY = '''
+    WITH head AS (
+        SELECT a.id AS account_id,
+            SUM(CASE WHEN t.transaction_type_id = :deposit
+                AND t.created_at <= :to_date THEN t.amount END) AS income,
+            SUM(CASE WHEN t.transaction_type_id = :withdrawal
+                AND t.created_at <= :to_date THEN t.amount END) AS expenses
+        FROM accounts a
+        CROSS JOIN transactions t ON t.account_id = a.id
+            AND t.created_at >= :from_date AND t.created_at < MIN(:from_bound, :to_month)
+        GROUP BY a.id
+    ),
+    tail AS (
+        SELECT a.id AS account_id,
+            SUM(CASE WHEN t.created_at > :to_date THEN
+                CASE t.transaction_type_id WHEN :deposit THEN t.amount WHEN :withdrawal THEN -t.amount END
+                END) AS future_net,
+            SUM(CASE WHEN t.transaction_type_id = :deposit
+                AND t.created_at BETWEEN :from_date AND :to_date THEN t.amount END) AS income,
+            SUM(CASE WHEN t.transaction_type_id = :withdrawal
+                AND t.created_at BETWEEN :from_date AND :to_date THEN t.amount END) AS expenses
+        FROM accounts a
+        CROSS JOIN transactions t ON t.account_id = a.id
+            AND t.created_at >= :to_month AND t.created_at < :bound
+        GROUP BY a.id
+    ),
+    months AS (
+        SELECT account_id,
+            SUM(CASE type WHEN :deposit THEN total END) AS income,
+            SUM(CASE type WHEN :withdrawal THEN total END) AS expenses
+        FROM monthly_totals
+        WHERE printf('%04d-%02d', year, month) > :from_bound
+            AND printf('%04d-%02d', year, month) < :to_month
+        GROUP BY account_id
+    )
+    SELECT a.id, a.account_number, a.name, a.balance, a.created_at,
+        COALESCE((SELECT SUM(CASE m.type WHEN :deposit THEN m.total WHEN :withdrawal THEN -m.total END)
+            FROM monthly_totals m
+            WHERE m.account_id = a.id AND printf('%04d-%02d', m.year, m.month) > :bound), 0)
+        + COALESCE(tail.future_net, 0) AS future_net,
+        COALESCE(head.income, 0) + COALESCE(months.income, 0) + COALESCE(tail.income, 0) AS total_income,
+        COALESCE(head.expenses, 0) + COALESCE(months.expenses, 0) + COALESCE(tail.expenses, 0) AS total_expenses
+    FROM accounts a
+    LEFT JOIN head ON head.account_id = a.id
+    LEFT JOIN months ON months.account_id = a.id
+    LEFT JOIN tail ON tail.account_id = a.id
+    ORDER BY a.id
+    '''
+
+# Every transaction within the period, ordered by account so that
+# they can be streamed out account by account, with the net change the
+# account's later transactions within the period made to its balance
+TRANSACTIONS_QUERY = '''
+    SELECT t.id, t.account_id, tt.id, tt.name, t.description, t.amount, c.id, c.name, t.created_at,
+        SUM(CASE t.transaction_type_id WHEN :deposit THEN t.amount WHEN :withdrawal THEN -t.amount ELSE 0 END)
+            OVER (PARTITION BY t.account_id)
+        - SUM(CASE t.transaction_type_id WHEN :deposit THEN t.amount WHEN :withdrawal THEN -t.amount ELSE 0 END)
+            OVER (PARTITION BY t.account_id ORDER BY t.created_at, t.id ROWS UNBOUNDED PRECEDING) AS later_net
+    FROM transactions t
+    LEFT JOIN transaction_types tt ON t.transaction_type_id = tt.id
+    LEFT JOIN categories c ON t.category_id = c.id
+    WHERE t.created_at BETWEEN :from_date AND :to_date
+    ORDER BY t.account_id, t.created_at, t.id
+    '''
+
+
+def _transaction_data(trans, money):
+    return {
+        'id': trans.id,
+        'type': {
+            'id': trans.transaction_type.id,
+            'name': trans.transaction_type.name,
+        },
+        'description': trans.description,
+        'amount': money(trans.amount),
+        'category': {
+            'id': trans.category.id,
+            'name': trans.category.name,
+        },
+        'created_at': trans.created_at,
+    }
 
-    if fmt == 'txt':
-        _report_txt(from_date, to_date, path)
-    elif fmt == 'json':
-        _report_json(from_date, to_date, path)
-    elif fmt == 'csv':
-        _report_csv(acct_id, acct_name, path)
-    elif fmt == 'html':
-        _report_html(acct_id, acct_name, path)
-    elif fmt == 'pdf':
-        _report_pdf(acct_id, acct_name, path)
-    else:
-        print(colorize.color_error('[error]') + ' Unable to generate report')
-        return
-    print(colorize.color_success('Report generated and saved to `{}`'.format(path)))
 
+def _budget_data(bud, money):
+    return {
+        'id': bud.id,
+        'category': {
+            'id': bud.category.id,
+            'name': bud.category.name,
+        },
+        'amount': money(bud.amount),
+        'balance': money(bud.balance),
+        'year': bud.year,
+        'month': bud.month,
+        'created_at': bud.created_at,
+    }
 
-def _report_txt(from_date, to_date, path):
-    _txt.generate_report(from_date, to_date, path)
 
+def _budget_row(bud):
+    """
+    The arguments to make `bud` again from, e.g. once cached
+    """
+    return (bud.id, bud.account_id, bud.category.id, bud.category.name, bud.amount,
+        bud.year, bud.month, bud.created_at, bud.account_name, bud.balance)
 
-def _report_json(from_date, to_date, path):
-    _json.generate_report(from_date, to_date, path)
 
+def _iter_transactions(rows, money, closing_balance):
+    for row in rows:
+        data = _transaction_data(transactions.Transaction(*row[:9]), money)
+        # Running balance of the account after the transaction
+        data['balance'] = money(closing_balance - row[9])
+        yield data
 
-def _report_csv(acct_id, acct_name, path):
-    pass
 
+def query_params(from_date, to_date):
+    """
+    The parameters of the report queries for `from_date` to `to_date`
+    """
+    return {
+        'from_date': from_date,
+        'to_date': to_date,
+        'from_bound': totals.bound(from_date),
+        'to_month': to_date[:7],
+        'bound': totals.bound(to_date),
+        'deposit': transactions.DEPOSIT_ID,
+        'withdrawal': transactions.WITHDRAWAL_ID,
+    }
 
-def _report_html(acct_id, acct_name, path):
-    # _html.generate_html_report(acct_id, acct_name, path)
-    pass
 
+def iter_report_data(from_date, to_date, money=utils.format_money):
+    """
+    Single-pass report data builder.
 
-def _report_pdf(acct_id, acct_name, path):
-    pass
+    Returns a `(report, accounts)` tuple, where `report` describes the
+    report itself and `accounts` is a generator of per-account dicts
+    shaped like those of `generate_report_data`. The 'transactions' of
+    each account are streamed from a single cursor, so they must be
+    consumed (or skipped) before moving on to the next account.
 
+    Money amounts are formatted with `money`.
+    """
+    report = {
+        'created_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'from_date': from_date,
+        'to_date': to_date,
+    }
 
-def generate_report_data(from_date, to_date):
+    params = query_params(from_date, to_date)
+
+    # The rows of the report queries, from the cache if the ledger has
+    # not changed since they were last read (see report_cache.py)
+    cache_key = report_cache.key(from_date, to_date)
+    cached = report_cache.get(cache_key)
+    if cached is not None:
+        (account_totals, budget_rows), trans_rows = cached
+    else:
+        cur = db.cursor()
+        account_totals = cur.execute(ACCOUNT_TOTALS_QUERY, params).fetchall()
+        budget_rows = [_budget_row(bud) for bud in budget.list_for_period(from_date, to_date)]
+        trans_rows = None
+
+    buds = {}
+    for row in budget_rows:
+        bud = budget.Budget(*row)
+        buds.setdefault(bud.account_id, []).append(_budget_data(bud, money))
+
+    def accounts_gen():
+        rows = trans_rows
+        if rows is None:
+            rows = db.cursor().execute(TRANSACTIONS_QUERY, params)
+            if cache_key is not None:
+                rows = report_cache.caching(cache_key, from_date, to_date, [account_totals, budget_rows], rows)
+        groups = itertools.groupby(rows, key=lambda row: row[1])
+        group = next(groups, None)
+
+        for row in account_totals:
+            account_id, account_number, name, balance, created_at = row[:5]
+            future_net, total_income, total_expenses = row[5:]
+
+            # Skip over transactions of accounts that are not being reported on
+            while group is not None and group[0] < account_id:
+                group = next(groups, None)
+
+            if group is not None and group[0] == account_id:
+                trans = _iter_transactions(group[1], money, balance - future_net)
+            else:
+                trans = iter(())
+
+            yield {
+                'id': account_id,
+                'account_number': account_number,
+                'name': name,
+                'created_at': created_at,
+                'transactions': trans,
+                'budgets': buds.get(account_id, []),
+                # "Undoes" the transaction effects beyond to_date
+                'balance': money(balance - future_net),
+                'total_income': money(total_income),
+                'total_expenses': money(total_expenses),
+                'total_revenue': money(total_income - total_expenses),
+            }
+
+            if group is not None and group[0] == account_id:
+                group = next(groups, None)
+
+    return report, accounts_gen()
+
+
+def generate_report_data(from_date, to_date, money=utils.format_money):
     """
-    Queries for various data on the account
+    Queries for various data on the accounts
     to be included in a report.
     Returns a dictionary.
     """
+    report, accts = iter_report_data(from_date, to_date, money)
     data = {
-        'report': {
-            'created_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'from_date': from_date,
-            'to_date': to_date,
-        },
+        'report': report,
         'accounts': {},
     }
 
-    cur = db.cursor()
-    accts = accounts.all()
-
-    for account in accts:
-        acct_data = {
-            'id': account.id,
-            'account_number': account.account_number,
-            'name': account.name,
-            'created_at': account.created_at,
-            'transactions': {},
-            'budgets': {},
-        }
-
-        # Need to adjust the balance of the account to
-        # reflect the balance at the end of the given `to_date`
-        future_totals_query = 'SELECT SUM(amount) FROM transactions \
-            WHERE account_id = ? AND transaction_type_id = ? \
-            AND created_at > ?;'
-        future_income = cur.execute(future_totals_query, (account.id, transactions.DEPOSIT_ID, to_date)).fetchone()[0]
-        future_income = future_income if future_income is not None else 0
-        future_expenses = cur.execute(future_totals_query, (account.id, transactions.WITHDRAWAL_ID, to_date)).fetchone()[0]
-        future_expenses = future_expenses if future_expenses is not None else 0
-        acct_data['balance'] = account.balance - future_income + future_expenses  # "Undoes" the transaction effects beyond to_date
-
-        totals_query = 'SELECT SUM(amount) FROM transactions \
-            WHERE account_id = ? AND transaction_type_id = ? \
-            AND created_at BETWEEN ? AND ?;'
-        total_income = cur.execute(totals_query, (account.id, transactions.DEPOSIT_ID, from_date, to_date)).fetchone()[0]
-        acct_data['total_income'] = total_income if total_income is not None else 0
-        total_expenses = cur.execute(totals_query, (account.id, transactions.WITHDRAWAL_ID, from_date, to_date)).fetchone()[0]
-        acct_data['total_expenses'] = total_expenses if total_expenses is not None else 0
-        acct_data['total_revenue'] = acct_data['total_income'] - acct_data['total_expenses']
-
-        # Format currencies
-        acct_data['balance'] = utils.format_money(acct_data['balance'])
-        acct_data['total_income'] = utils.format_money(acct_data['total_income'])
-        acct_data['total_expenses'] = utils.format_money(acct_data['total_expenses'])
-        acct_data['total_revenue'] = utils.format_money(acct_data['total_revenue'])
-
-        # Fetch and build transaction data for account
-        transacts = transactions.list_for_account(account.id, from_date=from_date, to_date=to_date)
-        for trans in transacts:
-            trans_data = {
-                'id': trans.id,
-                'type': {
-                    'id': trans.transaction_type.id,
-                    'name': trans.transaction_type.name,
-                },
-                'description': trans.description,
-                'amount': utils.format_money(trans.amount),
-                'category': {
-                    'id': trans.category.id,
-                    'name': trans.category.name,
-                },
-                'created_at': trans.created_at,
-            }
-            acct_data['transactions'][trans.id] = trans_data
-
-        # Fetch and build budget data for account
-        buds = budget.list_for_account(account.id, from_date=from_date, to_date=to_date)
-        for bud in buds:
-            bud_data  = {
-                'id': bud.id,
-                'category': {
-                    'id': bud.category.id,
-                    'name': bud.category.name,
-                },
-                'amount': utils.format_money(bud.amount),
-                'balance': utils.format_money(bud.balance),
-                'year': bud.year,
-                'month': bud.month,
-                'created_at': bud.created_at,
-            }
-            acct_data['budgets'][bud.id] = bud_data
-
-        data['accounts'][account.id] = acct_data
+    for acct_data in accts:
+        acct_data['transactions'] = {trans['id']: trans for trans in acct_data['transactions']}
+        acct_data['budgets'] = {bud['id']: bud for bud in acct_data['budgets']}
+        data['accounts'][acct_data['id']] = acct_data
 
     return data
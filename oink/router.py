@@ -4,15 +4,41 @@ Handles routing commands to their respective handlers.
 
 from __future__ import print_function
 
+import re
+import types
+
 from .colorize import colorize
 
-# Commands stored via register function.
+# Commands stored via register function, in the order they are shown in help.
+# This includes the "header" and "separator" helper commands.
 commands = []
 
+# Registered commands by keyword, for dispatching
+handlers = {}
+
 # The number of padding between commands and help text
 # This is determined by keeping track of the longest command string
 print_padding = 0
 
+# Pieces of a command line: whitespace between arguments, a "double" or
+# 'single' quoted string (which may be unterminated), an escaped character,
+# or a run of any other characters. Adjacent pieces make up one argument.
+# A backslash only escapes a quote, a backslash or whitespace, so Windows
+# paths can be typed as they are.
+TOKEN_RE = re.compile(r'''
+    (?P<space>\s+)
+    | "(?P<double>(?:[^"\\]|\\.)*)"?
+    | '(?P<single>(?:[^'\\]|\\.)*)'?
+    | \\(?P<escaped>[\s"'\\])
+    | (?P<bare>[^\s"'\\]+|\\)
+''', re.VERBOSE)
+
+ESCAPE_RE = re.compile(r'''\\([\s"'\\])''')
+
+# Bit set in a code object's flags when the function takes *args
+# (inspect.CO_VARARGS)
+CO_VARARGS = 0x04
+
 
 def register(command, help_text, handler):
     '''
@@ -27,9 +53,14 @@ def register(command, help_text, handler):
     optional arguments should set a default value.
 
     Handlers will receive arguments in the order specified in the command.
+    A handler reports failure by returning its error message, which is
+    printed for it; anything falsy means the command succeeded.
+    Raises ValueError if the handler can't be called with those arguments,
+    or if the keyword is already registered. A lazy handler (one with a
+    `resolve()` method returning the actual handler, see cli.lazy()) is
+    checked when its command is first run instead, once resolved.
 
     '''
-    global commands
     global print_padding
 
     bits = command.split()
@@ -37,98 +68,154 @@ def register(command, help_text, handler):
     required_args = [x for x in bits if x[0] == '<']
     optional_args = [x for x in bits if x[0] == '[']
 
-    commands.append({
+    comm = {
         'keyword': keyword,
         'required_args': required_args,
         'optional_args': optional_args,
         'command': command,
         'help_text': help_text,
         'handler': handler
-    })
+    }
+    commands.append(comm)
+
+    # Helper "commands" (headers and separators) only show up in help
+    if handler is None:
+        return
 
-    # print(commands)
+    if keyword in handlers:
+        raise ValueError('The command `{}` is already registered'.format(keyword))
+    if not hasattr(handler, 'resolve'):
+        _check_handler(comm)
+    handlers[keyword] = comm
 
     command_length = len(command)
     if command_length > print_padding:
         print_padding = command_length
 
 
+def _check_handler(comm):
+    '''
+    Ensures the handler of a command accepts as many arguments as the command
+    can be given, and needs no more than the required ones.
+    '''
+    required = len(comm['required_args'])
+    given = required + len(comm['optional_args'])
+    for count in (required, given):
+        error = _bind_error(comm['handler'], count)
+        if error:
+            raise ValueError('The handler for `{}` cannot be called with {} argument(s): {}'.format(
+                comm['command'], count, error))
+
+
+def _bind_error(handler, count):
+    '''
+    Why `handler` can't be called with `count` positional arguments, or
+    None if it can. Plain functions are checked from their code, sparing
+    startup the import of inspect, which is slow; anything else with
+    inspect.signature(). Handlers whose signature can't be inspected
+    (e.g. some builtins) are trusted.
+    '''
+    if isinstance(handler, types.FunctionType):
+        code = handler.__code__
+        fewest = code.co_argcount - len(handler.__defaults__ or ())
+        if code.co_kwonlyargcount > len(handler.__kwdefaults__ or {}):
+            return 'it has keyword-only arguments without defaults'
+        if count < fewest:
+            return 'it needs at least {}'.format(fewest)
+        if count > code.co_argcount and not code.co_flags & CO_VARARGS:
+            return 'it takes at most {}'.format(code.co_argcount)
+        return None
+
+    import inspect
+    try:
+        signature = inspect.signature(handler)
+    except (TypeError, ValueError):
+        return None
+    try:
+        signature.bind(*[None] * count)
+    except TypeError as err:
+        return str(err)
+    return None
+
+
+def tokenize(line):
+    '''
+    Splits a command line into its words. Quotes group words containing
+    spaces into one argument and a backslash escapes the next quote,
+    backslash or space.
+    '''
+    words = []
+    word = None
+    for match in TOKEN_RE.finditer(line):
+        kind = match.lastgroup
+        if kind == 'space':
+            if word is not None:
+                words.append(word)
+            word = None
+            continue
+
+        text = match.group(kind)
+        if kind in ('double', 'single'):
+            text = ESCAPE_RE.sub(r'\1', text)
+        word = text if word is None else word + text
+
+    if word is not None:
+        words.append(word)
+    return words
+
+
 def route(command):
     '''
     Attempts to match a command to a registered handler.
 
     Handles ensuring the required arguments, if any, are given.
+    Returns the error message if the command failed, otherwise None.
 
     '''
-    # Skip printing helper "commands"
-    if command.lower() in ('separator', 'header'):
-        print(colorize('[error]', 'red'), end='')
-        print(' unkown command, type "?" to see commands.')
-        return
+    words = tokenize(command)
+    if not words:
+        return dispatch('', [])
+    return dispatch(words[0], words[1:])
 
-    bits = command.split(' ')
-    keyword = bits[0] # First word (only single word commands supported)
-    argstr = ' '.join(bits[1:])
-    args = []
-
-    # Parse arguments and support spaces
-    cur_arg = ''
-    parsing_arg = False
-    for character in argstr:
-        # Check for quotes surrounding arguments that contain spaces
-        if character == '"' or character == "'": # ' and " trigger parsing flag
-            # Check if end of argument
-            if parsing_arg:
-                # End of argument, add to args list
-                args.append(cur_arg)
-                cur_arg = ''
-
-            # Flip the parsing flag and skip the quote token
-            parsing_arg = not parsing_arg
-            continue
-
-        # Check for spaces; if not parsing a quoted arg, space = delimeter
-        if character == ' ' and not parsing_arg:
-            args.append(cur_arg)
-            cur_arg = ''
-            continue
-
-        # Append the character token to the current arg string
-        cur_arg += character
 
-    if cur_arg != '':
-        args.append(cur_arg)
+def dispatch(keyword, args):
+    '''
+    Calls the handler registered for `keyword` with already split arguments,
+    e.g. those given on the command line.
 
-    while '' in args:
-        args.remove('')
+    Returns the error message if the command failed, otherwise None.
 
-    # Try to find and execute the command
-    for comm in commands:
-        if comm['keyword'] == keyword:
-            error = None
-            given_args_length = len(args)
-            command_args_length = len(comm['required_args'])
-            max_args_length = len(comm['optional_args']) + command_args_length
-
-            if given_args_length < command_args_length:
-                arg_index = command_args_length - given_args_length
-                if arg_index >= len(comm['required_args']):
-                    arg_index = 0
-                error = colorize(comm['required_args'][given_args_length], 'blue') + ' is required'
-            elif given_args_length > max_args_length:
-                error = '{} argument(s) were expected, but {} were given.'.format(
-                    command_args_length, given_args_length)
-            else:
-                # Must be valid arguments list
-                # Call the handler
-                error = comm['handler'](*args)
-
-            if error:
-                print(colorize('[error]', 'red') + ' {}'.format(error))
-
-            return
-
-    print(colorize('[error]', 'red') + ' unkown command, type "?" to see commands.')
+    '''
+    comm = handlers.get(keyword)
+    if comm is None:
+        return _error('unkown command, type "?" to see commands.')
+
+    given_args_length = len(args)
+    command_args_length = len(comm['required_args'])
+    max_args_length = len(comm['optional_args']) + command_args_length
+
+    if given_args_length < command_args_length:
+        error = colorize(comm['required_args'][given_args_length], 'blue') + ' is required'
+    elif given_args_length > max_args_length:
+        error = '{} argument(s) were expected, but {} were given.'.format(
+            command_args_length, given_args_length)
+    else:
+        # Must be valid arguments list
+        if hasattr(comm['handler'], 'resolve'):
+            # Lazy handlers are imported and checked the first time
+            comm['handler'] = comm['handler'].resolve()
+            _check_handler(comm)
+        # Call the handler
+        error = comm['handler'](*args)
+
+    if error:
+        return _error(error)
+    return None
+
+
+def _error(message):
+    print(colorize('[error]', 'red') + ' {}'.format(message))
+    return message
 
 
 def show_help():
@@ -0,0 +1,349 @@
+"""
+File: rules.py
+
+Rules for categorizing transactions automatically, e.g. every
+transaction with "NETFLIX" in its description goes under Entertainment.
+
+A rule matches the description of a transaction (by substring or by
+regular expression, ignoring case), its amount (within an inclusive
+range), or both. Rules are tried in the order they were added and the
+first one to match decides the category.
+
+Rather than testing the rules one at a time, a `Matcher` compiles them:
+every text to look for goes into one Aho-Corasick automaton, which finds
+all of them in a single pass over a description, and the rules are
+grouped by the bands of amounts that their ranges split the amounts
+into. Categorizing a transaction is a bisection to find its band and one
+pass of the automaton, so a large import takes time linear in its size
+whatever the number of text rules. Only the (usually few) regular
+expressions ahead of the best text match are tried on their own.
+"""
+
+from __future__ import print_function
+import bisect
+import collections
+import decimal
+import re
+from datetime import datetime
+
+from . import db, category, utils
+from .utils import tabulate
+from .colorize import color_info, color_success, colorize_headers
+
+# Kinds of rules
+CONTAINS = 'contains'
+REGEX = 'regex'
+AMOUNT = 'amount'
+
+# Transactions re-categorized per batch by `recategorize()`
+BATCH_SIZE = 1000
+
+
+class Rule(object):
+    def __init__(self, id, category_id, category_name, kind, pattern, min_amount, max_amount, created_at):
+        self.id = id
+        self.category = category.Category(category_id, category_name)
+        self.kind = kind
+        self.pattern = pattern
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+        self.created_at = created_at
+
+    def covers(self, amount):
+        """
+        Whether `amount` is within the amount range of the rule
+        """
+        return (self.min_amount is None or self.min_amount <= amount) and \
+            (self.max_amount is None or amount <= self.max_amount)
+
+
+class _Automaton(object):
+    """
+    Aho-Corasick automaton finding every one of a set of strings that
+    occurs in a text in a single pass over it, however many there are.
+    """
+    def __init__(self, strings):
+        # Trie of the strings: transitions and the strings ending at each state
+        self.goto = [{}]
+        self.out = [()]
+        for key, string in strings:
+            state = 0
+            for char in string:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.out.append(())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.out[state] += (key,)
+
+        # Where to carry on from when a character doesn't continue a match:
+        # the state of the longest suffix which is also in the trie
+        self.fail = [0] * len(self.goto)
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, target in self.goto[state].items():
+                queue.append(target)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[target] = self.goto[fallback].get(char, 0)
+                self.out[target] += self.out[self.fail[target]]
+
+    def find(self, text):
+        """
+        The keys of the strings occurring in `text`
+        """
+        goto, fail, out = self.goto, self.fail, self.out
+        found = []
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.extend(out[state])
+        return found
+
+
+class _Band(object):
+    """
+    The rules applying to a band of amounts, by their position in the order
+    """
+    def __init__(self, rules):
+        self.contains = set()
+        self.first_amount = None
+        self.regexes = []
+        for position, rule in rules:
+            if rule.kind == AMOUNT:
+                # Applies to any description, so no later rule can get a look-in
+                self.first_amount = position
+                break
+            if rule.kind == CONTAINS:
+                self.contains.add(position)
+            else:
+                self.regexes.append(position)
+
+
+class Matcher(object):
+    """
+    Categorizes transactions by the first of `rules` (in order) to match.
+    """
+    def __init__(self, rules):
+        self.rules = list(rules)
+        positions = list(enumerate(self.rules))
+        self.automaton = _Automaton([(position, rule.pattern.lower())
+            for position, rule in positions if rule.kind == CONTAINS])
+        self.regexes = {position: re.compile(rule.pattern, re.IGNORECASE)
+            for position, rule in positions if rule.kind == REGEX}
+
+        # Amounts at which the set of rules that may apply changes
+        bounds = set()
+        for rule in self.rules:
+            if rule.min_amount is not None:
+                bounds.add(rule.min_amount)
+            if rule.max_amount is not None:
+                bounds.add(rule.max_amount + 1)
+        self.bounds = sorted(bounds)
+
+        # Band i holds the amounts from bounds[i - 1] up to (not including) bounds[i]
+        self.bands = []
+        for i in range(len(self.bounds) + 1):
+            lowest = self.bounds[i - 1] if i else (self.bounds[0] - 1 if self.bounds else 0)
+            self.bands.append(_Band([(position, rule) for position, rule in positions if rule.covers(lowest)]))
+
+    def match(self, description, amount):
+        """
+        The category ID of the first rule matching a transaction with
+        `description` for `amount` (atomic), or None if none does.
+        """
+        band = self.bands[bisect.bisect_right(self.bounds, amount)]
+        description = description or ''
+        best = band.first_amount
+        for position in self.automaton.find(description.lower()):
+            if position in band.contains and (best is None or position < best):
+                best = position
+        for position in band.regexes:
+            if best is not None and position > best:
+                break
+            if self.regexes[position].search(description):
+                best = position
+                break
+        if best is None:
+            return None
+        return self.rules[best].category.id
+
+
+def all():
+    """
+    Every rule, in the order they are tried
+    """
+    rows = db.cursor().execute('SELECT r.id, r.category_id, c.name, r.kind, r.pattern, \
+        r.min_amount, r.max_amount, r.created_at \
+        FROM categorization_rules r \
+        LEFT JOIN categories c ON r.category_id = c.id \
+        ORDER BY r.id').fetchall()
+    return [Rule(*row) for row in rows]
+
+
+def matcher():
+    """
+    A `Matcher` for the current rules
+    """
+    return Matcher(all())
+
+
+def create(category_id, kind, pattern=None, min_amount=None, max_amount=None):
+    """
+    Adds a rule putting transactions matching `pattern` (for `kind`
+    CONTAINS or REGEX) for an amount from `min_amount` to `max_amount`
+    under category `category_id`.
+    Raises ValueError if the rule is invalid.
+    """
+    if kind == REGEX:
+        try:
+            re.compile(pattern)
+        except re.error as err:
+            raise ValueError('Invalid regular expression: {}'.format(err))
+    elif kind == CONTAINS:
+        if not pattern:
+            raise ValueError('The text to look for is empty')
+    elif kind == AMOUNT:
+        pattern = None
+        if min_amount is None and max_amount is None:
+            raise ValueError('A rule for any description needs an amount range')
+    else:
+        raise ValueError('Unknown rule kind `{}`'.format(kind))
+    if min_amount is not None and max_amount is not None and min_amount > max_amount:
+        raise ValueError('The minimum amount is greater than the maximum')
+    if not category.get(category_id):
+        raise ValueError('No category was found under the ID `{}`'.format(category_id))
+
+    cur = db.cursor()
+    cur.execute('INSERT INTO categorization_rules (category_id, kind, pattern, min_amount, max_amount, created_at) \
+        VALUES (?, ?, ?, ?, ?, ?)', (category_id, kind, pattern, min_amount, max_amount,
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    db.commit()
+    return cur.lastrowid
+
+
+def delete(rule_id):
+    """
+    Deletes the rule by `rule_id`
+    """
+    cur = db.cursor()
+    cur.execute('DELETE FROM categorization_rules WHERE id = ?', (rule_id,))
+    db.commit()
+    return cur.rowcount == 1
+
+
+def recategorize(account_id=None, batch_size=BATCH_SIZE):
+    """
+    Categorizes every uncategorized transaction (of account `account_id`)
+    that a rule matches. Returns the number of transactions categorized.
+    """
+    match = matcher().match
+    where = 'category_id IS NULL AND id > ?'
+    params = []
+    if account_id is not None:
+        where += ' AND account_id = ?'
+        params.append(account_id)
+    query = 'SELECT id, description, amount FROM transactions WHERE {} ORDER BY id LIMIT ?'.format(where)
+
+    count = 0
+    last_id = 0
+    cur = db.cursor()
+    with db.transaction():
+        while True:
+            rows = cur.execute(query, [last_id] + params + [batch_size]).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for trans_id, description, amount in rows:
+                category_id = match(description, amount)
+                if category_id is not None:
+                    updates.append((category_id, trans_id))
+            cur.executemany('UPDATE transactions SET category_id = ? WHERE id = ?', updates)
+            count += len(updates)
+    return count
+
+
+def _amount(text):
+    """
+    Parses an optional amount argument into an atomic amount (None for `*`)
+    """
+    if text in (None, '*'):
+        return None
+    # Parsed exactly, as the importer does, so that bounds match amounts
+    # to the cent (float('19.99') * 100 is 1998.999...)
+    try:
+        return int(decimal.Decimal(text) * 100)
+    except decimal.InvalidOperation:
+        raise ValueError('Invalid amount `{}`'.format(text))
+
+
+def list_rules():
+    """
+    Handler to list the categorization rules
+    """
+    rows = []
+    for rule in all():
+        rows.append([
+            rule.id,
+            rule.category.name,
+            rule.kind,
+            rule.pattern or '',
+            utils.format_money(rule.min_amount) if rule.min_amount is not None else '',
+            utils.format_money(rule.max_amount) if rule.max_amount is not None else '',
+        ])
+    if not rows:
+        print(color_info('No rules yet; add one with `addrule`.'))
+        return
+    headers = colorize_headers(['ID', 'Category', 'Kind', 'Pattern', 'Min Amount', 'Max Amount'])
+    print(tabulate(rows, headers=headers, tablefmt='psql'))
+
+
+def add_rule(category_id, pattern, min_amount=None, max_amount=None):
+    """
+    Handler to add a categorization rule. A `/pattern/` is a regular
+    expression, `*` matches any description and anything else is text to
+    look for. `*` leaves out either amount.
+    """
+    try:
+        category_id = int(category_id)
+        min_amount, max_amount = _amount(min_amount), _amount(max_amount)
+    except ValueError:
+        return 'The category ID must be an integer and the amounts numbers!'
+
+    if pattern == '*':
+        kind = AMOUNT
+    elif len(pattern) > 2 and pattern.startswith('/') and pattern.endswith('/'):
+        kind, pattern = REGEX, pattern[1:-1]
+    else:
+        kind = CONTAINS
+
+    try:
+        rule_id = create(category_id, kind, pattern, min_amount, max_amount)
+    except ValueError as err:
+        return str(err)
+    print(color_success('Rule (ID: {}) added'.format(rule_id)))
+
+
+def remove_rule(rule_id):
+    """
+    Handler to delete a categorization rule
+    """
+    if not delete(int(rule_id)):
+        return 'No rule was found with ID `{}`'.format(rule_id)
+    print(color_success('Rule (ID: {}) deleted'.format(rule_id)))
+
+
+def autocategorize(account_id=None):
+    """
+    Handler to categorize the uncategorized transactions by the rules
+    """
+    if account_id is not None:
+        account_id = int(account_id)
+    count = recategorize(account_id)
+    print(color_success('Categorized {} transaction(s)'.format(count)))
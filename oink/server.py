@@ -0,0 +1,343 @@
+"""
+File: server.py
+
+The `oink serve` daemon: exposes the ledger as JSON-RPC 2.0 methods over
+a Unix domain socket, so tools built around Oink don't have to open
+oink.db themselves or re-implement its logic.
+
+Clients send one request (or batch) per line and receive one response
+per line. All requests are handled by an asyncio event loop on a single
+thread with the one (warm) database connection, so writes are serialized
+and never wait on each other for SQLite's lock. Results of read methods
+are cached in memory until the ledger changes, either through the daemon
+or through another connection (see `PRAGMA data_version`).
+
+Money amounts are atomic integers (e.g. 410 for $4.10).
+"""
+
+from __future__ import print_function
+import asyncio
+import collections
+import datetime
+import inspect
+import json
+import os
+import signal
+import socket
+
+from . import db, accounts, budget, transactions
+from .colorize import color_info
+
+
+# Where the daemon listens unless given another path
+SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.oink', 'oink.sock')
+
+# How many read results are kept in memory
+CACHE_SIZE = 256
+
+# Seconds to let clients' requests finish on shutdown
+SHUTDOWN_TIMEOUT = 5
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+LEDGER_ERROR = -32000
+
+# Cached read results by (method, params), least recently used first
+cache = collections.OrderedDict()
+
+# `PRAGMA data_version` when the cache was last known to be valid
+_data_version = None
+
+# Stream writers of the connected clients, closed on shutdown
+_clients = set()
+
+
+class RPCError(Exception):
+    """
+    Raised by methods to return a JSON-RPC error to the client.
+    """
+    def __init__(self, message, code=LEDGER_ERROR):
+        super().__init__(message)
+        self.code = code
+
+
+def _account_data(acct):
+    return {
+        'id': acct.id,
+        'account_number': acct.account_number,
+        'name': acct.name,
+        'balance': acct.balance,
+        'created_at': acct.created_at,
+    }
+
+
+def _budget_data(bud):
+    return {
+        'id': bud.id,
+        'account_id': bud.account_id,
+        'account_name': bud.account_name,
+        'category': {
+            'id': bud.category.id,
+            'name': bud.category.name,
+        },
+        'amount': bud.amount,
+        'balance': bud.balance,
+        'year': bud.year,
+        'month': bud.month,
+        'created_at': bud.created_at,
+    }
+
+
+def list_accounts():
+    return [_account_data(acct) for acct in accounts.all()]
+
+
+def get_account(account_id):
+    if not accounts.exists(account_id):
+        raise RPCError('No account was found by the ID `{}`'.format(account_id))
+    return _account_data(accounts.get(account_id))
+
+
+def list_transactions(account_id=None, size=transactions.PAGE_SIZE, before=None):
+    """
+    A page of transactions, newest first. Pass the returned `next` key
+    as `before` to get the following page.
+    """
+    # SQLite takes a negative LIMIT as no limit at all
+    if isinstance(size, bool) or not isinstance(size, int) or size <= 0:
+        raise RPCError('The page size must be an integer greater than zero', INVALID_PARAMS)
+    if before is not None:
+        before = tuple(before)
+    rows = transactions.page(account_id, size, before=before)
+    return {
+        'transactions': [{
+            'id': row[0],
+            'account_name': row[1],
+            'description': row[2],
+            'type': {'id': row[3], 'name': row[4]},
+            'amount': row[5],
+            'category_name': row[6],
+            'created_at': row[7],
+        } for row in rows],
+        'next': list(transactions._key(rows[-1])) if len(rows) == size else None,
+    }
+
+
+def create_transaction(account_id, description, type_id, amount, category_id=None):
+    if not accounts.exists(account_id):
+        raise RPCError('No account was found by the ID `{}`'.format(account_id))
+    if not transactions.create(account_id, description, type_id, amount, category_id):
+        raise RPCError('Failed to record transaction')
+    return True
+
+
+def list_budgets(month=None, year=None):
+    now = datetime.datetime.now()
+    return [_budget_data(bud) for bud in budget.evaluate_month(month or now.month, year or now.year)]
+
+
+def create_budget(account_id, category_id, amount, year, month):
+    if not budget.create(account_id, category_id, amount, year, month):
+        raise RPCError('Failed to create budget')
+    return True
+
+
+def report_data(from_date, to_date='9999-99-99'):
+    from .reporting import reports
+    return reports.generate_report_data(from_date, to_date, money=lambda value: value)
+
+
+# name: (function, whether it writes to the ledger)
+METHODS = {
+    'accounts.list': (list_accounts, False),
+    'accounts.get': (get_account, False),
+    'transactions.list': (list_transactions, False),
+    'transactions.create': (create_transaction, True),
+    'budgets.list': (list_budgets, False),
+    'budgets.create': (create_budget, True),
+    'reports.data': (report_data, False),
+}
+
+
+def _check_data_version():
+    """
+    Drops the cache if another connection has changed the ledger since
+    it was last checked.
+    """
+    global _data_version
+    version = db.cursor().execute('PRAGMA data_version').fetchone()[0]
+    if version != _data_version:
+        cache.clear()
+        _data_version = version
+
+
+def call(name, params=None):
+    """
+    Calls method `name` with `params` (a list or dict), going through
+    the cache for read methods. Raises RPCError if the call fails.
+    """
+    if name not in METHODS:
+        raise RPCError('Method not found: `{}`'.format(name), METHOD_NOT_FOUND)
+    function, writes = METHODS[name]
+
+    if params is None:
+        params = []
+    if not isinstance(params, (list, dict)):
+        raise RPCError('Params must be an array or an object', INVALID_PARAMS)
+    args, kwargs = (params, {}) if isinstance(params, list) else ([], params)
+    try:
+        inspect.signature(function).bind(*args, **kwargs)
+    except TypeError as err:
+        raise RPCError(str(err), INVALID_PARAMS)
+
+    if writes:
+        try:
+            return function(*args, **kwargs)
+        finally:
+            cache.clear()
+
+    _check_data_version()
+    key = (name, json.dumps(params, sort_keys=True))
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    result = function(*args, **kwargs)
+    cache[key] = result
+    if len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+    return result
+
+
+def _error(request_id, code, message):
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+
+def handle_request(request):
+    """
+    Handles one decoded JSON-RPC request, returning the response
+    (or None for notifications, which have no `id`).
+    """
+    if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+        return _error(None, INVALID_REQUEST, 'Invalid request')
+
+    request_id = request.get('id')
+    try:
+        result = call(request['method'], request.get('params'))
+    except RPCError as err:
+        response = _error(request_id, err.code, str(err))
+    except Exception as err:
+        response = _error(request_id, LEDGER_ERROR, '{}: {}'.format(type(err).__name__, err))
+    else:
+        response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+    if 'id' not in request:
+        return None
+    return response
+
+
+def handle_line(line):
+    """
+    Handles one line sent by a client, returning the line to send back
+    (or None if there is nothing to send).
+    """
+    try:
+        request = json.loads(line)
+    except ValueError:
+        return json.dumps(_error(None, PARSE_ERROR, 'Parse error'))
+
+    if isinstance(request, list):
+        if not request:
+            return json.dumps(_error(None, INVALID_REQUEST, 'Invalid request'))
+        responses = [handle_request(req) for req in request]
+        responses = [response for response in responses if response is not None]
+        return json.dumps(responses) if responses else None
+
+    response = handle_request(request)
+    return json.dumps(response) if response is not None else None
+
+
+async def _handle_client(reader, writer):
+    _clients.add(writer)
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            response = handle_line(line.decode('utf-8'))
+            if response is not None:
+                writer.write(response.encode('utf-8') + b'\n')
+                await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, UnicodeDecodeError):
+        pass
+    finally:
+        _clients.discard(writer)
+        writer.close()
+
+
+async def start(path):
+    """
+    Starts listening on the Unix socket at `path`, returning the asyncio server.
+    """
+    server = await asyncio.start_unix_server(_handle_client, path)
+    os.chmod(path, 0o600)
+    return server
+
+
+def _in_use(path):
+    """
+    Whether a daemon is already listening on the socket at `path`.
+    """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def serve(path=None):
+    """
+    Handler for the daemon command. Serves JSON-RPC requests on the Unix
+    socket at `path` (defaults to ~/.oink/oink.sock) until interrupted.
+    """
+    path = os.path.expanduser(path or SOCKET_PATH)
+    if os.path.exists(path):
+        if _in_use(path):
+            return 'Another Oink daemon is already listening on `{}`'.format(path)
+        os.unlink(path)  # Left behind by a daemon that didn't shut down cleanly
+
+    loop = asyncio.new_event_loop()
+    try:
+        server = loop.run_until_complete(start(path))
+    except OSError as err:
+        loop.close()
+        return 'Unable to listen on `{}`: {}'.format(path, err)
+
+    # Stop between requests rather than raising KeyboardInterrupt in the middle of one
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, loop.stop)
+
+    print(color_info('Serving the ledger on `{}`; press Ctrl-C to stop.'.format(path)))
+    try:
+        loop.run_forever()
+    finally:
+        # Hang up on connected clients and let their handlers finish
+        server.close()
+        for writer in list(_clients):
+            writer.close()
+        pending = asyncio.all_tasks(loop)
+        if pending:
+            loop.run_until_complete(asyncio.wait(pending, timeout=SHUTDOWN_TIMEOUT))
+        loop.run_until_complete(server.wait_closed())
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+        loop.close()
+        if os.path.exists(path):
+            os.unlink(path)
+    print(color_info('Oink daemon stopped.'))
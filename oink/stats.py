@@ -0,0 +1,73 @@
+"""
+File: stats.py
+
+Handler for the query statistics command.
+See the instrumentation section of db.py.
+"""
+
+from __future__ import print_function
+import os
+
+from . import db
+from .utils import tabulate
+from .colorize import color_info, color_success, colorize_headers
+
+
+# How many queries to show in each table
+TOP = 10
+
+# Longest SQL text shown before it is elided
+SQL_WIDTH = 80
+
+
+def _ms(seconds):
+    return '{:.3f}'.format(seconds * 1000)
+
+
+def _table(stats):
+    rows = []
+    for stat in stats[:TOP]:
+        sql = stat['sql']
+        if len(sql) > SQL_WIDTH:
+            sql = sql[:SQL_WIDTH - 3] + '...'
+        rows.append([stat['calls'], stat['rows'], _ms(stat['total_time']),
+                     _ms(stat['mean_time']), _ms(stat['max_time']), sql])
+    headers = colorize_headers(['Calls', 'Rows', 'Total (ms)', 'Mean (ms)', 'Max (ms)', 'Query'])
+    return tabulate(rows, headers=headers, tablefmt='psql')
+
+
+def show(option=None):
+    """
+    Handler for the query statistics command.
+    With no `option`, shows the slowest and the most frequent queries.
+    `on` and `off` toggle instrumentation, `reset` clears the statistics
+    and any other value is a file path to export them to as JSON.
+    """
+    if option in ('on', 'off'):
+        db.instrument(option == 'on')
+        print(color_info('Query instrumentation turned {}'.format(option)))
+        return
+    if option == 'reset':
+        db.reset_stats()
+        print(color_info('Query statistics cleared'))
+        return
+    if option is not None:
+        path = os.path.expanduser(option)
+        try:
+            db.export_stats(path)
+        except OSError as err:
+            return 'Unable to export query statistics: {}'.format(err)
+        print(color_success('Query statistics saved to `{}`'.format(path)))
+        return
+
+    if not db.is_instrumented():
+        print(color_info('Query instrumentation is off; turn it on with `stats on`'))
+    if not db.query_stats():
+        print(color_info('No queries have been recorded yet'))
+        return
+
+    print(color_info('Slowest queries (by total time)'))
+    print(_table(db.query_stats('total_time')))
+    print('')
+    print(color_info('Most frequent queries'))
+    print(_table(db.query_stats('calls')))
@@ -0,0 +1,90 @@
+"""
+File: totals.py
+
+Monthly totals of every account's transactions, so that budgets and
+reports read a row per month instead of summing every transaction.
+
+The monthly_totals table holds the total amount and the number of the
+transactions of each account by year, month, category (0 for
+uncategorized) and type. Triggers on the transactions table keep it
+exact as transactions are added, changed and deleted (see migration 8),
+whichever way that is done. `verify()` checks it against the
+transactions and `rebuild()` recomputes it from them, e.g. should the
+triggers have been dropped for a bulk load.
+"""
+
+from __future__ import print_function
+
+from . import db
+from .colorize import color_success
+
+
+# Totals as summed from the transactions, in the monthly_totals layout
+SUMMED_QUERY = '''
+    SELECT account_id, CAST(substr(created_at, 1, 4) AS integer), CAST(substr(created_at, 6, 2) AS integer),
+        COALESCE(category_id, 0), transaction_type_id, SUM(amount), COUNT(*)
+    FROM transactions
+    GROUP BY 1, 2, 3, 4, 5
+    '''
+
+REBUILD_QUERY = '''
+    INSERT INTO monthly_totals (account_id, year, month, category_id, type, total, count)
+    ''' + SUMMED_QUERY
+
+# Rows of monthly_totals differing from the transactions, either way
+VERIFY_QUERY = '''
+    SELECT DISTINCT account_id, year, month, category_id, type FROM (
+        SELECT * FROM (
+            SELECT account_id, year, month, category_id, type, total, count FROM monthly_totals
+            EXCEPT ''' + SUMMED_QUERY + ''')
+        UNION
+        SELECT * FROM (''' + SUMMED_QUERY + '''
+            EXCEPT SELECT account_id, year, month, category_id, type, total, count FROM monthly_totals)
+    )
+    ORDER BY 1, 2, 3, 4, 5
+    '''
+
+
+def bound(date):
+    """
+    The month key just after the month of `date`, e.g. '2018-06~' for
+    '2018-06-23'. Every transaction of that month (or of any earlier
+    date) sorts before it and every later month's key after it.
+    """
+    return date[:7] + '~'
+
+
+def rebuild():
+    """
+    Recomputes every monthly total from the transactions
+    """
+    with db.transaction():
+        cur = db.cursor()
+        cur.execute('DELETE FROM monthly_totals')
+        cur.execute(REBUILD_QUERY)
+
+
+def verify():
+    """
+    The `(account_id, year, month, category_id, type)` of every monthly
+    total that does not match the transactions
+    """
+    return db.cursor().execute(VERIFY_QUERY).fetchall()
+
+
+def totals(action='verify'):
+    """
+    Handler to verify the monthly totals against the transactions,
+    or to rebuild them
+    """
+    if action == 'rebuild':
+        rebuild()
+        print(color_success('Monthly totals rebuilt'))
+    elif action == 'verify':
+        mismatches = verify()
+        if mismatches:
+            return '{} monthly total(s) do not match the transactions; ' \
+                'run `totals rebuild` to recompute them'.format(len(mismatches))
+        print(color_success('Monthly totals match the transactions'))
+    else:
+        return 'Unknown option `{}`; expected `rebuild` or `verify`'.format(action)
@@ -3,15 +3,14 @@ File: transactions.py
 """
 
 from __future__ import print_function
+import contextlib
 import re
 from datetime import datetime
 import locale
 
-# 3rd-Party module for tabular console output
-from tabulate import tabulate
-
-from . import db, accounts, budget, category, utils
-from .colorize import color_error, color_info, color_input, color_success, colorize_headers, colorize, colorize_list
+from . import db, accounts, budget, category, rules, totals, utils
+from .utils import tabulate
+from .colorize import color_error, color_info, color_input, color_success, color_warning, colorize_headers, colorize, colorize_list
 
 
 DEPOSIT_ID = 0
@@ -47,66 +46,17 @@ def list_for_account(account_id, from_date='0000-00-00', to_date='9999-99-99'):
     return trans
 
 
-def setup():
+def signed_amount(type_id, amount):
     """
-    Initial database setup; creates the `transactions` table
+    The effect a transaction of `type_id` for `amount`
+    has on the balance of its account
     """
-    global WITHDRAWAL_ID, DEPOSIT_ID
-
-    locale.setlocale(locale.LC_ALL, '')
-    cur = db.cursor()
+    if type_id == DEPOSIT_ID:
+        return amount
+    elif type_id == WITHDRAWAL_ID:
+        return -amount
+    return 0
 
-    # Create transaction_types table
-    cur.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS transaction_types (
-            id integer PRIMARY KEY AUTOINCREMENT,
-            name text NOT NULL,
-            UNIQUE(name)
-        );
-        '''
-    )
-    db.commit()
-
-    # Insert the default transaction types
-    cur.execute(f'''
-        INSERT INTO transaction_types (id, name)
-        SELECT {DEPOSIT_ID}, 'deposit'
-        WHERE NOT EXISTS(SELECT 1 FROM transaction_types WHERE id = {DEPOSIT_ID} AND name = 'deposit');
-        ''')
-    cur.execute(f'''
-        INSERT INTO transaction_types (id, name)
-        SELECT {WITHDRAWAL_ID}, 'withdrawal'
-        WHERE NOT EXISTS(SELECT 1 FROM transaction_types WHERE id = {WITHDRAWAL_ID} AND name = 'withdrawal');
-        ''')
-    db.commit()
-
-    # Create transactions table
-    cur.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id integer PRIMARY KEY AUTOINCREMENT,
-            account_id integer NOT NULL,
-            transaction_type_id integer NOT NULL,
-            description text,
-            amount integer NOT NULL,
-            category_id integer,
-            created_at text NOT NULL,
-            FOREIGN KEY (account_id)
-                REFERENCES accounts (id)
-                ON UPDATE CASCADE
-                ON DELETE NO ACTION,
-            FOREIGN KEY (transaction_type_id)
-                REFERENCES transaction_types (id)
-                ON UPDATE CASCADE
-                ON DELETE NO ACTION,
-            FOREIGN KEY (category_id)
-                REFERENCES categories (id)
-                ON UPDATE CASCADE
-                ON DELETE NO ACTION
-        );
-        ''')
-    db.commit()
 
 def create(account_id, description, type_id, amount, category_id=None):
     """
@@ -115,29 +65,24 @@ def create(account_id, description, type_id, amount, category_id=None):
     cur = db.cursor()
     created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    # Insert the transaction record
-    cur.execute('INSERT INTO transactions (account_id, transaction_type_id, description, amount, category_id, created_at) \
-        VALUES (?, ?, ?, ?, ?, ?)', (account_id, type_id, description, amount, category_id, created_at))
-
-    if cur.rowcount == 0:
-        print(color_error('[error]') + ' Failed to record transaction.')
-        return
+    with db.transaction():
+        # Insert the transaction record
+        cur.execute('INSERT INTO transactions (account_id, transaction_type_id, description, amount, category_id, created_at) \
+            VALUES (?, ?, ?, ?, ?, ?)', (account_id, type_id, description, amount, category_id, created_at))
 
-    # Now withdraw or deposit from the account as recorded
-    prev_balance = accounts.get_balance(account_id)
-    new_balance = 0
-    if type_id == WITHDRAWAL_ID:
-        new_balance = prev_balance - amount
-    elif type_id == DEPOSIT_ID:
-        new_balance = prev_balance + amount
-    else:
-        print(color_warning(f'Unexpected transaction type "{type_id}" received. Account balance will not be affected.'))
-        return True
+        if cur.rowcount == 0:
+            print(color_error('[error]') + ' Failed to record transaction.')
+            return
 
-    # Set the new balance
-    success = accounts.set_balance(account_id, new_balance)
+        if type_id not in (WITHDRAWAL_ID, DEPOSIT_ID):
+            print(color_warning(f'Unexpected transaction type "{type_id}" received. Account balance will not be affected.'))
+            return True
 
-    return success
+        # Now withdraw or deposit from the account as recorded
+        if not accounts.post(account_id, signed_amount(type_id, amount)):
+            db.rollback()
+            return False
+        return True
 
 
 def list_transaction_types():
@@ -198,7 +143,11 @@ def new():
 
         print('')
         category.print_list()  # Prints out available categories
-        category_id = input(color_input('Category ID: '))
+        suggested = rules.matcher().match(description, utils.float_to_atomic(amount))
+        if suggested is None:
+            category_id = input(color_input('Category ID: '))
+        else:
+            category_id = input(color_input('Category ID [{}]: '.format(suggested))) or str(suggested)
         if category_id.lower() in ('', 'none', 'null', 'n/a'):
             category_id = None
         else:
@@ -214,28 +163,67 @@ def new():
             print(color_success('Transaction recorded'))
             return
 
-        print(color_error('[error]') + ' Failed to update balance.')
-        return
+        return 'Failed to update balance.'
+
+# Columns shown by the transaction listings
+LIST_QUERY = '''
+    SELECT t.id, account.name, t.description, type.id, type.name, t.amount,
+        category.name, t.created_at
+    FROM transactions t
+    LEFT JOIN accounts account ON t.account_id = account.id
+    LEFT JOIN transaction_types type ON t.transaction_type_id = type.id
+    LEFT JOIN categories category ON t.category_id = category.id
+    WHERE {where}
+    ORDER BY t.created_at {order}, t.id {order}
+    LIMIT ?
+    '''
+
+# Balance of the account after each transaction from (created_at, id)
+# `(?, ?)` to `(?, ?)`: its current balance less every later transaction.
+# The months after the newest one's are taken from the monthly totals (see
+# totals.py), so only the transactions from the oldest key until the end
+# of the newest one's month are read, however deep into the ledger the
+# page is. The monthly totals are aliased `t` to share the account filter.
+# The unary + keeps the partitioning from steering SQLite onto a full scan
+# of an account index instead of the range from the oldest key on.
+RUNNING_BALANCE_QUERY = '''
+    WITH future AS (
+        SELECT t.account_id, SUM(CASE t.type WHEN ? THEN t.total WHEN ? THEN -t.total END) AS net
+        FROM monthly_totals t
+        WHERE {where} AND printf('%04d-%02d', t.year, t.month) > ?
+        GROUP BY t.account_id
+    )
+    SELECT id, balance FROM (
+        SELECT t.id, t.created_at, a.balance - COALESCE(f.net, 0) - COALESCE(SUM(CASE t.transaction_type_id
+                WHEN ? THEN t.amount WHEN ? THEN -t.amount ELSE 0 END) OVER (
+            PARTITION BY +t.account_id ORDER BY t.created_at DESC, t.id DESC
+            ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS balance
+        FROM transactions t
+        JOIN accounts a ON a.id = t.account_id
+        LEFT JOIN future f ON f.account_id = t.account_id
+        WHERE {where} AND t.created_at >= ? AND (t.created_at, t.id) >= (?, ?) AND t.created_at < ?
+    )
+    WHERE (created_at, id) <= (?, ?)
+    '''
+
+# Default number of transactions per page for the paginated listing
+PAGE_SIZE = 25
 
-def list_all_transactions(num=10):
+# Transactions read at a time when listing every transaction (`lt *`)
+LIST_ALL_PAGE_SIZE = 1000
+
+# Last argument of the listing commands that adds the running balance
+BALANCE_FLAGS = ('b', 'bal', 'balance')
+
+# Error for a last argument of the listing commands that isn't a flag
+UNKNOWN_FLAG = 'Unknown option `{}`; did you mean `balance`?'
+
+
+def _format_rows(rows):
     """
-    Handler to list transactions for all accounts
+    Colorizes listing rows for output, placing (+/-)
+    in front of amounts in response to credit/debit
     """
-    if num in (None, '*'):
-        num = -1
-
-    cur = db.cursor()
-    cur.execute(
-        'SELECT transactions.id, account.name, transactions.description, type.id, type.name, transactions.amount, \
-        category.name, transactions.created_at FROM transactions \
-        LEFT JOIN accounts account ON transactions.account_id = account.id \
-        LEFT JOIN transaction_types type ON transactions.transaction_type_id = type.id \
-        LEFT JOIN categories category ON transactions.category_id = category.id \
-        ORDER BY transactions.created_at DESC, transactions.id DESC \
-        LIMIT ?', (num,))
-    rows = cur.fetchall()
-
-    # Place (+/-) in front of amount in response to credit/debit
     new_rows = []
     for row in rows:
         amount = utils.atomic_to_float(row[5])
@@ -246,59 +234,312 @@ def list_all_transactions(num=10):
             str_amount = colorize('+' + locale.currency(amount, grouping=True), 'green')
         else:
             str_amount = colorize(' ' + locale.currency(amount, grouping=True), 'yellow')
-        new_rows.append(colorize_list(row[:3], ['white', 'cyan', 'yellow']) + [colorize(row[4], 'white'), str_amount,] + colorize_list(row[6:], ['purple', 'white']))
+        new_row = colorize_list(row[:3], ['white', 'cyan', 'yellow']) + [colorize(row[4], 'white'), str_amount,] + colorize_list(row[6:8], ['purple', 'white'])
+        if len(row) > 8: # Running balance
+            new_row.append(colorize(locale.currency(utils.atomic_to_float(row[8]), grouping=True), 'cyan'))
+        new_rows.append(new_row)
+    return new_rows
 
-    headers = colorize_headers([
+
+def _print_rows(rows):
+    headers = [
         'ID', 'Account', 'Description', 'Type',
-        'Amount', 'Category', 'Created At'])
-    print(tabulate(new_rows, headers=headers, tablefmt='psql'))
+        'Amount', 'Category', 'Created At']
+    if rows and len(rows[0]) > 8:
+        headers.append('Balance')
+    print(tabulate(_format_rows(rows), headers=colorize_headers(headers), tablefmt='psql'))
+
 
-def list_transactions(account_id=None, num=10):
+def _account_filter(account_id):
     """
-    Handler to list transactions for a given account.
+    The `(where, params)` clauses limiting a listing to account `account_id`
+    (or to nothing if it is None)
+    """
+    if account_id is None:
+        return ['1'], []
+    return ['t.account_id = ?'], [account_id]
+
+
+def page(account_id=None, size=PAGE_SIZE, before=None, after=None, balance=False):
+    """
+    Fetches a single page of transactions, newest first, using keyset
+    pagination on `(created_at, id)`: `before` fetches the page of
+    transactions older than that key, `after` the page newer than it.
+    Only the rows of the page itself are ever read, however deep into
+    the ledger the page is.
+    With `balance`, each row ends with the balance of its account after
+    the transaction (see `running_balances()`).
+    Returns the list of listing rows.
+    """
+    where, params = _account_filter(account_id)
+    if before is not None:
+        where.append('(t.created_at, t.id) < (?, ?)')
+        params.extend(before)
+    elif after is not None:
+        where.append('(t.created_at, t.id) > (?, ?)')
+        params.extend(after)
+    params.append(size)
+
+    # Pages before the key are read backwards and flipped around
+    order = 'ASC' if after is not None else 'DESC'
+    query = LIST_QUERY.format(where=' AND '.join(where), order=order)
+    rows = db.cursor().execute(query, params).fetchall()
+    if after is not None:
+        rows.reverse()
+    if balance and rows:
+        balances = running_balances(rows, account_id)
+        rows = [row + (balances[row[0]],) for row in rows]
+    return rows
+
+
+def running_balances(rows, account_id=None):
     """
+    The balance of its account after each transaction of the page of
+    listing `rows` (of account `account_id`, or of all accounts), by
+    transaction id. Computed in SQL from the current balances and the
+    monthly totals, reading only the transactions of the rows' months.
+    """
+    where, params = _account_filter(account_id)
+    query = RUNNING_BALANCE_QUERY.format(where=' AND '.join(where))
+    oldest = min(_key(row) for row in rows)
+    newest = max(_key(row) for row in rows)
+    bound = totals.bound(newest[0])
+    types = [DEPOSIT_ID, WITHDRAWAL_ID]
+    params = (types + params + [bound] + types + params
+              + [oldest[0]] + list(oldest) + [bound] + list(newest))
+    return dict(db.cursor().execute(query, params).fetchall())
+
+
+def _key(row):
+    """
+    The `(created_at, id)` pagination key of a listing row
+    """
+    return (row[7], row[0])
+
+
+def _balance_flag(flag):
+    """
+    Whether the optional last argument `flag` of a listing command asks
+    for the running balance, or None if it is not a known flag.
+    """
+    if flag in (None, False, True):
+        return bool(flag)
+    if flag.lower() not in BALANCE_FLAGS:
+        return None
+    return True
+
+
+def page_transactions(account_id=None, size=None, balance=None):
+    """
+    Handler to page through the transactions of an account (or of all
+    accounts) one screen at a time, newest first.
+    `balance` adds the running balance of the account after each one.
+    """
+    flag, balance = balance, _balance_flag(balance)
+    if balance is None:
+        return UNKNOWN_FLAG.format(flag)
+
     if account_id in (None, '*'):
-        list_all_transactions(num)
+        account_id = None
+    else:
+        account_id = int(account_id)
+        if not accounts.exists(account_id):
+            return 'No account was found by the ID `{}`'.format(account_id)
+
+    size = PAGE_SIZE if size in (None, '*') else int(size)
+    if size <= 0:
+        return 'The page size must be greater than zero!'
+
+    rows = page(account_id, size, balance=balance)
+    if not rows:
+        print(color_info('No transactions were found.'))
         return
-    account_id = int(account_id)
+
+    number = 1
+    while True:
+        _print_rows(rows)
+
+        choice = input(color_input('Page {} - [n]ext, [p]revious, [q]uit: '.format(number))).lower()
+        if choice in ('', 'n', 'next'):
+            older = page(account_id, size, before=_key(rows[-1]), balance=balance)
+            if not older:
+                print(color_info('No older transactions.'))
+                return
+            rows = older
+            number += 1
+        elif choice in ('p', 'prev', 'previous'):
+            newer = page(account_id, size, after=_key(rows[0]), balance=balance)
+            if not newer:
+                print(color_info('Already at the newest transactions.'))
+                continue
+            rows = newer
+            number -= 1
+        else:
+            return
+
+
+def _print_all(account_id, balance):
+    """
+    Prints every transaction of account `account_id` (or of all accounts),
+    newest first, reading them a page at a time by keyset pagination
+    rather than all at once. Nothing is asked, so it works from scripts.
+    """
+    rows = page(account_id, LIST_ALL_PAGE_SIZE, balance=balance)
+    if not rows:
+        print(color_info('No transactions were found.'))
+        return
+    while rows:
+        _print_rows(rows)
+        rows = page(account_id, LIST_ALL_PAGE_SIZE, before=_key(rows[-1]), balance=balance)
+
+
+def list_all_transactions(num=10, balance=None):
+    """
+    Handler to list transactions for all accounts
+    """
+    flag, balance = balance, _balance_flag(balance)
+    if balance is None:
+        return UNKNOWN_FLAG.format(flag)
 
     if num in (None, '*'):
-        num = -1
+        _print_all(None, balance)
+        return
+    _print_rows(page(None, int(num), balance=balance))
 
-    cur = db.cursor()
+
+def list_transactions(account_id=None, num=10, balance=None):
+    """
+    Handler to list transactions for a given account.
+    Every transaction (`*`) is listed without stopping between pages;
+    `pt` pages through them interactively.
+    `balance` adds the running balance of the account after each one.
+    """
+    if account_id in (None, '*'):
+        return list_all_transactions(num, balance)
+    account_id = int(account_id)
 
     if not accounts.exists(account_id):
-        print(color_error('[error]') + ' No account was found by the ID `{}`'.format(acct))
+        return 'No account was found by the ID `{}`'.format(account_id)
+
+    flag, balance = balance, _balance_flag(balance)
+    if balance is None:
+        return UNKNOWN_FLAG.format(flag)
+
+    if num in (None, '*'):
+        _print_all(account_id, balance)
         return
+    _print_rows(page(account_id, int(num), balance=balance))
 
-    cur.execute(
-        'SELECT transactions.id, account.name, transactions.description, type.id, type.name, transactions.amount, \
-        category.name, transactions.created_at FROM transactions \
-        LEFT JOIN accounts account ON transactions.account_id = account.id \
-        LEFT JOIN transaction_types type ON transactions.transaction_type_id = type.id \
-        LEFT JOIN categories category ON transactions.category_id = category.id \
-        WHERE transactions.account_id = ? \
-        ORDER BY transactions.created_at DESC, transactions.id DESC \
-        LIMIT ?', (account_id, num,))
-    rows = cur.fetchall()
-
-    # Place (+/-) in front of amount in response to credit/debit
-    new_rows = []
-    for row in rows:
-        amount = utils.atomic_to_float(row[5])
-        str_amount = ''
-        if row[3] == WITHDRAWAL_ID: # Credit
-            str_amount = colorize('-' + locale.currency(amount, grouping=True), 'red')
-        elif row[3] == DEPOSIT_ID:
-            str_amount = colorize('+' + locale.currency(amount, grouping=True), 'green')
+
+# Transactions whose description matches an FTS5 query (see migration 5),
+# best matches first
+SEARCH_QUERY = '''
+    SELECT t.id, account.name, t.description, type.id, type.name, t.amount,
+        category.name, t.created_at
+    FROM transactions_fts
+    JOIN transactions t ON t.id = transactions_fts.rowid
+    LEFT JOIN accounts account ON t.account_id = account.id
+    LEFT JOIN transaction_types type ON t.transaction_type_id = type.id
+    LEFT JOIN categories category ON t.category_id = category.id
+    WHERE transactions_fts MATCH ? AND t.created_at BETWEEN ? AND ? {filters}
+    ORDER BY transactions_fts.rank, t.created_at DESC, t.id DESC
+    LIMIT ?
+    '''
+
+# Most transactions listed by `find`
+SEARCH_LIMIT = 50
+
+# Filters of `find` queries, e.g. `account:Checking` or `category:none`
+SEARCH_FILTERS = ('account', 'category')
+
+
+def parse_search(text):
+    """
+    Splits a `find` query into an FTS5 match expression and its filters.
+    Every word must appear in the description (in any order and case);
+    a word ending in `*` matches any word starting with it. Words like
+    `account:<ID or name>` and `category:<name or none>` are filters.
+    Returns a `(match, filters)` tuple, where `filters` maps the names
+    of the filters given to their values.
+    """
+    terms = []
+    filters = {}
+    for word in text.split():
+        name, _, value = word.partition(':')
+        if value and name.lower() in SEARCH_FILTERS:
+            filters[name.lower()] = value
+            continue
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            # Quoted so that FTS5 syntax in the query is taken literally
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms), filters
+
+
+def search(match, from_date='0000-00-00', to_date='9999-99-99', account=None, category=None, limit=SEARCH_LIMIT):
+    """
+    Finds the transactions from `from_date` to `to_date` whose description
+    matches the FTS5 expression `match` (see `parse_search()`), optionally
+    only those of `account` (an ID or name) or `category` (a name, or
+    'none' for uncategorized ones).
+    Returns up to `limit` listing rows, best matches first.
+    """
+    filters = []
+    params = [match, from_date, to_date]
+    if account is not None:
+        try:
+            params.append(int(account))
+            filters.append('AND t.account_id = ?')
+        except ValueError:
+            params.append(account)
+            filters.append('AND account.name = ?')
+    if category is not None:
+        if category.lower() == 'none':
+            filters.append('AND t.category_id IS NULL')
         else:
-            str_amount = colorize(' ' + locale.currency(amount, grouping=True), 'yellow')
-        new_rows.append(colorize_list(row[:3], ['white', 'cyan', 'yellow']) + [colorize(row[4], 'white'), str_amount,] + colorize_list(row[6:], ['purple', 'white']))
+            params.append(category)
+            filters.append('AND category.name = ?')
+    params.append(limit)
+
+    query = SEARCH_QUERY.format(filters=' '.join(filters))
+    return db.cursor().execute(query, params).fetchall()
+
+
+@contextlib.contextmanager
+def deferred_search_index():
+    """
+    Context manager for bulk inserts of transactions. Their descriptions
+    are indexed for `find` all at once at the end of the block, rather
+    than one at a time by the insert trigger, which is several times
+    slower than the inserts themselves. Use within a database transaction.
+    """
+    cur = db.cursor()
+    last_id = cur.execute('SELECT COALESCE(MAX(id), 0) FROM transactions').fetchone()[0]
+    cur.execute('UPDATE transactions_fts_state SET deferred = 1')
+    try:
+        yield
+    finally:
+        cur.execute('INSERT INTO transactions_fts (rowid, description) \
+            SELECT id, description FROM transactions WHERE id > ?', (last_id,))
+        cur.execute('UPDATE transactions_fts_state SET deferred = 0')
 
-    headers = colorize_headers([
-        'ID', 'Account', 'Description', 'Type',
-        'Amount', 'Category', 'Created At'])
-    print(tabulate(new_rows, headers=headers, tablefmt='psql'))
+
+def find(query, from_date='0000-00-00', to_date='9999-99-99'):
+    """
+    Handler to search the transaction descriptions
+    """
+    match, filters = parse_search(query)
+    if not match:
+        return 'Nothing to search for; give at least one word.'
+
+    rows = search(match, from_date, to_date, filters.get('account'), filters.get('category'))
+    if not rows:
+        print(color_info('No matching transactions were found.'))
+        return
+    _print_rows(rows)
+    if len(rows) == SEARCH_LIMIT:
+        print(color_info('Showing the best {} matches; narrow the search to see others.'.format(SEARCH_LIMIT)))
 
 
 def add_transfer(amount, source_acct_id, dest_acct_id):
@@ -314,40 +555,38 @@ def add_transfer(amount, source_acct_id, dest_acct_id):
         print(color_info('Transfer transaction cancelled.'))
         return
     if source_acct_id not in accts:
-        print(color_error('[error]') + ' The source account (ID: {}) does not exist.'.format(source_acct_id))
-        return
+        return 'The source account (ID: {}) does not exist.'.format(source_acct_id)
 
     if dest_acct_id in (None, ''):
         print(color_info('Transfer transaction cancelled.'))
         return
     if dest_acct_id not in accts:
-        print(color_error('[error]') + ' The destination account (ID: {}) does not exist.'.format(dest_acct_id))
-        return
+        return 'The destination account (ID: {}) does not exist.'.format(dest_acct_id)
 
     if amount is None:
         amount = input(color_input('Amount to transfer: '))
     try:
         amount = float(amount)
     except ValueError:
-        print(color_error('[error]') + ' The amount must be a number!')
-        return
+        return 'The amount must be a number!'
     else:
         if amount <= 0:
-            print(color_error('[error]') + ' The amount must be greater than zero!')
-            return
+            return 'The amount must be greater than zero!'
 
     amount = utils.float_to_atomic(amount)
 
-    # Make the two transactions on the accounts
-    success = create(source_acct_id, 'Transfer to Account ID {}'.format(dest_acct_id), WITHDRAWAL_ID, amount, None)
-    success = success and create(dest_acct_id, 'Transfer from Account ID {}'.format(source_acct_id), DEPOSIT_ID, amount, None)
+    # Make the two transactions on the accounts; both or neither
+    with db.transaction():
+        success = create(source_acct_id, 'Transfer to Account ID {}'.format(dest_acct_id), WITHDRAWAL_ID, amount, None)
+        success = success and create(dest_acct_id, 'Transfer from Account ID {}'.format(source_acct_id), DEPOSIT_ID, amount, None)
+        if not success:
+            db.rollback()
 
     if success:
         print(color_success('Transfer from account {} to {} recorded.'.format(source_acct_id, dest_acct_id)))
-        db.commit()
         return
 
-    print(color_error('[error]') + ' Failed to record transfer transaction from account {} to {}.'.format(source_acct_id, dest_acct_id))
+    return 'Failed to record transfer transaction from account {} to {}.'.format(source_acct_id, dest_acct_id)
 
 
 def delete_transaction(trans_id):
@@ -363,34 +602,26 @@ def delete_transaction(trans_id):
     try:
         trans_id = int(trans_id)
     except ValueError:
-        print(color_error('[error]') + ' Transaction ID must be an integer!')
-        return
+        return 'Transaction ID must be an integer!'
 
     exists = cur.execute('SELECT COUNT(*) FROM transactions WHERE id = ?', (trans_id,)).fetchone()[0] == 1
     if not exists:
-        print(color_error('[error]') + ' No transaction was found with ID `{}`'.format(trans_id))
-        return
+        return 'No transaction was found with ID `{}`'.format(trans_id)
 
-    # Counter the transaction effect
-    transaction = cur.execute('SELECT account_id, transaction_type_id, amount FROM transactions \
-        WHERE id = ?', (trans_id,)).fetchone()
-    account_id = transaction[0]
-    type_id = transaction[1]
-    amount = transaction[2]
-    if type_id == DEPOSIT_ID:
-        amount *= -1
+    with db.transaction():
+        # Counter the transaction effect
+        account_id, type_id, amount = cur.execute('SELECT account_id, transaction_type_id, amount \
+            FROM transactions WHERE id = ?', (trans_id,)).fetchone()
 
-    # Update the balance of the account
-    accounts.set_balance(account_id, accounts.get_balance(account_id) + amount)
+        # Valid and exists so delete
+        cur.execute('DELETE FROM transactions WHERE id = ?', (trans_id,))
+        if cur.rowcount != 1:
+            return 'Failed to delete transaction.'
 
-    # Valid and exists so delete
-    cur.execute('DELETE FROM transactions WHERE id = ?', (trans_id,))
-    if cur.execute('SELECT COUNT(*) FROM transactions WHERE id = ?', (trans_id,)).fetchone()[0] != 0:
-        print(color_error('[error]') + ' Failed to delete transaction.')
-        return
+        # Update the balance of the account
+        accounts.post(account_id, -signed_amount(type_id, amount))
 
     print(color_success('Transaction deleted.'))
-    db.commit()
 
 
 def _edit_transaction(trans_id, description=None, type_id=None, amount=None, category_id=None):
@@ -398,53 +629,39 @@ def _edit_transaction(trans_id, description=None, type_id=None, amount=None, cat
     Helper function for updating a transaction record
     """
     cur = db.cursor()
-    # Get current record
-    transaction = cur.execute('SELECT description, transaction_type_id, amount, category_id FROM \
-        transactions WHERE id = ?', (trans_id,)).fetchone()
-
-    if cur.rowcount == 0:
-        print(color_error('[error]') + ' Transaction not found.')
-        return False
-
-    if description is None:
-        description = transaction[0]
-    if type_id is None:
-        type_id = transaction[1]
-    if not amount and amount != 0:
-        amount = transaction[2]
-    if category_id is None:
-        category_id = transaction[3]
-
-    # Update where different
-    cur.execute('UPDATE transactions SET description = ?, transaction_type_id = ?, \
-        amount = ?, category_id = ? WHERE id = ?', (
-            description, type_id, amount, category_id, trans_id,
-        ))
-
-    if cur.rowcount != 1:
-        return False
-
-    # Check for change of credit in case need balance update
-    success = True
-    acct_id = cur.execute('SELECT account_id FROM transactions WHERE id = ?', (trans_id,)).fetchone()[0]
-    if transaction[1] == WITHDRAWAL_ID:
-        # Add the money back
-        success = accounts.set_balance(acct_id, accounts.get_balance(acct_id) + transaction[2])
-    elif transaction[1] == DEPOSIT_ID:
-        success = accounts.set_balance(acct_id, accounts.get_balance(acct_id) - transaction[2])
-
-    # Apply new transaction effect
-    if type_id == WITHDRAWAL_ID:
-        # Need to subtract the amount from the account
-        success &= accounts.set_balance(acct_id, accounts.get_balance(acct_id) - amount)
-    elif type_id == DEPOSIT_ID:
-        # Need to add the amount to the account
-        success &= accounts.set_balance(acct_id, accounts.get_balance(acct_id) + amount)
-
-    if success:
-        db.commit()
-        return True
-    return False
+    with db.transaction():
+        # Get current record
+        transaction = cur.execute('SELECT description, transaction_type_id, amount, category_id, account_id \
+            FROM transactions WHERE id = ?', (trans_id,)).fetchone()
+
+        if transaction is None:
+            print(color_error('[error]') + ' Transaction not found.')
+            return False
+
+        if description is None:
+            description = transaction[0]
+        if type_id is None:
+            type_id = transaction[1]
+        if not amount and amount != 0:
+            amount = transaction[2]
+        if category_id is None:
+            category_id = transaction[3]
+        acct_id = transaction[4]
+
+        # Update where different
+        cur.execute('UPDATE transactions SET description = ?, transaction_type_id = ?, \
+            amount = ?, category_id = ? WHERE id = ?', (
+                description, type_id, amount, category_id, trans_id,
+            ))
+
+        if cur.rowcount != 1:
+            return False
+
+        # Swap the old transaction effect for the new one in a single posting
+        delta = signed_amount(type_id, amount) - signed_amount(transaction[1], transaction[2])
+        if delta != 0:
+            return accounts.post(acct_id, delta)
+    return True
 
 
 def edit_transaction(trans_id):
@@ -457,8 +674,7 @@ def edit_transaction(trans_id):
     if cur.execute(
             'SELECT COUNT(*) FROM transactions WHERE id = ?', (trans_id,)
     ).fetchone()[0] == 0:
-        print('No transaction was found with ID `{}`'.format(trans_id))
-        return
+        return 'No transaction was found with ID `{}`'.format(trans_id)
 
     # Get the current transaction record
     transaction = cur.execute('SELECT description, transaction_type_id, amount, category_id FROM \
@@ -477,8 +693,7 @@ def edit_transaction(trans_id):
         return
     type_id = int(type_id)
     if not type_exists(type_id):
-        print(color_error('[error]') + ' Invalid type ID selected.')
-        return
+        return 'Invalid type ID selected.'
 
     amount = input(color_input('Transaction amount (${}): '.format(utils.atomic_to_float(transaction[2]))))
     if len(amount) <= 0:
@@ -494,8 +709,7 @@ def edit_transaction(trans_id):
     else:
         category_id = int(category_id)
         if not category.get(category_id):
-            print(color_error('[error]') + ' No category was found under the ID `{}`'.format(category_id))
-            return
+            return 'No category was found under the ID `{}`'.format(category_id)
 
     # Call the helper function
     success = _edit_transaction(trans_id, desc, type_id, utils.float_to_atomic(amount) if amount else None, category_id)
@@ -504,5 +718,4 @@ def edit_transaction(trans_id):
         print(color_success('Transaction updated'))
         return
 
-    print(color_error('[error]') + ' Failed to update transaction.')
-    return
+    return 'Failed to update transaction.'
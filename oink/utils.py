@@ -11,6 +11,15 @@ import re
 locale.setlocale(locale.LC_ALL, '')
 
 
+def tabulate(*args, **kwargs):
+    """
+    Drop-in for `tabulate.tabulate` which only imports the
+    (slow to import) tabulate package the first time a table is drawn
+    """
+    from tabulate import tabulate as _tabulate
+    return _tabulate(*args, **kwargs)
+
+
 def strpmoney(value):
     """
     Take a currency string `value` and return the
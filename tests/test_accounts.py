@@ -11,7 +11,7 @@ from __future__ import print_function
 import unittest
 import os
 
-from oink import accounts, db
+from oink import accounts, db, migrations
 
 
 class TestAccounts(unittest.TestCase):
@@ -24,7 +24,7 @@ class TestAccounts(unittest.TestCase):
         with open(r'testdb\oink.db', 'w') as fout:
             pass
         db.connect('testdb')
-        accounts.setup()
+        migrations.migrate()
 
     def tearDown(self):
         '''Destroys the testing database.'''
@@ -0,0 +1,105 @@
+'''
+File: test_aio.py
+
+Defines unit tests for aio.py.
+'''
+
+import asyncio
+import io
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from oink import accounts, aio, db, migrations, transactions
+
+
+class TestDatabase(unittest.TestCase):
+    '''Defines unit tests for the asyncio facade.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+        accounts.add_account('1001', 'Checking', 10000)
+        accounts.add_account('1002', 'Savings', 0)
+
+        stdout = mock.patch('sys.stdout', new_callable=io.StringIO)
+        stdout.start()
+        self.addCleanup(stdout.stop)
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def run_async(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_concurrent_reads(self):
+        '''Queries are awaited concurrently and run off the event loop's thread'''
+        async def scenario():
+            async with aio.Database(self.path) as database:
+                return await asyncio.gather(
+                    database.accounts.get(1),
+                    database.accounts.all(),
+                    database.execute('SELECT COUNT(*) FROM accounts'),
+                    database.run(lambda: db._connection() is not db.conn))
+
+        checking, everything, count, own_connection = self.run_async(scenario())
+        self.assertEqual(checking.name, 'Checking')
+        self.assertEqual([acct.name for acct in everything], ['Checking', 'Savings'])
+        self.assertEqual(count, [(2,)])
+        self.assertTrue(own_connection)
+
+    def test_batched_writes(self):
+        '''Writes queued together are committed together'''
+        statements = []
+
+        async def scenario():
+            async with aio.Database(self.path) as database:
+                await database.run(lambda: db._connection().set_trace_callback(statements.append))
+                return await asyncio.gather(*[
+                    database.transactions.create(1, 'Coffee {}'.format(i), transactions.WITHDRAWAL_ID, 300)
+                    for i in range(20)])
+
+        self.assertEqual(self.run_async(scenario()), [True] * 20)
+        self.assertEqual(statements.count('COMMIT'), 1)
+        self.assertEqual(accounts.get_balance(1), 10000 - 20 * 300)
+
+    def test_failed_write_in_batch(self):
+        '''A failing write doesn't undo the others in its batch'''
+        async def scenario():
+            async with aio.Database(self.path) as database:
+                return await asyncio.gather(
+                    database.transactions.create(1, 'Rent', transactions.WITHDRAWAL_ID, 2500),
+                    database.transactions.create(99, 'Nowhere', transactions.DEPOSIT_ID, 100),
+                    database.transactions.create(1, 'Lunch', transactions.WITHDRAWAL_ID, 1000, 42),
+                    database.accounts.post(2, 500),
+                    return_exceptions=True)
+
+        created, missing, bad_category, posted = self.run_async(scenario())
+        self.assertTrue(created)
+        self.assertIsInstance(missing, Exception)  # Foreign key on account_id
+        self.assertIsInstance(bad_category, Exception)
+        self.assertTrue(posted)
+        self.assertEqual(accounts.get_balance(1), 10000 - 2500)
+        self.assertEqual(accounts.get_balance(2), 500)
+        self.assertEqual(db.cursor().execute('SELECT COUNT(*) FROM transactions').fetchone()[0], 1)
+
+    def test_unknown_helper(self):
+        '''Only the listed helpers are exposed'''
+        database = aio.Database(self.path)
+        with self.assertRaises(AttributeError):
+            database.accounts.delete
+        with self.assertRaises(RuntimeError):
+            self.run_async(database.accounts.get(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+'''
+File: test_budget.py
+
+Defines unit tests for budget.py.
+'''
+
+import shutil
+import tempfile
+import unittest
+
+from oink import accounts, budget, category, db, migrations, transactions
+
+
+class TestBudgetEvaluation(unittest.TestCase):
+    '''Defines unit tests for evaluating budget balances.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+
+        cur = db.cursor()
+        accounts.add_account('1001', 'Checking', 100000)
+        accounts.add_account('1002', 'Savings', 50000)
+        category.create('Food')
+        category.create('Rent')
+
+        # (account, type, amount, category, created_at)
+        rows = [
+            (1, transactions.WITHDRAWAL_ID, 2500, 1, '2018-06-01 09:00:00'),
+            (1, transactions.WITHDRAWAL_ID, 1000, 1, '2018-06-30 23:59:59'),
+            (1, transactions.DEPOSIT_ID, 300, 1, '2018-06-15 12:00:00'),
+            (1, transactions.WITHDRAWAL_ID, 9999, 1, '2018-07-01 00:00:00'),
+            (1, transactions.WITHDRAWAL_ID, 80000, 2, '2018-06-02 10:00:00'),
+            (2, transactions.WITHDRAWAL_ID, 700, 1, '2018-06-03 10:00:00'),
+            (1, transactions.WITHDRAWAL_ID, 400, 1, '2018-12-24 10:00:00'),
+        ]
+        cur.executemany('INSERT INTO transactions (account_id, transaction_type_id, \
+            amount, category_id, created_at) VALUES (?, ?, ?, ?, ?)', rows)
+
+        budget.create(1, 1, 10000, 2018, 6)
+        budget.create(1, 2, 90000, 2018, 6)
+        budget.create(2, 1, 5000, 2018, 6)
+        budget.create(1, 1, 10000, 2018, 12)
+        budget.create(2, 2, 5000, 2018, 7)
+        db.commit()
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def test_evaluate_month_balances(self):
+        '''Budget balances for a month net the in-month category transactions'''
+        balances = {bud.id: bud.balance for bud in budget.evaluate_month(6, 2018)}
+        self.assertEqual(balances, {1: 10000 - 2500 - 1000 + 300, 2: 10000, 3: 4300})
+
+    def test_evaluate_december_rolls_over_year(self):
+        '''December budgets are bounded by January of the following year'''
+        buds = budget.evaluate_month(12, 2018)
+        self.assertEqual([bud.balance for bud in buds], [9600])
+
+    def test_budget_without_transactions_keeps_its_amount(self):
+        '''A budget with no matching transactions has a balance of its amount'''
+        buds = budget.evaluate_month(7, 2018)
+        self.assertEqual([(bud.account_name, bud.balance) for bud in buds], [('Savings', 5000)])
+
+    def test_list_for_account_uses_single_query(self):
+        '''Listing budgets for an account does not query once per budget'''
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+        buds = budget.list_for_account(1, '2018-01-01', '2018-12-31')
+        db.conn.set_trace_callback(None)
+
+        self.assertEqual([bud.balance for bud in buds], [6800, 10000, 9600])
+        self.assertEqual(len(statements), 1)
+
+    def test_balances_are_loaded_lazily_in_bulk(self):
+        '''Constructing budgets is free; loading their balances is one query'''
+        rows = db.cursor().execute('SELECT id, account_id, category_id, NULL, \
+            amount, year, month, created_at FROM budgets ORDER BY id').fetchall()
+
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+        buds = [budget.Budget(*row) for row in rows * 200]
+        self.assertEqual(len(statements), 0)
+
+        budget.load_balances(buds)
+        balances = [bud.balance for bud in buds[:5]]
+        db.conn.set_trace_callback(None)
+
+        self.assertEqual(balances, [6800, 10000, 4300, 9600, 5000])
+        self.assertEqual(len(statements), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+'''
+File: test_cli.py
+
+Defines unit tests for cli.py.
+'''
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from oink import accounts, cli, colorize, db, migrations, router, transactions
+
+
+SCHEME = dict.fromkeys(['info', 'error', 'success', 'warning', 'input', 'headers', 'default'], 'white')
+
+
+class TestNonInteractive(unittest.TestCase):
+    '''Defines unit tests for running commands without an interactive session.'''
+
+    @classmethod
+    def setUpClass(cls):
+        if not router.commands:
+            cli.register_commands()
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+
+        scheme = mock.patch.object(colorize, 'COLOR_SCHEME', SCHEME)
+        scheme.start()
+        self.addCleanup(scheme.stop)
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def categories(self):
+        return [row[0] for row in db.cursor().execute('SELECT name FROM categories ORDER BY id')]
+
+    def run_script(self, text):
+        path = os.path.join(self.path, 'script.oink')
+        with open(path, 'w') as fout:
+            fout.write(text)
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            return cli.run_script(path)
+
+    def test_parse_args(self):
+        '''Words after the options make up the command'''
+        args = cli.parse_args(['lt', '1', '50'])
+        self.assertEqual((args.script, args.command), (None, ['lt', '1', '50']))
+        args = cli.parse_args(['-f', '-'])
+        self.assertEqual((args.script, args.command), ('-', []))
+
+    def test_run_command(self):
+        '''A single command reports whether it succeeded'''
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertTrue(cli.run_command(['ac', 'Groceries']))
+            self.assertFalse(cli.run_command(['nope']))
+            self.assertFalse(cli.run_command(['ac']))
+        self.assertEqual(self.categories(), ['Groceries'])
+
+    def test_failing_handler(self):
+        '''Commands whose handler reports an error fail'''
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.assertFalse(cli.run_command(['dt', '999']))
+            self.assertFalse(cli.run_command(['lt', '5']))
+            self.assertTrue(cli.run_command(['ac', 'Rent']))
+            self.assertFalse(cli.run_command(['ac', 'Rent']))
+        self.assertIn('No transaction was found with ID `999`', stdout.getvalue())
+
+    def test_exit_status(self):
+        '''Oink exits with a non-zero status when its command fails'''
+        config = dict(cli.DEFAULT_CONFIG, databasePath=self.path)
+        with mock.patch.object(cli, 'load_config', return_value=config), \
+                mock.patch.object(cli, 'register_commands'), \
+                mock.patch.object(cli, 'REPORT_CACHE_PATH', os.path.join(self.path, 'report_cache.db')), \
+                mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertEqual(cli.main(['dt', '999']), 1)
+            self.assertEqual(cli.main(['ac', 'Rent']), 0)
+        db.connect(self.path)
+        self.assertEqual(self.categories(), ['Rent'])
+
+    def test_run_script(self):
+        '''Scripts skip comments and blank lines and stop at `q`'''
+        self.assertTrue(self.run_script('# Monthly setup\nac Rent\n\nac "Eating Out"\nq\nac Never\n'))
+        self.assertEqual(self.categories(), ['Rent', 'Eating Out'])
+
+    def test_failed_script_keeps_nothing(self):
+        '''A failing command rolls back the whole script'''
+        self.assertFalse(self.run_script('ac Rent\nac Utilities\nbogus\n'))
+        self.assertEqual(self.categories(), [])
+
+    def test_failed_handler_rolls_back_script(self):
+        '''A command whose handler reports an error rolls back the whole script'''
+        self.assertFalse(self.run_script('ac Rent\ndt 999\nac Utilities\n'))
+        self.assertEqual(self.categories(), [])
+
+    def test_listing_everything_in_script(self):
+        '''Listing every transaction does not read the script's next line as input'''
+        accounts.add_account('1001', 'Checking', 0)
+        transactions.create(1, 'Paycheck', transactions.DEPOSIT_ID, 5000)
+        stdin = io.StringIO('lt 1 *\nac Rent\n')
+        with mock.patch('sys.stdin', stdin), mock.patch.object(transactions, '_print_rows'), \
+                mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertTrue(cli.run_script('-'))
+        self.assertEqual(self.categories(), ['Rent'])
+
+    def test_script_from_stdin(self):
+        '''Commands can be piped in, including answers to their prompts'''
+        stdin = io.StringIO('ac Rent\ndc 1\ny\n')
+        with mock.patch('sys.stdin', stdin), mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertTrue(cli.run_script('-'))
+        self.assertEqual(self.categories(), [])
+
+
+class TestStartup(unittest.TestCase):
+    '''Defines unit tests for keeping startup fast.'''
+
+    def test_heavy_modules_are_imported_lazily(self):
+        '''Starting Oink does not import reporting, the importer, tabulate or inspect'''
+        code = 'import sys; from oink import cli; cli.register_commands(); ' + \
+            'print(sorted(m for m in ("oink.reporting", "oink.importer", "tabulate", "inspect") if m in sys.modules))'
+        output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+        self.assertEqual(output.strip(), '[]')
+
+    def test_lazy_handler(self):
+        '''Lazy handlers import their module when first run'''
+        handler = cli.lazy('.utils', 'strfmoney')
+        self.assertEqual(handler(410), '4.10')
+
+    def test_timing_flag(self):
+        '''The timing flag can come before a command'''
+        args = cli.parse_args(['--timing', 'lt', '1'])
+        self.assertTrue(args.timing)
+        self.assertEqual(args.command, ['lt', '1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,268 @@
+'''
+File: test_db.py
+
+Defines unit tests for db.py.
+'''
+
+import concurrent.futures
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from oink import accounts, db, migrations
+
+
+class TestConnectionProfile(unittest.TestCase):
+    '''Defines unit tests for configuring database connections.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+        accounts.add_account('1001', 'Checking', 10000)
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def pragma(self, connection, name):
+        return connection.execute('PRAGMA {}'.format(name)).fetchone()[0]
+
+    def test_default_profile(self):
+        '''Connections default to WAL mode with the tuned pragmas'''
+        self.assertEqual(self.pragma(db.conn, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(db.conn, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(db.conn, 'cache_size'), -16000)
+        self.assertEqual(self.pragma(db.conn, 'temp_store'), 2)  # MEMORY
+        self.assertEqual(self.pragma(db.conn, 'foreign_keys'), 1)
+
+    def test_profile_overrides(self):
+        '''Settings from the config override the defaults'''
+        connection = db.open_connection(self.path, {'synchronous': 'full', 'cacheSize': 500})
+        self.assertEqual(self.pragma(connection, 'synchronous'), 2)  # FULL
+        self.assertEqual(self.pragma(connection, 'cache_size'), 500)
+        connection.close()
+
+    def test_invalid_profile(self):
+        '''Invalid settings are rejected rather than put into a pragma'''
+        with self.assertRaises(ValueError):
+            db.open_connection(self.path, {'journalMode': 'WAL; DROP TABLE accounts'})
+        with self.assertRaises(ValueError):
+            db.open_connection(self.path, {'cacheSize': 'lots'})
+
+    def test_read_only(self):
+        '''Read-only connections can read but not write'''
+        reader = db.open_connection(self.path, read_only=True)
+        self.assertEqual(reader.execute('SELECT name FROM accounts').fetchall(), [('Checking',)])
+        with self.assertRaises(sqlite3.OperationalError):
+            reader.execute('DELETE FROM accounts')
+        reader.close()
+
+    def test_readers_do_not_wait_on_writer(self):
+        '''A reader sees the last committed state while a write is in progress'''
+        reader = db.open_connection(self.path, {'readOnly': True})
+        with db.transaction():
+            accounts.post(1, 500)
+            balance = reader.execute('SELECT balance FROM accounts WHERE id = 1').fetchone()[0]
+        self.assertEqual(balance, 10000)
+        self.assertEqual(reader.execute('SELECT balance FROM accounts').fetchone()[0], 10500)
+        reader.close()
+
+    def test_nested_transactions(self):
+        '''Nested blocks can be rolled back without the outermost one'''
+        with db.transaction():
+            accounts.post(1, 100)
+            with self.assertRaises(RuntimeError):
+                with db.transaction():
+                    accounts.post(1, 1000)
+                    raise RuntimeError('interrupted')
+            with db.transaction():
+                accounts.post(1, 5000)
+                db.rollback()
+            accounts.post(1, 10)
+        self.assertEqual(accounts.get_balance(1), 10000 + 100 + 10)
+
+
+class TestPool(unittest.TestCase):
+    '''Defines unit tests for using the database from several threads.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+        accounts.add_account('1001', 'Checking', 10000)
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def in_threads(self, target, count=4):
+        results, errors = [None] * count, []
+        def run(index):
+            try:
+                results[index] = target(index)
+            except Exception as err:
+                errors.append(err)
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_threads_get_their_own_connection(self):
+        '''The existing helpers can be called from any thread'''
+        def work(index):
+            with db.transaction():
+                accounts.post(1, 100)
+            return accounts.get_balance(1), db._connection()
+
+        results = self.in_threads(work)
+        self.assertEqual(accounts.get_balance(1), 10000 + 4 * 100)
+        connections = {id(connection) for _, connection in results}
+        self.assertEqual(len(connections), 4)
+        self.assertNotIn(id(db.conn), connections)
+
+    def test_reconnecting_reopens_thread_connections(self):
+        '''Reused threads follow `connect()` to the new database'''
+        other = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other)
+        balance = lambda: accounts.get_balance(1)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(executor.submit(balance).result(), 10000)
+            old_pool = db.pool
+
+            db.disconnect()
+            db.connect(self.path)
+            self.assertEqual(executor.submit(balance).result(), 10000)
+
+            # Connecting again without disconnecting closes the old connections
+            old_conn = db.conn
+            db.connect(other)
+            migrations.migrate()
+            accounts.add_account('2001', 'Elsewhere', 300)
+            self.assertEqual(executor.submit(balance).result(), 300)
+        self.assertTrue(old_pool._closed)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            old_conn.execute('SELECT 1')
+
+    def test_reader_sees_one_snapshot(self):
+        '''Queries in a reader block see the ledger as it was when it started'''
+        with db.pool.reader():
+            before = accounts.get_balance(1)
+            def write(index):
+                with db.transaction():
+                    accounts.post(1, 500)
+            self.in_threads(write, count=1)
+            self.assertEqual(accounts.get_balance(1), before)
+            with self.assertRaises(sqlite3.OperationalError):
+                accounts.post(1, 1)
+        with db.pool.reader():
+            self.assertEqual(accounts.get_balance(1), before + 500)
+
+    def test_readers_and_writers(self):
+        '''Readers run side by side while writers take turns'''
+        def work(index):
+            if index % 2:
+                with db.pool.writer():
+                    accounts.post(1, 10)
+                return None
+            with db.pool.reader() as connection:
+                return connection.execute('SELECT COUNT(*) FROM accounts').fetchone()[0]
+
+        results = self.in_threads(work, count=8)
+        self.assertEqual([result for result in results if result is not None], [1] * 4)
+        self.assertEqual(accounts.get_balance(1), 10000 + 4 * 10)
+        self.assertLessEqual(len(db.pool._opened), db.pool.size + 1)
+
+    def test_pool_size(self):
+        '''The pool never opens more readers than its size'''
+        pool = db.Pool(self.path, size=2)
+        def work(index):
+            with pool.reader() as connection:
+                return connection.execute('SELECT COUNT(*) FROM accounts').fetchone()[0]
+        self.assertEqual(self.in_threads(work, count=6), [1] * 6)
+        self.assertLessEqual(len(pool._opened), 2)
+        pool.close()
+        with self.assertRaises(ValueError):
+            db.Pool(self.path, size=0)
+
+
+class TestInstrumentation(unittest.TestCase):
+    '''Defines unit tests for the query statistics.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+        db.reset_stats()
+        db.instrument(True)
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.instrument(False)
+        db.reset_stats()
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def test_normalize(self):
+        '''Literals, IN lists and whitespace are folded together'''
+        self.assertEqual(db.normalize("SELECT *  FROM t\n WHERE a = 12 AND b = 'x''y' AND c IN (?, ?, ?)"),
+            'SELECT * FROM t WHERE a = ? AND b = ? AND c IN (?)')
+
+    def test_repeated_queries_are_grouped(self):
+        '''The same query issued per row shows up as one frequent entry'''
+        for i in range(5):
+            accounts.add_account(str(1000 + i), 'Account {}'.format(i), 0)
+        for i in range(5):
+            db.cursor().execute('SELECT name FROM accounts WHERE id = {}'.format(i + 1)).fetchone()
+        rows = db.cursor().execute('SELECT id FROM accounts')
+        self.assertEqual(len(list(rows)), 5)
+
+        stats = {stat['sql']: stat for stat in db.query_stats('calls')}
+        per_row = stats['SELECT name FROM accounts WHERE id = ?']
+        self.assertEqual((per_row['calls'], per_row['rows']), (5, 5))
+        self.assertEqual(stats['SELECT id FROM accounts']['rows'], 5)
+        self.assertEqual(db.query_stats('calls')[0]['calls'], 5)
+        self.assertGreaterEqual(per_row['max_time'], per_row['mean_time'])
+
+    def test_recording_is_locked(self):
+        '''Queries are recorded under a lock, as any thread may run them'''
+        recorder = threading.Thread(target=db._record, args=('SELECT 1', 0.5), kwargs={'calls': 1})
+        with db._stats_lock:
+            recorder.start()
+            recorder.join(0.1)
+            self.assertTrue(recorder.is_alive())
+            self.assertEqual(db._stats, {})
+        recorder.join()
+        self.assertEqual([(stat['sql'], stat['calls']) for stat in db.query_stats()], [('SELECT ?', 1)])
+
+    def test_export_stats(self):
+        '''Statistics can be exported as JSON'''
+        db.cursor().execute('SELECT COUNT(*) FROM accounts').fetchone()
+        path = os.path.join(self.path, 'stats.json')
+        db.export_stats(path)
+        with open(path) as fin:
+            exported = json.load(fin)
+        self.assertEqual([stat['sql'] for stat in exported], ['SELECT COUNT(*) FROM accounts'])
+
+    def test_disabled(self):
+        '''Nothing is recorded while instrumentation is off'''
+        db.instrument(False)
+        db.cursor().execute('SELECT COUNT(*) FROM accounts').fetchone()
+        self.assertEqual(db.query_stats(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
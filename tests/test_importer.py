@@ -0,0 +1,179 @@
+'''
+File: test_importer.py
+
+Defines unit tests for importer.py.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from oink import accounts, category, db, importer, migrations, rules, transactions
+
+
+OFX = '''OFXHEADER:100
+DATA:OFXSGML
+
+<OFX>
+<BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20180623120000[-5:EST]
+<TRNAMT>-42.10
+<NAME>AMAZON MKTPLACE
+</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20180625<TRNAMT>1500.00<NAME>PAYROLL</NAME></STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1>
+</OFX>
+'''
+
+QIF = '''!Type:Bank
+D6/23'18
+T-42.10
+PAMAZON MKTPLACE
+^
+D06/25/2018
+T1,500.00
+PPAYROLL
+^
+'''
+
+
+class TestImporter(unittest.TestCase):
+    '''Defines unit tests for importing bank exports.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+        accounts.add_account('1001', 'Checking', 10000)
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def write(self, name, content):
+        path = os.path.join(self.path, name)
+        with open(path, 'w') as fout:
+            fout.write(content)
+        return path
+
+    def imported(self):
+        return db.cursor().execute('SELECT transaction_type_id, description, amount, created_at \
+            FROM transactions ORDER BY id').fetchall()
+
+    def assert_sample_imported(self):
+        self.assertEqual(self.imported(), [
+            (transactions.WITHDRAWAL_ID, 'AMAZON MKTPLACE', 4210, '2018-06-23 12:00:00'),
+            (transactions.DEPOSIT_ID, 'PAYROLL', 150000, '2018-06-25 00:00:00'),
+        ])
+        self.assertEqual(accounts.get_balance(1), 10000 - 4210 + 150000)
+
+    def test_import_csv_signed_amounts(self):
+        '''CSV exports with a signed amount column'''
+        path = self.write('export.csv', 'Date,Description,Amount\n'
+            '2018-06-23,AMAZON MKTPLACE,-42.10\n'
+            '2018-06-25,PAYROLL,"1,500.00"\n')
+        self.assertEqual(importer.import_file(path, 1), 2)
+        self.assertEqual([row[:3] for row in self.imported()], [
+            (transactions.WITHDRAWAL_ID, 'AMAZON MKTPLACE', 4210),
+            (transactions.DEPOSIT_ID, 'PAYROLL', 150000),
+        ])
+        self.assertEqual(accounts.get_balance(1), 10000 - 4210 + 150000)
+
+    def test_import_csv_debit_credit_columns(self):
+        '''CSV exports with separate debit and credit columns'''
+        path = self.write('export.csv', 'Posted Date,Payee,Debit,Credit\n'
+            '06/23/2018,AMAZON MKTPLACE,42.10,\n'
+            '06/25/2018,PAYROLL,,1500.00\n')
+        self.assertEqual(importer.import_file(path, 1), 2)
+        self.assertEqual(accounts.get_balance(1), 10000 - 4210 + 150000)
+
+    def test_import_ofx(self):
+        '''OFX statements in both SGML and XML style'''
+        path = self.write('export.ofx', OFX)
+        self.assertEqual(importer.import_file(path, 1), 2)
+        self.assert_sample_imported()
+
+    def test_import_qif(self):
+        '''QIF exports with Quicken style dates'''
+        path = self.write('export.qif', QIF)
+        self.assertEqual(importer.import_file(path, 1), 2)
+        self.assertEqual([row[:3] for row in self.imported()], [
+            (transactions.WITHDRAWAL_ID, 'AMAZON MKTPLACE', 4210),
+            (transactions.DEPOSIT_ID, 'PAYROLL', 150000),
+        ])
+        self.assertEqual(accounts.get_balance(1), 10000 - 4210 + 150000)
+
+    def test_failed_import_imports_nothing(self):
+        '''An unparseable row rolls the whole import back'''
+        path = self.write('export.csv', 'Date,Description,Amount\n'
+            '2018-06-23,AMAZON MKTPLACE,-42.10\n'
+            'yesterday,PAYROLL,1500.00\n')
+        with self.assertRaises(importer.ImportFileError):
+            importer.import_file(path, 1, batch_size=1)
+        self.assertEqual(self.imported(), [])
+        self.assertEqual(accounts.get_balance(1), 10000)
+
+    def test_import_csv_with_byte_order_mark(self):
+        '''CSV exports starting with a UTF-8 byte order mark'''
+        path = os.path.join(self.path, 'export.csv')
+        with open(path, 'w', encoding='utf-8-sig') as fout:
+            fout.write('Date,Description,Amount\n'
+                '2018-06-23,AMAZON MKTPLACE,-42.10\n'
+                '2018-06-25,PAYROLL,"1,500.00"\n')
+        self.assertEqual(importer.import_file(path, 1), 2)
+        self.assertEqual([row[:3] for row in self.imported()], [
+            (transactions.WITHDRAWAL_ID, 'AMAZON MKTPLACE', 4210),
+            (transactions.DEPOSIT_ID, 'PAYROLL', 150000),
+        ])
+
+    def test_unreadable_files(self):
+        '''Files in another encoding or of malformed CSV fail to import cleanly'''
+        path = os.path.join(self.path, 'export.csv')
+        with open(path, 'wb') as fout:
+            fout.write('Date,Description,Amount\n2018-06-23,Caf\xe9,-4.10\n'.encode('latin-1'))
+        with self.assertRaises(importer.ImportFileError):
+            importer.import_file(path, 1)
+        self.assertEqual(importer.import_file(path, 1, encoding='latin-1'), 1)
+
+        path = self.write('broken.csv', 'Date,Description,Amount\n2018-06-23,"{}",-1.00\n'.format('x' * 200000))
+        with self.assertRaises(importer.ImportFileError):
+            importer.import_file(path, 1)
+        self.assertEqual(len(self.imported()), 1)
+
+    def test_import_applies_rules(self):
+        '''Imported transactions are categorized by the rules'''
+        category.create('Shopping')
+        rules.create(1, rules.CONTAINS, 'amazon')
+        importer.import_file(self.write('export.qif', QIF), 1)
+        categories = db.cursor().execute('SELECT description, category_id FROM transactions ORDER BY id').fetchall()
+        self.assertEqual(categories, [('AMAZON MKTPLACE', 1), ('PAYROLL', None)])
+
+    def test_import_large_file(self):
+        '''Large files are imported in batches'''
+        lines = ['Date,Description,Amount\n']
+        lines += ['2018-06-{:02d},Row {},-1.00\n'.format(i % 28 + 1, i) for i in range(100000)]
+        path = self.write('export.csv', ''.join(lines))
+        self.assertEqual(importer.import_file(path, 1), 100000)
+        self.assertEqual(accounts.get_balance(1), 10000 - 100000 * 100)
+
+    def test_balance_is_posted_once(self):
+        '''The balance is updated once per import, however many months it spans'''
+        lines = ['Date,Description,Amount\n']
+        lines += ['2018-{:02d}-15,Row {},-1.00\n'.format(month, month) for month in range(1, 13)]
+        path = self.write('export.csv', ''.join(lines))
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+        importer.import_file(path, 1)
+        db.conn.set_trace_callback(None)
+        updates = [sql for sql in statements if sql.lstrip().startswith('UPDATE accounts')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(accounts.get_balance(1), 10000 - 12 * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+'''
+File: test_migrations.py
+
+Defines unit tests for migrations.py.
+'''
+
+import shutil
+import tempfile
+import unittest
+
+from oink import db, migrations
+
+
+class TestMigrations(unittest.TestCase):
+    '''Defines unit tests for upgrading the database schema.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def query_plan(self, sql, params=()):
+        rows = db.cursor().execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        return ' '.join(row[-1] for row in rows)
+
+    def test_migrate_new_database(self):
+        '''A fresh database is brought to the latest version'''
+        applied = migrations.migrate()
+        self.assertEqual(applied, [number for number, _, _ in migrations.MIGRATIONS])
+        self.assertEqual(migrations.version(), migrations.LATEST_VERSION)
+        self.assertEqual(migrations.pending(), [])
+
+        types = db.cursor().execute('SELECT id, name FROM transaction_types ORDER BY id').fetchall()
+        self.assertEqual(types, [(0, 'deposit'), (1, 'withdrawal')])
+
+    def test_migrate_is_idempotent(self):
+        '''Migrating an up-to-date database does nothing'''
+        migrations.migrate()
+        self.assertEqual(migrations.migrate(), [])
+
+    def test_migrate_legacy_database(self):
+        '''Databases created before migrations existed keep their data'''
+        cur = db.cursor()
+        cur.execute('CREATE TABLE accounts (id integer NOT NULL PRIMARY KEY, \
+            account_number text NOT NULL, name text NOT NULL UNIQUE, \
+            balance integer NOT NULL, created_at text NOT NULL)')
+        cur.execute('INSERT INTO accounts VALUES (1, "24", "Legacy", 100, "2017-01-01")')
+        db.commit()
+
+        migrations.migrate()
+        self.assertEqual(cur.execute('SELECT name FROM accounts').fetchall(), [('Legacy',)])
+
+    def test_indexes_on_large_ledger(self):
+        '''Migrating a million-row ledger adds indexes the hot paths use'''
+        migrations.migrate(target=1)
+        cur = db.cursor()
+        cur.execute('INSERT INTO accounts VALUES (1, "1", "Checking", 0, "2017-01-01")')
+        cur.execute('INSERT INTO accounts VALUES (2, "2", "Savings", 0, "2017-01-01")')
+        cur.execute('INSERT INTO categories VALUES (1, "Food")')
+        cur.execute('''
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < 1000000)
+            INSERT INTO transactions (account_id, transaction_type_id, description, amount, category_id, created_at)
+            SELECT n % 2 + 1, n % 2, 'Transaction ' || n, n % 5000, CASE WHEN n % 3 = 0 THEN 1 END,
+                datetime('2010-01-01', '+' || (n / 100) || ' minutes')
+            FROM seq''')
+        db.commit()
+
+        sum_query = 'SELECT SUM(amount) FROM transactions \
+            WHERE account_id = ? AND transaction_type_id = ? AND created_at BETWEEN ? AND ?'
+        params = (1, 0, '2010-01-01', '2010-01-02')
+        before = cur.execute(sum_query, params).fetchone()
+
+        self.assertEqual(migrations.migrate(), list(range(2, migrations.LATEST_VERSION + 1)))
+        self.assertEqual(cur.execute('SELECT COUNT(*) FROM transactions').fetchone()[0], 1000000)
+        self.assertEqual(cur.execute(sum_query, params).fetchone(), before)
+
+        self.assertIn('USING COVERING INDEX idx_transactions_account_created',
+            self.query_plan(sum_query, params))
+        self.assertIn('USING COVERING INDEX idx_transactions_account_category_created',
+            self.query_plan('SELECT SUM(amount) FROM transactions WHERE account_id = ? \
+                AND category_id = ? AND created_at BETWEEN ? AND ?', (1, 1, '2010-01', '2010-02')))
+
+
+if __name__ == '__main__':
+    unittest.main()
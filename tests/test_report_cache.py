@@ -0,0 +1,158 @@
+'''
+File: test_report_cache.py
+
+Defines unit tests for report_cache.py.
+'''
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from oink import accounts, budget, category, db, migrations, report_cache, transactions
+from oink.reporting import reports
+
+
+def raw(value):
+    '''Leaves money amounts as atomic integers.'''
+    return value
+
+
+class TestReportCache(unittest.TestCase):
+    '''Defines unit tests for the persistent report cache.'''
+
+    def setUp(self):
+        '''Setup testing database and cache.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+        report_cache.configure(os.path.join(self.path, 'report_cache.db'))
+
+        accounts.add_account('1001', 'Checking', 100000)
+        category.create('Food')
+        self.record('Groceries', 2500, '2018-05-20 09:00:00')
+        self.record('Pizza', 1800, '2018-06-15 19:00:00')
+        budget.create(1, 1, 5000, 2018, 6)
+
+    def tearDown(self):
+        '''Destroys the testing database and turns the cache off.'''
+        report_cache.configure(None)
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def record(self, description, amount, created_at):
+        '''Records a withdrawal for Food made at `created_at`'''
+        with db.transaction():
+            db.cursor().execute('INSERT INTO transactions (account_id, transaction_type_id, \
+                description, amount, category_id, created_at) VALUES (1, ?, ?, ?, 1, ?)',
+                (transactions.WITHDRAWAL_ID, description, amount, created_at))
+            accounts.post(1, -amount)
+
+    def june(self):
+        '''The June report data and the statements run to get it'''
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+        data = reports.generate_report_data('2018-06-01', '2018-06-30', money=raw)
+        db.conn.set_trace_callback(None)
+        data['report'].pop('created_at')
+        return data, len(statements)
+
+    def test_unchanged_range_is_cached(self):
+        '''Reports for an unchanged range are served from the cache'''
+        built, queries = self.june()
+        cached, cached_queries = self.june()
+        self.assertEqual(cached, built)
+        self.assertEqual(cached_queries, 1)
+        self.assertEqual(cached['accounts'][1]['budgets'][1]['balance'], 5000 - 1800)
+
+    def test_changes_after_range_keep_entry(self):
+        '''Transactions after the range leave its report cached'''
+        built, queries = self.june()
+        self.record('Tacos', 900, '2018-07-02 12:00:00')
+        budget.create(1, 1, 5000, 2018, 7)
+        cached, cached_queries = self.june()
+        self.assertEqual(cached_queries, 1)
+        self.assertEqual(cached, built)
+
+    def test_changes_up_to_range_invalidate_entry(self):
+        '''Transactions within or before the range, budgets and accounts do not'''
+        category.create('Rent')
+        changes = [
+            lambda: self.record('Bagels', 300, '2018-06-20 08:00:00'),
+            lambda: self.record('Backdated', 100, '2017-12-31 23:00:00'),
+            lambda: budget.create(1, 2, 100000, 2018, 6),
+            lambda: db.cursor().execute("UPDATE accounts SET name = 'Main' WHERE id = 1"),
+        ]
+        for change in changes:
+            self.june()
+            change()
+            data, queries = self.june()
+            self.assertGreater(queries, 1)
+        self.assertEqual(len(data['accounts'][1]['transactions']), 2)
+        self.assertEqual(len(data['accounts'][1]['budgets']), 2)
+        self.assertEqual(data['accounts'][1]['name'], 'Main')
+
+    def test_year_only_range(self):
+        '''Changes within the last year of a year-only range invalidate its entry'''
+        def budget_balance():
+            data = reports.generate_report_data('2017', '2018', money=raw)
+            return data['accounts'][1]['budgets'][1]['balance']
+
+        self.assertEqual(budget_balance(), 5000 - 1800)
+        self.record('Backdated', 2000, '2018-06-10 08:00:00')
+        self.assertEqual(budget_balance(), 5000 - 1800 - 2000)
+
+    def test_least_recently_used_are_evicted(self):
+        '''The cache stays within its size by evicting the least recently used'''
+        report_cache.put('a', '2018-01', '2018-01', 'report')
+        with sqlite3.connect(report_cache.path) as connection:
+            size = connection.execute('SELECT size FROM reports').fetchone()[0]
+        report_cache.configure(report_cache.path, size * 3)
+
+        for key in 'bcd':
+            report_cache.put(key, '2018-' + key, '2018-' + key, 'report')
+        self.assertIsNone(report_cache.get('a'))
+        self.assertEqual(report_cache.get('b')[0], 'report')
+        report_cache.put('e', '2018-e', '2018-e', 'report')
+        self.assertEqual([key for key in 'bcde' if report_cache.get(key)], ['b', 'd', 'e'])
+
+    def test_rows_are_streamed_in_chunks(self):
+        '''Rows are written as they pass through and read back a chunk at a time'''
+        rows = [[i, 'row {}'.format(i)] for i in range(5)]
+        with mock.patch.object(report_cache, 'CHUNK_ROWS', 2):
+            self.assertEqual(list(report_cache.caching('a', '2018-01', '2018-01', 'report', iter(rows))), rows)
+        with sqlite3.connect(report_cache.path) as connection:
+            self.assertEqual(connection.execute('SELECT COUNT(*) FROM report_rows').fetchone()[0], 3)
+        data, cached = report_cache.get('a')
+        self.assertEqual(data, 'report')
+        self.assertEqual(next(cached), rows[0])
+        self.assertEqual(list(cached), rows[1:])
+
+    def test_unfinished_entries_are_not_kept(self):
+        '''Entries whose rows were not all read, or that outgrow the cache, are dropped'''
+        rows = report_cache.caching('a', '2018-01', '2018-01', 'report', iter([[1], [2]]))
+        self.assertEqual(next(rows), [1])
+        rows.close()
+        self.assertIsNone(report_cache.get('a'))
+
+        report_cache.configure(report_cache.path, 1024)
+        rows = [[i, os.urandom(16).hex()] for i in range(1000)]
+        with mock.patch.object(report_cache, 'CHUNK_ROWS', 10):
+            self.assertEqual(list(report_cache.caching('b', '2018-02', '2018-02', 'report', iter(rows))), rows)
+        self.assertIsNone(report_cache.get('b'))
+        with sqlite3.connect(report_cache.path) as connection:
+            self.assertEqual(connection.execute('SELECT COUNT(*) FROM report_rows').fetchone()[0], 0)
+
+    def test_caching_off(self):
+        '''Nothing is cached while caching is off'''
+        path = report_cache.path
+        report_cache.configure(path, 0)
+        self.june()
+        self.assertIsNone(report_cache.key('2018-06-01', '2018-06-30'))
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+'''
+File: test_reports.py
+
+Defines unit tests for the reporting package.
+'''
+
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from oink import accounts, budget, category, db, migrations, transactions
+from oink.reporting import reports, _csv, _html, _json
+
+
+def raw(value):
+    '''Leaves money amounts as atomic integers.'''
+    return value
+
+
+class ReportTestCase(unittest.TestCase):
+    '''Sets up a small ledger to report on.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+
+        accounts.add_account('1001', 'Checking', 100000)
+        accounts.add_account('1002', 'Savings', 50000)
+        accounts.add_account('1003', 'Empty', 0)
+        category.create('Food')
+
+        # (account, description, type, amount, category, created_at)
+        rows = [
+            (1, 'Groceries', transactions.WITHDRAWAL_ID, 2500, 1, '2018-05-20 09:00:00'),
+            (1, 'Paycheck', transactions.DEPOSIT_ID, 150000, None, '2018-06-01 09:00:00'),
+            (1, 'Pizza', transactions.WITHDRAWAL_ID, 1800, 1, '2018-06-15 19:00:00'),
+            (2, 'Interest', transactions.DEPOSIT_ID, 120, None, '2018-06-30 00:00:00'),
+            (1, 'Tacos', transactions.WITHDRAWAL_ID, 900, 1, '2018-07-02 12:00:00'),
+            (2, 'Withdrawal', transactions.WITHDRAWAL_ID, 10000, None, '2018-08-01 12:00:00'),
+        ]
+        cur = db.cursor()
+        cur.executemany('INSERT INTO transactions (account_id, description, \
+            transaction_type_id, amount, category_id, created_at) \
+            VALUES (?, ?, ?, ?, ?, ?)', rows)
+        # Current balances reflect every transaction
+        cur.execute('UPDATE accounts SET balance = 100000 - 2500 + 150000 - 1800 - 900 WHERE id = 1')
+        cur.execute('UPDATE accounts SET balance = 50000 + 120 - 10000 WHERE id = 2')
+        budget.create(1, 1, 5000, 2018, 6)
+        db.commit()
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+
+class TestReportData(ReportTestCase):
+    '''Defines unit tests for building report data.'''
+
+    def test_account_balances_and_totals(self):
+        '''Balances are as of the end of the range; totals cover the range'''
+        data = reports.generate_report_data('2018-06-01', '2018-06-30', money=raw)
+        checking, savings, empty = [data['accounts'][i] for i in (1, 2, 3)]
+
+        self.assertEqual(checking['balance'], 100000 - 2500 + 150000 - 1800)
+        self.assertEqual(checking['total_income'], 150000)
+        self.assertEqual(checking['total_expenses'], 1800)
+        self.assertEqual(checking['total_revenue'], 150000 - 1800)
+        self.assertEqual(savings['balance'], 50000)
+        self.assertEqual(savings['total_income'], 0)
+        self.assertEqual(empty['balance'], 0)
+        self.assertEqual(empty['transactions'], {})
+
+    def test_transactions_and_budgets(self):
+        '''Transactions and budgets are grouped under their account'''
+        data = reports.generate_report_data('2018-06-01', '2018-07-31', money=raw)
+        checking = data['accounts'][1]
+
+        self.assertEqual(list(checking['transactions']), [2, 3, 5])
+        self.assertEqual(checking['transactions'][3]['category']['name'], 'Food')
+        self.assertEqual(checking['transactions'][2]['type']['name'], 'deposit')
+        self.assertEqual(list(data['accounts'][2]['transactions']), [4])
+        self.assertEqual(checking['budgets'][1]['balance'], 5000 - 1800)
+
+    def test_running_balances(self):
+        '''Transactions carry the balance of their account after them'''
+        data = reports.generate_report_data('2018-06-01', '2018-07-31', money=raw)
+        balances = [trans['balance'] for trans in data['accounts'][1]['transactions'].values()]
+        self.assertEqual(balances, [
+            100000 - 2500 + 150000,
+            100000 - 2500 + 150000 - 1800,
+            100000 - 2500 + 150000 - 1800 - 900,
+        ])
+        self.assertEqual(data['accounts'][2]['transactions'][4]['balance'], 50000 + 120)
+
+    def test_constant_number_of_queries(self):
+        '''Building the report does not query once per account'''
+        for i in range(20):
+            accounts.add_account(str(2000 + i), 'Account {}'.format(i), 0)
+
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+        reports.generate_report_data('0000', '9999', money=raw)
+        db.conn.set_trace_callback(None)
+        self.assertEqual(len(statements), 3)
+
+
+class TestJsonReport(ReportTestCase):
+    '''Defines unit tests for the streaming JSON report writer.'''
+
+    def test_streamed_report_matches_report_data(self):
+        '''The streamed document is the same as dumping the report data'''
+        fout = io.StringIO()
+        report, accts = reports.iter_report_data('2018-06-01', '2018-07-31', money=raw)
+        _json.write_report(report, accts, fout)
+        streamed = json.loads(fout.getvalue())
+
+        expected = json.loads(json.dumps(
+            reports.generate_report_data('2018-06-01', '2018-07-31', money=raw)))
+        streamed['report'].pop('created_at')
+        expected['report'].pop('created_at')
+        self.assertEqual(streamed, expected)
+
+
+class TestCsvReport(ReportTestCase):
+    '''Defines unit tests for the streaming CSV report writer.'''
+
+    def test_rows(self):
+        '''Transactions then budgets of each account, one per row'''
+        fout = io.StringIO()
+        report, accts = reports.iter_report_data('2018-06-01', '2018-07-31', money=raw)
+        _csv.write_report(report, accts, fout)
+        rows = list(csv.reader(io.StringIO(fout.getvalue())))
+
+        self.assertEqual(rows[0], _csv.HEADER)
+        self.assertEqual([(row[0], row[4]) for row in rows[1:]],
+            [('transaction', '2'), ('transaction', '3'), ('transaction', '5'), ('budget', '1'), ('transaction', '4')])
+        self.assertEqual(rows[2], ['transaction', '1', '1001', 'Checking', '3', '2018-06-15 19:00:00',
+            'withdrawal', 'Pizza', 'Food', '-18.00', '2457.00', '2018', '06'])
+        self.assertEqual(rows[4][8:], ['Food', '50.00', '32.00', '2018', '06'])
+
+    def test_gzipped_report(self):
+        '''The rep command writes `.csv.gz` reports gzipped'''
+        path = os.path.join(self.path, 'june.csv.gz')
+        reports.report(path, '2018-06-01', '2018-06-30')
+        with gzip.open(path, 'rt', newline='') as fin:
+            rows = list(csv.reader(fin))
+        self.assertEqual([row[0] for row in rows[1:]], ['transaction', 'transaction', 'budget'])
+        self.assertEqual(_csv.decimal(-5), '-0.05')
+
+    def test_files_are_utf8(self):
+        '''Plain and gzipped files are encoded as UTF-8 whatever the locale'''
+        db.cursor().execute('UPDATE transactions SET description = ? WHERE id = 3', ('Café ☕',))
+        for name, opener in (('june.csv', open), ('june.csv.gz', gzip.open)):
+            path = os.path.join(self.path, name)
+            _csv.generate_report('2018-06-01', '2018-06-30', path)
+            with opener(path, 'rt', encoding='utf-8', newline='') as fin:
+                rows = list(csv.reader(fin))
+            self.assertEqual(rows[2][7], 'Café ☕')
+
+
+class TestHtmlReport(ReportTestCase):
+    '''Defines unit tests for the streaming HTML report writer.'''
+
+    def write(self, page_size=_html.PAGE_SIZE):
+        fout = io.StringIO()
+        report, accts = reports.iter_report_data('2018-06-01', '2018-07-31', money=raw)
+        _html.write_report(report, accts, fout, page_size)
+        return fout.getvalue()
+
+    def test_report(self):
+        '''Every account is rendered with its transactions and budgets'''
+        document = self.write()
+        self.assertTrue(document.startswith('<!DOCTYPE html>'))
+        self.assertTrue(document.endswith('</html>\n'))
+        self.assertEqual(document.count('<article class="account"'), 3)
+        self.assertIn('<td>Pizza</td><td>Food</td>', document)
+        self.assertEqual(document.count('<section class="page"'), 2)
+        self.assertIn('No transactions for this account', document)
+        self.assertIn('<td class="money">-1800</td><td class="money">245700</td>', document)
+
+    def test_values_are_escaped(self):
+        '''Descriptions cannot inject markup into the report'''
+        db.cursor().execute('UPDATE transactions SET description = ? WHERE id = 3', ('<b>Pizza & Co</b>',))
+        self.assertIn('<td>&lt;b&gt;Pizza &amp; Co&lt;/b&gt;</td>', self.write())
+
+    def test_file_is_utf8(self):
+        '''The file is encoded as UTF-8, as the document declares'''
+        db.cursor().execute('UPDATE transactions SET description = ? WHERE id = 3', ('Café ☕',))
+        path = os.path.join(self.path, 'report.html')
+        with mock.patch.object(_html, 'MONEY', raw):
+            _html.generate_report('2018-06-01', '2018-07-31', path)
+        with open(path, 'rb') as fin:
+            document = fin.read()
+        self.assertIn(b'<meta charset="utf-8">', document)
+        self.assertIn('<td>Café ☕</td>'.encode('utf-8'), document)
+
+    def test_pages(self):
+        '''Transactions are split into pages linked to each other'''
+        document = self.write(page_size=2)
+        self.assertIn('<section class="page" id="account-1-page-2">', document)
+        self.assertNotIn('id="account-1-page-3"', document)
+        self.assertIn('<a href="#account-1-page-2">Next &rarr;</a>', document)
+        self.assertIn('<a href="#account-1-page-1">&larr; Previous</a>', document)
+
+
+class TestMultiFormatReport(ReportTestCase):
+    '''Defines unit tests for generating a report in several formats at once.'''
+
+    def setUp(self):
+        super().setUp()
+        # Money left atomic so that the reports can be compared with the data
+        for writer in (_json, _html, _csv):
+            patcher = mock.patch.object(writer, 'MONEY', raw)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # One transaction at a time, so that the writers have to keep up
+        for name in ('FANOUT_BATCH_SIZE', 'FANOUT_QUEUE_SIZE'):
+            patcher = mock.patch.object(reports, name, 1)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.base = os.path.join(self.path, 'report')
+
+    def read(self, suffix):
+        with open(self.base + suffix, newline='') as fin:
+            return fin.read()
+
+    def test_single_data_pass(self):
+        '''Every format is written from one pass over the report data'''
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            reports.report(self.base, '2018-06-01', '2018-07-31', 'json, csv,html')
+        db.conn.set_trace_callback(None)
+        self.assertEqual(len(statements), 3)
+
+        written = json.loads(self.read('.json'))
+        expected = json.loads(json.dumps(
+            reports.generate_report_data('2018-06-01', '2018-07-31', money=raw)))
+        written['report'].pop('created_at')
+        expected['report'].pop('created_at')
+        self.assertEqual(written, expected)
+
+        fout = io.StringIO()
+        _csv.write_report(*reports.iter_report_data('2018-06-01', '2018-07-31', money=raw), fout)
+        self.assertEqual(self.read('.csv'), fout.getvalue())
+        self.assertIn('<td>Pizza</td><td>Food</td><td class="money">-1800</td>', self.read('.html'))
+
+    def test_failed_writer(self):
+        '''A failing writer neither stalls nor spoils the other formats'''
+        outputs = [('html', self.base + '.html'), ('json', self.base + '.json')]
+        with mock.patch.object(_html, 'write_report', side_effect=IOError('disk full')):
+            with self.assertRaises(IOError):
+                reports.generate_reports('2018-06-01', '2018-07-31', outputs)
+        self.assertEqual(list(json.loads(self.read('.json'))['accounts']), ['1', '2', '3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
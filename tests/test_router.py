@@ -0,0 +1,102 @@
+'''
+File: test_router.py
+
+Defines unit tests for router.py.
+'''
+
+import io
+import unittest
+from unittest import mock
+
+from oink import router
+
+
+class TestRouter(unittest.TestCase):
+    '''Defines unit tests for registering and routing commands.'''
+
+    def setUp(self):
+        '''Start every test with an empty registry.'''
+        for name, value in (('commands', []), ('handlers', {}), ('print_padding', 0)):
+            patcher = mock.patch.object(router, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.calls = []
+        router.register('header', 'Testing', None)
+        router.register('echo <first> [second]', 'Echo arguments', self.echo)
+        router.register('separator', None, None)
+
+    def echo(self, first, second=None):
+        self.calls.append((first, second))
+
+    def route(self, command):
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            return router.route(command)
+
+    def test_tokenize(self):
+        '''Quotes group words and backslashes escape quotes and spaces'''
+        self.assertEqual(router.tokenize('  lt 1   50 '), ['lt', '1', '50'])
+        self.assertEqual(router.tokenize('ac "Eating Out"'), ['ac', 'Eating Out'])
+        self.assertEqual(router.tokenize("ac 'Eating Out' \"\""), ['ac', 'Eating Out', ''])
+        self.assertEqual(router.tokenize(r'ac Eating\ Out "say \"hi\""'), ['ac', 'Eating Out', 'say "hi"'])
+        self.assertEqual(router.tokenize(r'rep C:\reports\june.txt'), ['rep', r'C:\reports\june.txt'])
+        self.assertEqual(router.tokenize('ac "unterminated name'), ['ac', 'unterminated name'])
+
+    def test_tokenize_long_argument(self):
+        '''Long quoted arguments are tokenized in linear time'''
+        text = 'x' * 200000
+        self.assertEqual(router.tokenize('echo "{}"'.format(text)), ['echo', text])
+
+    def test_route(self):
+        '''Commands are dispatched with their arguments'''
+        self.assertIsNone(self.route('echo one'))
+        self.assertIsNone(self.route('echo "one two" three'))
+        self.assertEqual(self.calls, [('one', None), ('one two', 'three')])
+
+    def test_route_errors(self):
+        '''Unknown commands and wrong argument counts are reported'''
+        self.assertIsNotNone(self.route('nope'))
+        self.assertIsNotNone(self.route('header'))
+        self.assertIsNotNone(self.route('echo'))
+        self.assertIsNotNone(self.route('echo 1 2 3'))
+        self.assertIsNotNone(self.route(''))
+        self.assertEqual(self.calls, [])
+
+    def test_register_validates_handler(self):
+        '''Handlers that can't take the command's arguments are rejected up front'''
+        with self.assertRaises(ValueError):
+            router.register('one <a> <b>', 'Too many required', lambda a: None)
+        with self.assertRaises(ValueError):
+            router.register('two [a]', 'Argument without a default', lambda a: None)
+        with self.assertRaises(ValueError):
+            router.register('echo <a>', 'Already registered', lambda a: None)
+        with self.assertRaises(ValueError):
+            router.register('four [a]', 'Keyword-only argument', lambda *, a: None)
+        router.register('three [a] [b]', 'Takes anything', lambda *args: None)
+        router.register('five <a>', 'Bound method', self.echo)
+
+    def test_lazy_handlers_are_checked_when_resolved(self):
+        '''Lazy handlers are checked once resolved, when their command is first run'''
+        def lazy(handler):
+            def call(*args):
+                return handler(*args)
+            call.resolve = lambda: handler
+            return call
+
+        router.register('six <a> <b>', 'Too many required', lazy(lambda a: None))
+        with self.assertRaises(ValueError):
+            self.route('six 1 2')
+        router.register('seven <a>', 'Resolved once', lazy(self.echo))
+        self.assertIsNone(self.route('seven 1'))
+        self.assertEqual(router.handlers['seven']['handler'], self.echo)
+        self.assertEqual(self.calls, [('1', None)])
+
+    def test_help_keeps_order(self):
+        '''Help lists headers and commands in registration order'''
+        self.assertEqual([comm['command'] for comm in router.commands],
+                         ['header', 'echo <first> [second]', 'separator'])
+        self.assertEqual(list(router.handlers), ['echo'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+'''
+File: test_rules.py
+
+Defines unit tests for rules.py.
+'''
+
+import io
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from oink import accounts, category, db, importer, migrations, rules
+
+
+class TestRules(unittest.TestCase):
+    '''Defines unit tests for categorizing transactions by rules.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+        accounts.add_account('1001', 'Checking', 0)
+        for name in ('Shopping', 'Entertainment', 'Rent', 'Coffee'):
+            category.create(name)
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def test_first_matching_rule_wins(self):
+        '''Rules are tried in order, by text, regex and amount'''
+        rules.create(2, rules.CONTAINS, 'netflix')
+        rules.create(4, rules.REGEX, r'^(starbucks|peet)')
+        rules.create(1, rules.CONTAINS, 'amazon', max_amount=10000)
+        rules.create(3, rules.AMOUNT, min_amount=100000)
+        rules.create(1, rules.CONTAINS, 'prime', min_amount=500, max_amount=1500)
+        match = rules.matcher().match
+
+        self.assertEqual(match('NETFLIX.COM 866-579', 1599), 2)
+        self.assertEqual(match('Starbucks #123', 450), 4)
+        self.assertEqual(match('Coffee at Starbucks', 450), None)
+        self.assertEqual(match('Amazon Marketplace', 10000), 1)
+        self.assertEqual(match('Amazon Marketplace', 10001), None)
+        self.assertEqual(match('Netflix annual', 150000), 2)
+        self.assertEqual(match('Landlord', 150000), 3)
+        self.assertEqual(match('Prime Video', 499), None)
+        self.assertEqual(match('Prime Video', 1000), 1)
+        self.assertEqual(match(None, 1000), None)
+
+    def test_overlapping_texts(self):
+        '''Texts inside, overlapping and sharing prefixes with others are all found'''
+        for category_id, text in ((1, 'her'), (2, 'she'), (3, 'shell'), (4, 'he')):
+            rules.create(category_id, rules.CONTAINS, text)
+        match = rules.matcher().match
+        self.assertEqual(match('SHELL OIL', 100), 2)
+        self.assertEqual(match('ushers', 100), 1)
+        self.assertEqual(match('the', 100), 4)
+        self.assertEqual(match('shale', 100), None)
+
+    def test_invalid_rules(self):
+        '''Rules that could never work are refused'''
+        with self.assertRaises(ValueError):
+            rules.create(1, rules.REGEX, '(unclosed')
+        with self.assertRaises(ValueError):
+            rules.create(1, rules.AMOUNT)
+        with self.assertRaises(ValueError):
+            rules.create(1, rules.CONTAINS, 'x', min_amount=10, max_amount=5)
+        with self.assertRaises(ValueError):
+            rules.create(99, rules.CONTAINS, 'x')
+        self.assertEqual(rules.all(), [])
+
+    def test_amount_bounds_are_exact(self):
+        '''Amount bounds are parsed to the cent, as imported amounts are'''
+        for text in ('19.99', '0.29', '1000.10'):
+            self.assertEqual(rules._amount(text), -importer._parse_amount('-' + text))
+        with self.assertRaises(ValueError):
+            rules._amount('lots')
+
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertIsNone(rules.add_rule('4', '*', '19.99', '19.99'))
+        match = rules.matcher().match
+        self.assertEqual(match('Anything', importer._parse_amount('19.99')), 4)
+        self.assertEqual(match('Anything', 1998), None)
+
+    def test_recategorize(self):
+        '''Only uncategorized transactions that a rule matches are categorized'''
+        rows = [('Netflix', None), ('Netflix', 3), ('Groceries', None)] * 1500
+        db.cursor().executemany('INSERT INTO transactions (account_id, transaction_type_id, \
+            description, amount, category_id, created_at) VALUES (1, 1, ?, 1599, ?, "2018-06-01")', rows)
+        db.commit()
+        rules.create(2, rules.CONTAINS, 'netflix')
+
+        self.assertEqual(rules.recategorize(), 1500)
+        counts = db.cursor().execute('SELECT category_id, COUNT(*) FROM transactions \
+            GROUP BY category_id ORDER BY category_id').fetchall()
+        self.assertEqual(counts, [(None, 1500), (2, 1500), (3, 1500)])
+        self.assertEqual(rules.recategorize(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
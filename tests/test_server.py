@@ -0,0 +1,124 @@
+'''
+File: test_server.py
+
+Defines unit tests for server.py.
+'''
+
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from oink import accounts, db, migrations, server, transactions
+
+
+class TestServer(unittest.TestCase):
+    '''Defines unit tests for the JSON-RPC daemon.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+        accounts.add_account('1001', 'Checking', 10000)
+        server.cache.clear()
+
+        stdout = mock.patch('sys.stdout', new_callable=io.StringIO)
+        stdout.start()
+        self.addCleanup(stdout.stop)
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def rpc(self, method, params=None, request_id=1):
+        request = {'jsonrpc': '2.0', 'id': request_id, 'method': method}
+        if params is not None:
+            request['params'] = params
+        return json.loads(server.handle_line(json.dumps(request)))
+
+    def test_accounts(self):
+        '''Accounts are listed with atomic balances'''
+        response = self.rpc('accounts.list')
+        self.assertEqual(response['id'], 1)
+        self.assertEqual([(acct['name'], acct['balance']) for acct in response['result']],
+                         [('Checking', 10000)])
+        self.assertEqual(self.rpc('accounts.get', {'account_id': 1})['result']['name'], 'Checking')
+        self.assertEqual(self.rpc('accounts.get', [2])['error']['code'], server.LEDGER_ERROR)
+
+    def test_create_transaction_invalidates_cache(self):
+        '''Writes go through transactions.create and reads see them straight away'''
+        self.assertEqual(self.rpc('transactions.list')['result']['transactions'], [])
+        response = self.rpc('transactions.create', {'account_id': 1, 'description': 'Rent',
+            'type_id': transactions.WITHDRAWAL_ID, 'amount': 2500})
+        self.assertTrue(response['result'])
+
+        listed = self.rpc('transactions.list', {'account_id': 1})['result']
+        self.assertEqual([trans['description'] for trans in listed['transactions']], ['Rent'])
+        self.assertEqual(self.rpc('accounts.get', [1])['result']['balance'], 7500)
+
+    def test_cache_sees_other_connections(self):
+        '''Changes made by other processes drop cached results'''
+        self.assertEqual(self.rpc('accounts.list')['result'][0]['balance'], 10000)
+        self.assertEqual(len(server.cache), 1)
+
+        other = db.open_connection(self.path)
+        other.execute('UPDATE accounts SET balance = 1 WHERE id = 1')
+        other.commit()
+        other.close()
+
+        self.assertEqual(self.rpc('accounts.list')['result'][0]['balance'], 1)
+
+    def test_errors(self):
+        '''Malformed requests get JSON-RPC errors'''
+        self.assertEqual(json.loads(server.handle_line('{nope'))['error']['code'], server.PARSE_ERROR)
+        self.assertEqual(json.loads(server.handle_line('[]'))['error']['code'], server.INVALID_REQUEST)
+        self.assertEqual(self.rpc('accounts.drop')['error']['code'], server.METHOD_NOT_FOUND)
+        self.assertEqual(self.rpc('accounts.get', {'id': 1})['error']['code'], server.INVALID_PARAMS)
+        for size in (0, -1, '10', 2.5, True):
+            response = self.rpc('transactions.list', {'size': size})
+            self.assertEqual(response['error']['code'], server.INVALID_PARAMS)
+
+    def test_batch_and_notifications(self):
+        '''Batches get one response per request; notifications get none'''
+        line = json.dumps([
+            {'jsonrpc': '2.0', 'id': 1, 'method': 'accounts.list'},
+            {'jsonrpc': '2.0', 'method': 'accounts.list'},
+            {'jsonrpc': '2.0', 'id': 2, 'method': 'budgets.list', 'params': [6, 2018]},
+        ])
+        self.assertEqual([response['id'] for response in json.loads(server.handle_line(line))], [1, 2])
+        self.assertIsNone(server.handle_line(json.dumps({'jsonrpc': '2.0', 'method': 'accounts.list'})))
+
+    def test_unix_socket(self):
+        '''Clients talk to the daemon over a Unix socket, one line per request'''
+        path = os.path.join(self.path, 'oink.sock')
+
+        async def session():
+            listener = await server.start(path)
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(b'{"jsonrpc": "2.0", "id": 7, "method": "accounts.list"}\n')
+            response = json.loads(await reader.readline())
+            writer.close()
+            await writer.wait_closed()
+            await asyncio.sleep(0.01)  # Lets the daemon see the client hang up
+            listener.close()
+            await listener.wait_closed()
+            return response
+
+        loop = asyncio.new_event_loop()
+        try:
+            response = loop.run_until_complete(session())
+        finally:
+            loop.close()
+        self.assertEqual(response['id'], 7)
+        self.assertEqual(response['result'][0]['name'], 'Checking')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+'''
+File: test_totals.py
+
+Defines unit tests for totals.py.
+'''
+
+import shutil
+import tempfile
+import unittest
+
+from oink import accounts, category, db, migrations, totals, transactions
+
+
+class TestMonthlyTotals(unittest.TestCase):
+    '''Defines unit tests for the monthly totals of transactions.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+
+        accounts.add_account('1001', 'Checking', 100000)
+        accounts.add_account('1002', 'Savings', 50000)
+        category.create('Food')
+        category.create('Rent')
+
+        # (account, type, amount, category, created_at)
+        rows = [
+            (1, transactions.WITHDRAWAL_ID, 2500, 1, '2018-06-01 09:00:00'),
+            (1, transactions.WITHDRAWAL_ID, 1000, 1, '2018-06-30 23:59:59'),
+            (1, transactions.DEPOSIT_ID, 300, 1, '2018-06-15 12:00:00'),
+            (1, transactions.WITHDRAWAL_ID, 80000, 2, '2018-07-02 10:00:00'),
+            (2, transactions.WITHDRAWAL_ID, 700, None, '2018-06-03 10:00:00'),
+        ]
+        db.cursor().executemany('INSERT INTO transactions (account_id, transaction_type_id, \
+            amount, category_id, created_at) VALUES (?, ?, ?, ?, ?)', rows)
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def monthly_totals(self):
+        '''Every monthly total, as (account, year, month, category, type, total, count)'''
+        return db.cursor().execute('SELECT * FROM monthly_totals ORDER BY 1, 2, 3, 4, 5').fetchall()
+
+    def test_inserts_are_totalled(self):
+        '''New transactions add to the total of their month and category'''
+        self.assertEqual(self.monthly_totals(), [
+            (1, 2018, 6, 1, transactions.DEPOSIT_ID, 300, 1),
+            (1, 2018, 6, 1, transactions.WITHDRAWAL_ID, 3500, 2),
+            (1, 2018, 7, 2, transactions.WITHDRAWAL_ID, 80000, 1),
+            (2, 2018, 6, 0, transactions.WITHDRAWAL_ID, 700, 1),
+        ])
+        self.assertEqual(totals.verify(), [])
+
+    def test_updates_move_totals(self):
+        '''Editing a transaction moves it between months, categories and accounts'''
+        cur = db.cursor()
+        cur.execute("UPDATE transactions SET created_at = '2018-05-31 08:00:00', category_id = 2 WHERE id = 1")
+        cur.execute('UPDATE transactions SET account_id = 2, amount = 900 WHERE id = 2')
+        cur.execute('UPDATE transactions SET category_id = 1 WHERE id = 5')
+        self.assertEqual(self.monthly_totals(), [
+            (1, 2018, 5, 2, transactions.WITHDRAWAL_ID, 2500, 1),
+            (1, 2018, 6, 1, transactions.DEPOSIT_ID, 300, 1),
+            (1, 2018, 7, 2, transactions.WITHDRAWAL_ID, 80000, 1),
+            (2, 2018, 6, 1, transactions.WITHDRAWAL_ID, 1600, 2),
+        ])
+        self.assertEqual(totals.verify(), [])
+
+    def test_deletes_remove_empty_totals(self):
+        '''Deleting the last transaction of a total removes it'''
+        cur = db.cursor()
+        cur.execute('DELETE FROM transactions WHERE id IN (1, 3, 4)')
+        self.assertEqual(self.monthly_totals(), [
+            (1, 2018, 6, 1, transactions.WITHDRAWAL_ID, 1000, 1),
+            (2, 2018, 6, 0, transactions.WITHDRAWAL_ID, 700, 1),
+        ])
+        self.assertEqual(totals.verify(), [])
+
+    def test_verify_and_rebuild(self):
+        '''Totals out of step with the transactions are found and recomputed'''
+        expected = self.monthly_totals()
+        cur = db.cursor()
+        cur.execute('UPDATE monthly_totals SET total = total + 1 WHERE account_id = 2')
+        cur.execute('DELETE FROM monthly_totals WHERE year = 2018 AND month = 7')
+        self.assertEqual(totals.verify(), [
+            (1, 2018, 7, 2, transactions.WITHDRAWAL_ID),
+            (2, 2018, 6, 0, transactions.WITHDRAWAL_ID),
+        ])
+
+        totals.rebuild()
+        self.assertEqual(self.monthly_totals(), expected)
+        self.assertEqual(totals.verify(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+'''
+File: test_transactions.py
+
+Defines unit tests for transactions.py.
+'''
+
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from oink import accounts, category, db, migrations, transactions
+
+
+class TestTransactions(unittest.TestCase):
+    '''Defines unit tests for recording transactions against accounts.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+        accounts.add_account('1001', 'Checking', 10000)
+        accounts.add_account('1002', 'Savings', 0)
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def test_create_posts_to_balance(self):
+        '''Deposits and withdrawals adjust the account balance'''
+        self.assertTrue(transactions.create(1, 'Paycheck', transactions.DEPOSIT_ID, 5000))
+        self.assertTrue(transactions.create(1, 'Rent', transactions.WITHDRAWAL_ID, 7000))
+        self.assertEqual(accounts.get_balance(1), 10000 + 5000 - 7000)
+
+    def test_create_posts_with_single_update(self):
+        '''The balance is updated in SQL without reading it back first'''
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+        transactions.create(1, 'Paycheck', transactions.DEPOSIT_ID, 5000)
+        db.conn.set_trace_callback(None)
+
+        self.assertFalse([sql for sql in statements if sql.startswith('SELECT')])
+        self.assertEqual(len([sql for sql in statements if sql.startswith('UPDATE')]), 1)
+
+    def test_edit_swaps_transaction_effect(self):
+        '''Editing the type and amount replaces the old effect on the balance'''
+        transactions.create(1, 'Rent', transactions.WITHDRAWAL_ID, 7000)
+        self.assertTrue(transactions._edit_transaction(1, type_id=transactions.DEPOSIT_ID, amount=2500))
+        self.assertEqual(accounts.get_balance(1), 10000 + 2500)
+
+        self.assertTrue(transactions._edit_transaction(1, description='Refund'))
+        self.assertEqual(accounts.get_balance(1), 10000 + 2500)
+
+    def test_transaction_block_rolls_back(self):
+        '''A failed transaction block leaves neither the record nor the posting'''
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                transactions.create(1, 'Transfer out', transactions.WITHDRAWAL_ID, 1000)
+                raise RuntimeError('interrupted')
+
+        count = db.cursor().execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+        self.assertEqual(count, 0)
+        self.assertEqual(accounts.get_balance(1), 10000)
+
+
+class TestPagination(unittest.TestCase):
+    '''Defines unit tests for keyset pagination of transaction listings.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+        accounts.add_account('1001', 'Checking', 0)
+        accounts.add_account('1002', 'Savings', 0)
+
+        # Several transactions share a timestamp, so ids break the ties,
+        # and they span several months
+        rows = [(i % 2 + 1, transactions.DEPOSIT_ID, 'T{}'.format(i), i,
+                 '2018-{:02d}-{:02d} 12:00:00'.format(i // 9 + 1, i // 3 % 3 + 1)) for i in range(50)]
+        db.cursor().executemany('INSERT INTO transactions (account_id, transaction_type_id, \
+            description, amount, created_at) VALUES (?, ?, ?, ?, ?)', rows)
+        db.commit()
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def walk(self, account_id=None, size=7, balance=False):
+        pages = [transactions.page(account_id, size, balance=balance)]
+        while True:
+            older = transactions.page(account_id, size, before=transactions._key(pages[-1][-1]), balance=balance)
+            if not older:
+                return pages
+            pages.append(older)
+
+    def test_pages_cover_every_transaction_in_order(self):
+        '''Walking the pages lists every transaction once, newest first'''
+        ids = [row[0] for pg in self.walk() for row in pg]
+        expected = db.cursor().execute('SELECT id FROM transactions \
+            ORDER BY created_at DESC, id DESC').fetchall()
+        self.assertEqual(ids, [row[0] for row in expected])
+
+    def test_pages_for_an_account(self):
+        '''Pages of an account only contain its transactions'''
+        pages = self.walk(account_id=2)
+        self.assertEqual(sum(len(pg) for pg in pages), 25)
+        self.assertEqual({row[1] for pg in pages for row in pg}, {'Savings'})
+
+    def test_previous_page(self):
+        '''Paging back from a page returns the page before it'''
+        pages = self.walk()
+        for previous, current in zip(pages, pages[1:]):
+            self.assertEqual(transactions.page(None, 7, after=transactions._key(current[0])), previous)
+
+    def test_list_all_without_prompting(self):
+        '''Listing every transaction streams all the pages without asking anything'''
+        printed = []
+        with mock.patch.object(transactions, 'LIST_ALL_PAGE_SIZE', 7), \
+                mock.patch.object(transactions, '_print_rows', printed.append), \
+                mock.patch('builtins.input', side_effect=AssertionError('prompted')):
+            self.assertIsNone(transactions.list_transactions(2, '*'))
+            self.assertIsNone(transactions.list_transactions('*', '*'))
+        self.assertEqual(printed[:4], self.walk(account_id=2))
+        self.assertEqual(printed[4:], self.walk())
+
+    def test_running_balance(self):
+        '''Each row ends with the balance of its account after the transaction'''
+        db.cursor().execute('UPDATE accounts SET balance = 500 + \
+            (SELECT SUM(amount) FROM transactions WHERE account_id = accounts.id)')
+        rows = db.cursor().execute('SELECT id, account_id, amount FROM transactions \
+            ORDER BY created_at, id').fetchall()
+        expected = {}
+        balances = {1: 500, 2: 500}
+        for trans_id, account_id, amount in rows:
+            balances[account_id] += amount
+            expected[trans_id] = balances[account_id]
+
+        for account_id in (None, 2):
+            pages = self.walk(account_id, balance=True)
+            self.assertEqual({row[0]: row[8] for pg in pages for row in pg},
+                {trans_id: bal for trans_id, bal in expected.items()
+                 if account_id is None or trans_id in {row[0] for row in rows if row[1] == account_id}})
+        self.assertEqual(transactions.page(2, 7, after=transactions._key(pages[1][0]), balance=True), pages[0])
+
+
+class TestSearch(unittest.TestCase):
+    '''Defines unit tests for searching transaction descriptions.'''
+
+    def setUp(self):
+        '''Setup testing database.'''
+        self.path = tempfile.mkdtemp()
+        db.connect(self.path)
+        migrations.migrate()
+        accounts.add_account('1001', 'Checking', 0)
+        accounts.add_account('1002', 'Savings', 0)
+        category.create('Shopping')
+
+        rows = [
+            (1, 'AMAZON Marketplace', 1, '2017-12-30 10:00:00'),
+            (1, 'Amazon Prime', None, '2018-03-01 10:00:00'),
+            (2, 'amazon gift card', 1, '2018-06-01 10:00:00'),
+            (1, 'Café on Main', None, '2018-06-02 10:00:00'),
+            (1, 'Rent', None, '2018-07-01 10:00:00'),
+        ]
+        db.cursor().executemany('INSERT INTO transactions (account_id, transaction_type_id, \
+            description, amount, category_id, created_at) VALUES (?, 1, ?, 100, ?, ?)', rows)
+        db.commit()
+
+    def tearDown(self):
+        '''Destroys the testing database.'''
+        db.disconnect()
+        shutil.rmtree(self.path)
+
+    def find(self, query, *args):
+        match, filters = transactions.parse_search(query)
+        rows = transactions.search(match, *args, account=filters.get('account'), category=filters.get('category'))
+        return sorted(row[0] for row in rows)
+
+    def test_words_and_prefixes(self):
+        '''Words match in any case and order; a trailing * matches a prefix'''
+        self.assertEqual(self.find('amazon'), [1, 2, 3])
+        self.assertEqual(self.find('prime AMAZON'), [2])
+        self.assertEqual(self.find('ama*'), [1, 2, 3])
+        self.assertEqual(self.find('cafe'), [4])
+        self.assertEqual(self.find('amazon OR rent'), [])  # Taken literally, not as FTS5 syntax
+
+    def test_dates_and_filters(self):
+        '''Searches can be narrowed by date, account and category'''
+        self.assertEqual(self.find('amazon', '2018-01-01', '2018-12-31'), [2, 3])
+        self.assertEqual(self.find('amazon account:Savings'), [3])
+        self.assertEqual(self.find('amazon account:1'), [1, 2])
+        self.assertEqual(self.find('amazon category:shopping'), [])
+        self.assertEqual(self.find('amazon category:Shopping'), [1, 3])
+        self.assertEqual(self.find('amazon category:none'), [2])
+
+    def test_index_follows_changes(self):
+        '''Edited and deleted transactions are found by their current description'''
+        transactions._edit_transaction(5, description='Rent for July')
+        self.assertEqual(self.find('july'), [5])
+        db.cursor().execute('DELETE FROM transactions WHERE id = 2')
+        self.assertEqual(self.find('amazon'), [1, 3])
+
+    def test_deferred_index(self):
+        '''Bulk inserts are indexed at the end of the block'''
+        with db.transaction(), transactions.deferred_search_index():
+            transactions.create(2, 'Amazon refund', transactions.DEPOSIT_ID, 100)
+            self.assertEqual(self.find('refund'), [])
+        self.assertEqual(self.find('refund'), [6])
+        transactions.create(2, 'Another refund', transactions.DEPOSIT_ID, 100)
+        self.assertEqual(self.find('refund'), [6, 7])
+
+
+if __name__ == '__main__':
+    unittest.main()